@@ -0,0 +1,92 @@
+import json
+import os
+import signal
+import threading
+import time
+
+
+ADMIN_ROLE = 'admin'
+
+
+# Список админов держится в памяти как frozenset. Файл и таблица roles
+# перечитываются фоновым потоком (по изменению mtime файла и раз в
+# db_refresh_interval для БД) или по SIGHUP, поэтому проверка роли на
+# горячем пути - одна операция со множеством без обращений к диску.
+class AdminRegistry:
+    def __init__(self, path, db_manager=None, check_interval=5, db_refresh_interval=60):
+        self.path = os.path.abspath(path)
+        self.db_manager = db_manager
+        self.check_interval = check_interval
+        self.db_refresh_interval = db_refresh_interval
+        self.admin_ids = frozenset()
+        self.file_admin_ids = frozenset()
+        self.db_admin_ids = frozenset()
+        self.file_mtime = None
+        self.db_loaded_at = 0
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+
+        self.reload(force=True)
+        self.watcher = threading.Thread(target=self.watch, name='admin-registry', daemon=True)
+        self.watcher.start()
+        self.install_signal_handler()
+
+    def is_admin(self, user_id):
+        """Проверка, что пользователь - админ"""
+        return str(user_id) in self.admin_ids
+
+    def reload(self, force=False):
+        """Перечитывание файла (если изменился) и таблицы roles (если пора)"""
+        with self.lock:
+            changed = self._reload_file(force)
+            if self.db_manager and (force or time.monotonic() - self.db_loaded_at >= self.db_refresh_interval):
+                changed = self._reload_db() or changed
+            if changed:
+                self.admin_ids = self.file_admin_ids | self.db_admin_ids
+
+    def _reload_file(self, force):
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError as e:
+            print(f"❌ Файл админов недоступен: {e}")
+            return False
+        if not force and mtime == self.file_mtime:
+            return False
+
+        try:
+            with open(self.path, 'r') as file:
+                data = json.load(file)
+        except (OSError, ValueError) as e:
+            # Битый файл при редактировании - оставляем прошлый список
+            print(f"❌ Ошибка чтения файла админов: {e}")
+            return False
+
+        self.file_mtime = mtime
+        self.file_admin_ids = frozenset(str(admin_id) for admin_id in data.get('admin_ids', []))
+        return True
+
+    def _reload_db(self):
+        self.db_loaded_at = time.monotonic()
+        try:
+            admin_ids = frozenset(str(telegram_id) for telegram_id in self.db_manager.get_role_telegram_ids(ADMIN_ROLE))
+        except Exception as e:
+            print(f"❌ Ошибка загрузки ролей из БД: {e}")
+            return False
+        changed = admin_ids != self.db_admin_ids
+        self.db_admin_ids = admin_ids
+        return changed
+
+    def watch(self):
+        while not self.stop_event.wait(self.check_interval):
+            self.reload()
+
+    def install_signal_handler(self):
+        """kill -HUP <pid> - немедленное перечитывание списка админов"""
+        if not hasattr(signal, 'SIGHUP') or threading.current_thread() is not threading.main_thread():
+            return
+        signal.signal(signal.SIGHUP, lambda signum, frame: threading.Thread(
+            target=self.reload, kwargs={'force': True}, daemon=True
+        ).start())
+
+    def stop(self):
+        self.stop_event.set()
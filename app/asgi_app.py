@@ -0,0 +1,265 @@
+import base64
+import json
+import mimetypes
+import os
+from contextlib import asynccontextmanager
+import anyio # type: ignore
+import uvicorn # type: ignore
+from asgiref.wsgi import WsgiToAsgi # type: ignore
+from starlette.applications import Starlette # type: ignore
+from starlette.middleware import Middleware # type: ignore
+from starlette.middleware.gzip import GZipMiddleware # type: ignore
+from starlette.concurrency import iterate_in_threadpool # type: ignore
+from starlette.responses import FileResponse, JSONResponse, Response, StreamingResponse # type: ignore
+from starlette.routing import Mount, Route # type: ignore
+from werkzeug.http import http_date
+from dotenv import load_dotenv
+from async_database_manager import AsyncDatabaseManager
+import pagination
+from image_variants import ImageVariantProcessor, VARIANT_SIZES
+from photo_storage import parse_range, iter_chunks
+from response_layer import dumps, etag_matches, COMPRESS_MIN_SIZE, GZIP_LEVEL
+from instrumentation import add_io_bytes, measure, traced
+from web_app import WebApplication, PHOTO_CACHE_MAX_AGE
+
+
+load_dotenv()
+
+
+class FlaskCompatibleJSONResponse(JSONResponse):
+    def render(self, content):
+        return dumps(content)
+
+
+# Горячие GET-запросы обслуживаются асинхронно, остальное - Flask через WSGI-мост.
+# WsgiToAsgi дочитывает тело запроса в event loop (во временный файл) и только
+# потом отдает его Flask в поток, поэтому медленная загрузка фото не держит поток
+# и не мешает запросам карты. Загрузка, изменение, пакет и импорт меток остаются
+# в Flask: их транзакции (метка, кластеры, статистика, фото) живут в DatabaseManager.
+class AsyncWebApplication:
+    def __init__(self):
+        self.web_app = WebApplication()
+        self.db_manager = AsyncDatabaseManager()
+        self.photo_storage = self.web_app.photo_storage
+        routes = [
+            Route('/api/get_marks/{user_telegram_id:int}', traced('get_marks', self.get_marks), methods=['GET']),
+            Route('/api/get_mark/{mark_id:int}', traced('get_mark_details', self.get_mark_details), methods=['GET']),
+            Route('/upload/{filename:path}', traced('get_photo', self.get_photo), methods=['GET', 'HEAD'])
+        ]
+        # В режиме webhook бот работает в каждом воркере и принимает свою долю обновлений
+        self.telegram_webhook = None
+        if os.getenv('BOT_MODE', 'polling') == 'webhook':
+            import bot
+            from telegram_webhook import TelegramWebhook
+
+            self.telegram_webhook = TelegramWebhook(bot.build_application(webhook=True), bot.WEBHOOK_SECRET)
+            routes += [
+                Route(bot.WEBHOOK_PATH, traced('telegram_webhook', self.telegram_webhook.handle), methods=['POST']),
+                Route('/api/webhook_stats', self.telegram_webhook.stats, methods=['GET'])
+            ]
+        self.app = Starlette(
+            routes=routes + [Mount('/', app=WsgiToAsgi(self.web_app.app))],
+            # Ответы Flask уже сжаты (br/gzip) и проходят как есть, фото не сжимаются
+            middleware=[Middleware(GZipMiddleware, minimum_size=COMPRESS_MIN_SIZE, compresslevel=GZIP_LEVEL)],
+            lifespan=self.lifespan
+        )
+
+    @asynccontextmanager
+    async def lifespan(self, app):
+        await self.db_manager.init_pool(
+            min_conn=int(os.getenv('ASYNC_DB_POOL_MIN', '1')),
+            max_conn=int(os.getenv('ASYNC_DB_POOL_MAX', '10'))
+        )
+        if self.telegram_webhook:
+            await self.telegram_webhook.start()
+        yield
+        if self.telegram_webhook:
+            await self.telegram_webhook.stop()
+        await self.db_manager.close_pool()
+
+    async def get_marks(self, request):
+        """GET - получение списка меток: ?fields=id,lat,lon,title&limit=200&cursor=..."""
+        try:
+            fields = pagination.parse_fields(request.query_params.get('fields'))
+            after = pagination.decode_cursor(request.query_params.get('cursor'))
+            limit = pagination.parse_limit(request.query_params.get('limit'), after)
+        except ValueError as e:
+            return FlaskCompatibleJSONResponse({'success': False, 'message': str(e)}, status_code=400)
+
+        user_telegram_id = request.path_params['user_telegram_id']
+        user = await self.db_manager.get_or_create_user(user_telegram_id)
+        if not user:
+            return FlaskCompatibleJSONResponse({'error': 'Ошибка при создании пользователя'}, status_code=404)
+
+        # Версию читаем до списка, как и во Flask: значение ETag у обоих серверов
+        # одно, Flask лишь помечает его слабым при сжатии - сравнение слабое
+        version = await self.db_manager.get_marks_version(user['id'])
+        etag = pagination.marks_etag(user['id'], version, request.url.path, request.url.query)
+        headers = {'ETag': f'"{etag}"', 'Cache-Control': 'private, no-cache'}
+        if etag_matches(request.headers.get('if-none-match'), headers['ETag']):
+            return Response(status_code=304, headers=headers)
+
+        marks, last = await self.db_manager.get_user_marks_page(user['id'], fields, limit, after)
+        return FlaskCompatibleJSONResponse({
+            'success': True,
+            'marks': marks,
+            'user_id': user['id'],
+            'version': version,
+            'next_cursor': pagination.encode_cursor(*last) if last else None
+        }, headers=headers)
+
+    async def get_mark_details(self, request):
+        """Получение полной информации о метке"""
+        try:
+            mark = await self.db_manager.get_mark_with_photos(request.path_params['mark_id'])
+            if not mark:
+                return FlaskCompatibleJSONResponse({'success': False, 'message': 'Место не найдено'}, status_code=404)
+
+            as_url = request.query_params.get('photos') == 'url'
+            width = request.query_params.get('width')
+            width = int(width) if width and width.isdigit() else None
+            size = request.query_params.get('size')
+            if size not in VARIANT_SIZES:
+                size = None
+
+            mark_data = {
+                'title': mark['title'],
+                'description': mark['description'] or '',
+                'visit_date': mark['visit_date'].strftime('%Y-%m-%d'),
+                'address': mark['address']
+            }
+
+            if mark['main_filename']:
+                variants = json.loads(mark['main_variants'])
+                filename = await self.pick_photo_filename(mark['main_filename'], variants, width, size)
+                photo_data = await self.get_photo_data(filename, as_url)
+                if photo_data:
+                    mark_data['main_photo'] = photo_data
+
+            photos = json.loads(mark['photos'])
+            if photos:
+                mark_data['photos'] = []
+                for photo in photos:
+                    filename = await self.pick_photo_filename(photo['filename'], photo['variants'], width, size)
+                    photo_data = await self.get_photo_data(filename, as_url)
+                    if photo_data:
+                        mark_data['photos'].append(photo_data)
+
+            return FlaskCompatibleJSONResponse({'success': True, 'mark': mark_data})
+
+        except Exception as e:
+            return FlaskCompatibleJSONResponse({'success': False, 'message': str(e)}, status_code=500)
+
+    async def pick_photo_filename(self, filename, variants, width=None, size=None):
+        """Имя файла подходящего размера, оригинал - если варианты еще не готовы"""
+        variant_filename = ImageVariantProcessor.choose_variant(variants, width, size)
+        if variant_filename and await anyio.to_thread.run_sync(self.photo_storage.exists, variant_filename):
+            return variant_filename
+        return filename
+
+    async def get_photo_data(self, filename, as_url=False):
+        """Ссылка на фото или data URI с base64, хранилище читается вне event loop"""
+        if not await anyio.to_thread.run_sync(self.photo_storage.exists, filename):
+            return None
+
+        if as_url:
+            return f"/upload/{filename}"
+
+        with measure('io'):
+            image_data = await anyio.to_thread.run_sync(
+                lambda: b''.join(iter_chunks(self.photo_storage.open(filename)))
+            )
+        add_io_bytes(len(image_data))
+        with measure('serialize'):
+            base64_image = base64.b64encode(image_data).decode('utf-8')
+        mime_type = mimetypes.guess_type(filename)[0] or 'image/jpeg'
+        return f"data:{mime_type};base64,{base64_image}"
+
+    async def get_photo(self, request):
+        """GET - асинхронная отдача фото из хранилища (ETag, Last-Modified, Range)"""
+        filename = request.path_params['filename']
+        try:
+            file_path = await anyio.to_thread.run_sync(self.photo_storage.local_path, filename)
+            if file_path:
+                stat_result = await anyio.to_thread.run_sync(os.stat, file_path)
+                response = FileResponse(
+                    file_path,
+                    stat_result=stat_result,
+                    headers={'Cache-Control': f'public, max-age={PHOTO_CACHE_MAX_AGE}'}
+                )
+                etag = response.headers['etag']
+            else:
+                stat = await anyio.to_thread.run_sync(self.photo_storage.stat, filename)
+                response = None
+                etag = f'"{stat.etag}"' if stat else None
+        except ValueError:
+            etag = None
+        if etag is None:
+            return Response(status_code=404)
+
+        # Повторное открытие метки: браузер проверяет кеш, файл не читаем
+        headers = {'ETag': etag, 'Cache-Control': f'public, max-age={PHOTO_CACHE_MAX_AGE}'}
+        if etag_matches(request.headers.get('if-none-match'), etag):
+            return Response(status_code=304, headers=headers)
+        if response is not None:
+            return response
+
+        # Удаленное хранилище: поток кусками через пул потоков
+        headers['Last-Modified'] = http_date(stat.mtime)
+        headers['Accept-Ranges'] = 'bytes'
+        status_code = 200
+        start, end = 0, stat.size - 1
+        byte_range = parse_range(request.headers.get('range'), stat.size)
+        if byte_range:
+            start, end = byte_range
+            status_code = 206
+            headers['Content-Range'] = f"bytes {start}-{end}/{stat.size}"
+        headers['Content-Length'] = str(end - start + 1)
+        media_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        if request.method == 'HEAD':
+            return Response(status_code=status_code, headers=headers, media_type=media_type)
+
+        stream = await anyio.to_thread.run_sync(self.photo_storage.open, filename, start, end)
+        return StreamingResponse(
+            iterate_in_threadpool(iter_chunks(stream, end - start + 1)),
+            status_code=status_code,
+            headers=headers,
+            media_type=media_type
+        )
+
+
+def create_app():
+    """Фабрика ASGI-приложения, вызывается в каждом воркере uvicorn"""
+    return AsyncWebApplication().app
+
+
+def main():
+    """Запуск ASGI сервера отдельным процессом с несколькими воркерами"""
+    # Как у веб-процесса supervisor.py: сборщик файлов и обработка фото - в
+    # job_worker.py, а не по потоку и пулу в каждом воркере uvicorn
+    os.environ.setdefault('PHOTO_GC_ENABLED', '0')
+    os.environ.setdefault('IMAGE_PROCESSING', 'queue')
+    if os.environ['IMAGE_PROCESSING'] == 'queue':
+        print("⚠️ Размеры фото и сборку файлов выполняет job_worker.py - запустите его или supervisor.py")
+
+    # Схему готовим здесь один раз: воркеры uvicorn только подключаются к базе
+    if os.getenv('DB_BOOTSTRAP', '1') == '1':
+        from supervisor import Supervisor
+
+        if not Supervisor.prepare_database():
+            print("❌ База данных недоступна, сервер не запущен")
+            raise SystemExit(1)
+        os.environ['DB_BOOTSTRAP'] = '0'
+
+    uvicorn.run(
+        'asgi_app:create_app',
+        factory=True,
+        host=os.getenv('WEB_HOST', '0.0.0.0'),
+        port=int(os.getenv('WEB_PORT', '5000')),
+        workers=int(os.getenv('WEB_WORKERS', str(os.cpu_count() or 1))),
+        log_level=os.getenv('WEB_LOG_LEVEL', 'info')
+    )
+
+
+if __name__ == '__main__':
+    main()
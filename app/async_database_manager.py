@@ -0,0 +1,118 @@
+import asyncpg # type: ignore
+import os
+import time
+from dotenv import load_dotenv
+from instrumentation import record_query
+import pagination
+
+
+load_dotenv()
+
+
+class AsyncDatabaseManager:
+    def __init__(self):
+        self.connection_pool = None
+
+    async def init_pool(self, min_conn=1, max_conn=10):
+        """Инициализация asyncpg pool"""
+        try:
+            self.connection_pool = await asyncpg.create_pool(
+                min_size=min_conn,
+                max_size=max_conn,
+                host=os.getenv('DB_HOST', 'localhost'),
+                database=os.getenv('DB_NAME', 'bilodelo'),
+                user=os.getenv('DB_USER', 'postgres'),
+                password=os.getenv('DB_PASSWORD', ''),
+                port=os.getenv('DB_PORT', '5432')
+            )
+            print("✅ Async connection pool инициализирован")
+            return True
+        except Exception as e:
+            print(f"❌ Ошибка инициализации async pool: {e}")
+            return False
+
+    async def close_pool(self):
+        """Закрытие asyncpg pool"""
+        if self.connection_pool:
+            await self.connection_pool.close()
+            self.connection_pool = None
+
+    async def _query(self, method, query, *args):
+        """Запрос через pool.fetch/fetchrow/fetchval с учетом времени для метрик"""
+        started = time.perf_counter()
+        try:
+            return await getattr(self.connection_pool, method)(query, *args)
+        finally:
+            record_query(time.perf_counter() - started, query, args)
+
+    # DAO МЕТОДЫ ДЛЯ ПОЛЬЗОВАТЕЛЕЙ
+    async def get_or_create_user(self, telegram_id):
+        """Получение пользователя по Telegram ID, при отсутствии - создание"""
+        row = await self._query('fetchrow', """
+            WITH created AS (
+                INSERT INTO users (telegram_id) VALUES ($1)
+                ON CONFLICT (telegram_id) DO NOTHING
+                RETURNING id
+            )
+            SELECT id FROM created
+            UNION ALL
+            SELECT id FROM users WHERE telegram_id = $1
+            LIMIT 1;
+        """, telegram_id)
+        if row:
+            return {"id": row["id"]}
+        return None
+
+    async def get_marks_version(self, user_id):
+        """Текущая версия списка меток пользователя (для ETag)"""
+        return await self._query('fetchval', "SELECT marks_version FROM users WHERE id = $1;", user_id)
+
+    # DAO МЕТОДЫ ДЛЯ МЕТОК
+    async def get_user_marks_page(self, user_id, fields=None, limit=None, after=None):
+        """Страница меток пользователя с курсором по (visit_date, created_at, id)"""
+        fields = fields or pagination.MARK_FIELDS
+        query = f"""
+            SELECT {", ".join(fields)}, visit_date AS _visit_date, created_at AS _created_at, id AS _id
+            FROM marks
+            WHERE user_id = $1"""
+        params = [user_id]
+        if after:
+            query += " AND (visit_date, created_at, id) < ($2, $3, $4)"
+            params.extend(after)
+        query += " ORDER BY visit_date DESC, created_at DESC, id DESC"
+        if limit:
+            params.append(limit + 1)
+            query += f" LIMIT ${len(params)}"
+
+        rows = await self._query('fetch', query + ";", *params)
+        has_more = limit is not None and len(rows) > limit
+        if has_more:
+            rows = rows[:limit]
+
+        marks = [{field: row[field] for field in fields} for row in rows]
+        last = (rows[-1]['_visit_date'], rows[-1]['_created_at'], rows[-1]['_id']) if has_more else None
+        return marks, last
+
+    async def get_mark_with_photos(self, mark_id):
+        """Получение метки и ее фото за один запрос"""
+        row = await self._query('fetchrow', """
+            SELECT m.title, m.description, m.visit_date, m.address,
+                   main.filename AS main_filename, main.variants::text AS main_variants,
+                   COALESCE(
+                       (SELECT json_agg(json_build_object('filename', p.filename, 'variants', p.variants)
+                                        ORDER BY p.created_at)
+                        FROM photos p
+                        WHERE p.mark_id = m.id AND p.is_main = FALSE),
+                       '[]'
+                   )::text AS photos
+            FROM marks m
+            LEFT JOIN LATERAL (
+                SELECT filename, variants FROM photos
+                WHERE mark_id = m.id AND is_main = TRUE
+                LIMIT 1
+            ) main ON TRUE
+            WHERE m.id = $1;
+        """, mark_id)
+        if row:
+            return dict(row)
+        return None
@@ -0,0 +1,346 @@
+import argparse
+import hashlib
+import io
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+import httpx # type: ignore
+from instrumentation import METRICS
+from psycopg2.extras import execute_values # type: ignore
+
+
+# Нагрузочный прогон HTTP API на локальном Postgres:
+#   cd app && DB_NAME=bilodelo_bench python benchmark.py --users 20 --marks 500 --photos 2
+# Данные создаются в таблицах из create_tables у пользователей с telegram_id
+# от --telegram-base и удаляются после прогона (если не указан --keep).
+
+# Сборщик фото и внешний геокодер в прогоне не нужны
+os.environ.setdefault('PHOTO_GC_ENABLED', '0')
+os.environ.setdefault('GEOCODER', 'stub')
+
+ENDPOINTS = ('get_marks', 'get_mark', 'create_mark', 'update_mark', 'delete_mark')
+# Имена эндпоинтов Flask, под которыми они учитываются в метриках
+FLASK_ENDPOINTS = {'get_mark': 'get_mark_details'}
+# Центр, вокруг которого разбрасываются метки (Москва), и разброс в градусах
+SEED_CENTER = (55.75, 37.62)
+SEED_SPREAD = 0.5
+DEFAULT_TELEGRAM_BASE = 9_100_000_000
+
+
+def percentile(sorted_values, p):
+    """Перцентиль p (0..100) по отсортированному списку, с интерполяцией"""
+    if not sorted_values:
+        return None
+    position = (len(sorted_values) - 1) * p / 100
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def make_photo(rng, index):
+    """Небольшое JPEG с уникальным содержимым"""
+    from PIL import Image # type: ignore
+
+    image = Image.new('RGB', (640, 480), tuple(rng.randrange(256) for _ in range(3)))
+    # Пара случайных пикселей - чтобы хеш файла отличался от прошлых прогонов
+    for _ in range(16):
+        image.putpixel((rng.randrange(640), rng.randrange(480)), tuple(rng.randrange(256) for _ in range(3)))
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=85)
+    data = buffer.getvalue()
+    return f"{hashlib.sha256(data).hexdigest()}.jpg", data
+
+
+class BenchmarkSeeder:
+    def __init__(self, web_app, users, marks, photos, telegram_base, rng):
+        self.web_app = web_app
+        self.db_manager = web_app.db_manager
+        self.users = users
+        self.marks = marks
+        self.photos = photos
+        self.telegram_base = telegram_base
+        self.rng = rng
+        self.photo_files = []
+
+    def telegram_ids(self):
+        return range(self.telegram_base, self.telegram_base + self.users)
+
+    def seed(self):
+        """Создание пользователей, меток и фото; возвращает {telegram_id: [mark_id]}"""
+        self.cleanup()
+        self.photo_files = [make_photo(self.rng, index) for index in range(self.photos)]
+        for filename, data in self.photo_files:
+            self.web_app.photo_storage.put(filename, io.BytesIO(data))
+
+        state = {}
+        for telegram_id in self.telegram_ids():
+            self.db_manager.create_user(telegram_id)
+            user_id = self.db_manager.get_user_by_telegram_id(telegram_id)['id']
+            self.db_manager.copy_marks(user_id, self.generate_marks())
+            marks, _ = self.db_manager.get_user_marks_page(user_id, ('id',))
+            mark_ids = [mark['id'] for mark in marks]
+            self.add_photos(mark_ids)
+            state[telegram_id] = mark_ids
+        return state
+
+    def generate_marks(self):
+        today = date.today()
+        for index in range(self.marks):
+            yield (
+                f"Метка {index}",
+                ' '.join(self.rng.choice(('море', 'горы', 'город', 'лес', 'река', 'музей')) for _ in range(30)),
+                today - timedelta(days=self.rng.randrange(3 * 365)),
+                f"Тестовая улица, {index}",
+                round(SEED_CENTER[0] + self.rng.uniform(-SEED_SPREAD, SEED_SPREAD), 6),
+                round(SEED_CENTER[1] + self.rng.uniform(-SEED_SPREAD, SEED_SPREAD), 6)
+            )
+
+    def add_photos(self, mark_ids):
+        if not self.photo_files:
+            return
+        rows = [
+            (mark_id, filename, index == 0)
+            for mark_id in mark_ids
+            for index, (filename, _) in enumerate(self.photo_files)
+        ]
+        with self.db_manager.transaction() as cursor:
+            execute_values(cursor, "INSERT INTO photos (mark_id, filename, is_main) VALUES %s;", rows, page_size=1000)
+
+    def cleanup(self):
+        """Удаление пользователей прогона (метки и фото - каскадом) и их файлов"""
+        with self.db_manager.transaction() as cursor:
+            cursor.execute(
+                "SELECT id FROM users WHERE telegram_id >= %s AND telegram_id < %s;",
+                (self.telegram_base, self.telegram_base + self.users)
+            )
+            # Общая статистика не должна помнить метки удаленных пользователей
+            self.db_manager.remove_users_from_mark_stats([row[0] for row in cursor.fetchall()], cursor)
+            cursor.execute(
+                "DELETE FROM users WHERE telegram_id >= %s AND telegram_id < %s;",
+                (self.telegram_base, self.telegram_base + self.users)
+            )
+        self.db_manager.clear_caches()
+        for filename, _ in self.photo_files:
+            self.web_app.photo_gc.delete_files(filename)
+
+
+class BenchmarkRunner:
+    def __init__(self, base_url, state, concurrency, requests, rng, photo=None):
+        self.base_url = base_url
+        self.state = state
+        self.concurrency = concurrency
+        self.requests = requests
+        self.rng = rng
+        self.rng_lock = threading.Lock()
+        self.photo = photo
+        self.client = httpx.Client(base_url=base_url, timeout=60)
+        # Метки, созданные в create_mark, потом удаляет delete_mark
+        self.created = []
+        self.created_lock = threading.Lock()
+
+    def pick_user(self):
+        with self.rng_lock:
+            telegram_id = self.rng.choice(list(self.state))
+            mark_ids = self.state[telegram_id]
+            mark_id = self.rng.choice(mark_ids) if mark_ids else None
+            return telegram_id, mark_id
+
+    def request_get_marks(self, _):
+        telegram_id, _ = self.pick_user()
+        return self.client.get(f"/api/get_marks/{telegram_id}")
+
+    def request_get_mark(self, _):
+        _, mark_id = self.pick_user()
+        return self.client.get(f"/api/get_mark/{mark_id}")
+
+    def request_create_mark(self, index):
+        telegram_id, _ = self.pick_user()
+        data = {
+            'user_telegram_id': telegram_id,
+            'title': f"Новая метка {index}",
+            'description': 'Создана в нагрузочном прогоне',
+            'visit_date': date.today().isoformat(),
+            'lat': SEED_CENTER[0],
+            'lon': SEED_CENTER[1]
+        }
+        files = {'main_photo': ('photo.jpg', self.photo, 'image/jpeg')} if self.photo else None
+        response = self.client.post('/api/create_mark', data=data, files=files)
+        if response.status_code == 200 and response.json().get('success'):
+            with self.created_lock:
+                self.created.append((telegram_id, response.json()['mark']['id']))
+        return response
+
+    def request_update_mark(self, index):
+        telegram_id, mark_id = self.pick_user()
+        with self.rng_lock:
+            lat = round(SEED_CENTER[0] + self.rng.uniform(-SEED_SPREAD, SEED_SPREAD), 6)
+            lon = round(SEED_CENTER[1] + self.rng.uniform(-SEED_SPREAD, SEED_SPREAD), 6)
+        data = {'title': f"Измененная метка {index}", 'description': 'Изменена в нагрузочном прогоне', 'lat': lat, 'lon': lon}
+        return self.client.post(f"/api/update_mark/{telegram_id}/{mark_id}", data=data)
+
+    def request_delete_mark(self, _):
+        with self.created_lock:
+            target = self.created.pop() if self.created else None
+        if target is None:
+            # Созданных меток не осталось - удаляем засеянные
+            with self.rng_lock:
+                telegram_id = self.rng.choice([key for key, value in self.state.items() if value])
+                target = (telegram_id, self.state[telegram_id].pop())
+        return self.client.delete(f"/api/delete_mark/{target[0]}/{target[1]}")
+
+    def run(self, endpoint):
+        """Прогон одного эндпоинта: requests запросов в concurrency потоков"""
+        send = getattr(self, f"request_{endpoint}")
+        latencies = []
+        errors = Counter()
+        lock = threading.Lock()
+
+        def one(index):
+            started = time.perf_counter()
+            try:
+                response = send(index)
+                status = response.status_code
+            except Exception as e:
+                status = type(e).__name__
+            elapsed = (time.perf_counter() - started) * 1000
+            with lock:
+                latencies.append(elapsed)
+                if status != 200:
+                    errors[str(status)] += 1
+
+        flask_endpoint = FLASK_ENDPOINTS.get(endpoint, endpoint)
+        before = METRICS.endpoint_totals(flask_endpoint)
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            list(executor.map(one, range(self.requests)))
+        duration = time.perf_counter() - started
+        # Запросы к БД и время по составляющим - из метрик instrumentation
+        after = METRICS.endpoint_totals(flask_endpoint)
+        served = after['requests'] - before['requests']
+
+        def per_request(key, scale=1):
+            return round((after[key] - before[key]) * scale / served, 2) if served else None
+
+        latencies.sort()
+        return {
+            'endpoint': endpoint,
+            'requests': len(latencies),
+            'errors': dict(errors),
+            'duration_s': round(duration, 3),
+            'rps': round(len(latencies) / duration, 1) if duration else None,
+            'p50_ms': round(percentile(latencies, 50), 2),
+            'p95_ms': round(percentile(latencies, 95), 2),
+            'p99_ms': round(percentile(latencies, 99), 2),
+            'max_ms': round(latencies[-1], 2),
+            'queries_per_request': per_request('db_queries'),
+            'db_ms_per_request': per_request('db_seconds', 1000),
+            'io_ms_per_request': per_request('io_seconds', 1000),
+            'serialize_ms_per_request': per_request('serialize_seconds', 1000)
+        }
+
+
+def print_report(results, baseline=None):
+    baseline = {item['endpoint']: item for item in (baseline or {}).get('results', [])}
+    header = (
+        f"{'endpoint':<12} {'req':>6} {'err':>5} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} "
+        f"{'q/req':>6} {'db ms':>7}"
+    )
+    print(header)
+    print('-' * len(header))
+    for item in results:
+        print(
+            f"{item['endpoint']:<12} {item['requests']:>6} {sum(item['errors'].values()):>5} {item['rps']:>8} "
+            f"{item['p50_ms']:>9} {item['p95_ms']:>9} {item['p99_ms']:>9} "
+            f"{str(item['queries_per_request']):>6} {str(item['db_ms_per_request']):>7}"
+        )
+        before = baseline.get(item['endpoint'])
+        if before:
+            print(
+                f"{'  vs base':<12} {'':>6} {'':>5} {delta(item['rps'], before['rps']):>8} "
+                f"{delta(item['p50_ms'], before['p50_ms']):>9} {delta(item['p95_ms'], before['p95_ms']):>9} "
+                f"{delta(item['p99_ms'], before['p99_ms']):>9} {'':>6}"
+            )
+
+
+def delta(value, before):
+    if not before:
+        return '-'
+    return f"{(value - before) / before * 100:+.0f}%"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон HTTP API на локальном Postgres")
+    parser.add_argument('--users', type=int, default=10, help="сколько пользователей засеять")
+    parser.add_argument('--marks', type=int, default=200, help="меток на пользователя")
+    parser.add_argument('--photos', type=int, default=1, help="фото на метку")
+    parser.add_argument('--concurrency', type=int, default=8, help="параллельных клиентов")
+    parser.add_argument('--requests', type=int, default=200, help="запросов на эндпоинт")
+    parser.add_argument('--endpoints', default=','.join(ENDPOINTS), help="эндпоинты через запятую")
+    parser.add_argument('--seed', type=int, default=1, help="зерно генератора случайных чисел")
+    parser.add_argument('--telegram-base', type=int, default=DEFAULT_TELEGRAM_BASE, help="первый telegram_id прогона")
+    parser.add_argument('--json', help="сохранить результаты в файл")
+    parser.add_argument('--baseline', help="сравнить с результатами прошлого прогона (--json)")
+    parser.add_argument('--keep', action='store_true', help="не удалять засеянные данные")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    endpoints = [endpoint.strip() for endpoint in args.endpoints.split(',') if endpoint.strip()]
+    unknown = set(endpoints) - set(ENDPOINTS)
+    if unknown:
+        raise SystemExit(f"❌ Неизвестные эндпоинты: {', '.join(sorted(unknown))}")
+
+    from werkzeug.serving import make_server
+    from web_app import WebApplication
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    rng = random.Random(args.seed)
+    web_app = WebApplication()
+
+    seeder = BenchmarkSeeder(web_app, args.users, args.marks, args.photos, args.telegram_base, rng)
+    started = time.perf_counter()
+    state = seeder.seed()
+    print(f"✅ Засеяно: {args.users} польз. × {args.marks} меток × {args.photos} фото за {time.perf_counter() - started:.1f} с")
+
+    server = make_server('127.0.0.1', 0, web_app.app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, name='benchmark-server', daemon=True)
+    thread.start()
+
+    photo = seeder.photo_files[0][1] if seeder.photo_files else None
+    runner = BenchmarkRunner(f"http://127.0.0.1:{server.server_port}", state, args.concurrency, args.requests, rng, photo)
+    results = []
+    try:
+        for endpoint in endpoints:
+            results.append(runner.run(endpoint))
+            print(f"✅ {endpoint}: {results[-1]['rps']} rps, p95 {results[-1]['p95_ms']} мс")
+    finally:
+        server.shutdown()
+        if not args.keep:
+            seeder.cleanup()
+            print("✅ Данные прогона удалены")
+
+    report = {
+        'config': {key: value for key, value in vars(args).items() if key not in ('json', 'baseline')},
+        'results': results
+    }
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as file:
+            baseline = json.load(file)
+    print()
+    print_report(results, baseline)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+        print(f"✅ Результаты сохранены в {args.json}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,4 @@
+import asyncio
 import logging
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, WebAppInfo
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes
@@ -18,6 +19,20 @@ load_dotenv()
 # Токен бота от BotFather
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 web_app_url = os.getenv("WEB_APP_URL")
+# thread - Flask в потоке бота (по умолчанию), separate - веб запускается отдельно (asgi_app.py)
+WEB_MODE = os.getenv("WEB_MODE", "thread")
+# polling - long polling в этом процессе, webhook - обновления принимает asgi_app.py
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+# Адрес Bot API; для локальных прогонов - fake_telegram.py
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org")
+# Сколько обновлений обрабатывается одновременно и сколько может ждать в очереди
+BOT_CONCURRENT_UPDATES = int(os.getenv("BOT_CONCURRENT_UPDATES", "64"))
+BOT_UPDATE_QUEUE_SIZE = int(os.getenv("BOT_UPDATE_QUEUE_SIZE", "1000"))
+WEBHOOK_PATH = "/telegram/webhook"
+WEBHOOK_URL = os.getenv("WEBHOOK_URL") or f"{(web_app_url or '').rstrip('/')}{WEBHOOK_PATH}"
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+# Сколько параллельных соединений Telegram открывает к вебхуку (1..100)
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -51,22 +66,67 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     logging.error(f"Exception while handling an update: {context.error}")
 
 
-def main():
-    """Основная функция"""
-    # Запускаем Flask в отдельном потоке
-    app = WebApplication()
-    flask_thread = threading.Thread(target=app.run_flask, daemon=True)
-    flask_thread.start()
-    
-    # Создаем приложение бота
-    application = Application.builder().token(BOT_TOKEN).build()
+def build_application(webhook=False):
+    """Приложение бота с обработчиками
+
+    Обновления обрабатываются параллельно (не больше BOT_CONCURRENT_UPDATES
+    сразу), у HTTP-клиента столько же соединений к Bot API, иначе ответы
+    встанут в очередь на одном соединении. В режиме webhook Updater не нужен:
+    обновления кладет в update_queue обработчик вебхука (telegram_webhook.py).
+    """
+    builder = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .base_url(f"{TELEGRAM_API_URL.rstrip('/')}/bot")
+        .base_file_url(f"{TELEGRAM_API_URL.rstrip('/')}/file/bot")
+        .concurrent_updates(BOT_CONCURRENT_UPDATES)
+        .connection_pool_size(BOT_CONCURRENT_UPDATES)
+    )
+    if webhook:
+        builder = builder.updater(None).update_queue(asyncio.Queue(maxsize=BOT_UPDATE_QUEUE_SIZE))
+    application = builder.build()
     
     # Добавляем обработчики
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CallbackQueryHandler(web_app_data_handler))
+    return application
+
+
+async def register_webhook():
+    """Регистрация WEBHOOK_URL в Telegram; вызывается один раз при деплое"""
+    application = build_application(webhook=True)
+    async with application.bot:
+        await application.bot.set_webhook(
+            url=WEBHOOK_URL,
+            secret_token=WEBHOOK_SECRET,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+            allowed_updates=Update.ALL_TYPES
+        )
+    print(f"✅ Вебхук зарегистрирован: {WEBHOOK_URL}")
+
+
+def main():
+    """Основная функция"""
+    if BOT_MODE == "webhook":
+        # Обновления принимает веб-процесс, здесь только регистрация адреса
+        asyncio.run(register_webhook())
+        print("Бот в режиме webhook! Обновления принимает: python asgi_app.py (BOT_MODE=webhook)")
+        return
+    
+    # Запускаем Flask в отдельном потоке, если веб не вынесен в свой процесс
+    if WEB_MODE == "thread":
+        app = WebApplication()
+        flask_thread = threading.Thread(target=app.run_flask, daemon=True)
+        flask_thread.start()
+    
+    # Создаем приложение бота
+    application = build_application()
     
     # Запускаем бота
-    print("Бот запущен! Flask сервер работает на порту 5000")
+    if WEB_MODE == "thread":
+        print("Бот запущен! Flask сервер работает на порту 5000")
+    else:
+        print("Бот запущен! Веб-сервер запускается отдельно: python asgi_app.py")
     application.run_polling()
 
 
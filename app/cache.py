@@ -0,0 +1,57 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+MISSING = object()
+
+
+class TTLCache:
+    def __init__(self, maxsize=1024, ttl=30):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=MISSING):
+        """Значение из кеша; устаревшие записи считаются промахом"""
+        with self.lock:
+            item = self.items.get(key)
+            if item is not None:
+                expires_at, value = item
+                if expires_at > time.monotonic():
+                    self.items.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self.items[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        """Запись значения, самые старые по обращению записи вытесняются"""
+        with self.lock:
+            self.items[key] = (time.monotonic() + self.ttl, value)
+            self.items.move_to_end(key)
+            while len(self.items) > self.maxsize:
+                self.items.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.items.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+    def stats(self):
+        """Счетчики попаданий и промахов"""
+        with self.lock:
+            return {
+                'size': len(self.items),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses
+            }
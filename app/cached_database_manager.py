@@ -0,0 +1,287 @@
+import itertools
+import os
+import threading
+from contextlib import contextmanager
+from cache import TTLCache, MISSING
+from database_manager import DatabaseManager
+
+
+# Кеш чтений в памяти процесса. Записи через этот класс сбрасывают кеш сразу
+# и еще раз после commit транзакции; изменения из других процессов видны
+# не позже чем через TTL, списки пользователя - не позже чем через
+# CACHE_VERSION_TTL_SECONDS (версия меток кешируется на короткое время).
+class CachedDatabaseManager(DatabaseManager):
+    def __init__(self):
+        super().__init__()
+        ttl = int(os.getenv('CACHE_TTL_SECONDS', '30'))
+        self.users_cache = TTLCache(maxsize=int(os.getenv('CACHE_USERS_SIZE', '10000')), ttl=ttl)
+        self.marks_cache = TTLCache(maxsize=int(os.getenv('CACHE_MARKS_SIZE', '10000')), ttl=ttl)
+        self.lists_cache = TTLCache(maxsize=int(os.getenv('CACHE_LISTS_SIZE', '2000')), ttl=ttl)
+        self.versions_cache = TTLCache(
+            maxsize=int(os.getenv('CACHE_USERS_SIZE', '10000')),
+            ttl=float(os.getenv('CACHE_VERSION_TTL_SECONDS', '1'))
+        )
+        # Поколение списков пользователя входит в ключ: сброс - новое поколение.
+        # Поколения берутся из общего счетчика, поэтому вытесненная запись
+        # дает новое поколение, а не возврат к старым ключам lists_cache
+        generations_size = int(os.getenv('CACHE_GENERATIONS_SIZE', '10000'))
+        self.list_generations = TTLCache(maxsize=generations_size, ttl=ttl)
+        self.seen_versions = TTLCache(maxsize=generations_size, ttl=ttl)
+        self.generation_counter = itertools.count(1)
+        self.generations_lock = threading.Lock()
+        self.after_commit = {}
+
+    @contextmanager
+    def transaction(self):
+        """Транзакция, после commit которой выполняются отложенные сбросы кеша"""
+        with super().transaction() as cursor:
+            self.after_commit[id(cursor)] = []
+            try:
+                yield cursor
+            finally:
+                callbacks = self.after_commit.pop(id(cursor), [])
+        for callback in callbacks:
+            callback()
+
+    def _invalidate(self, callback, cursor=None):
+        callback()
+        if cursor is not None and id(cursor) in self.after_commit:
+            self.after_commit[id(cursor)].append(callback)
+
+    def _list_generation(self, user_id):
+        with self.generations_lock:
+            generation = self.list_generations.get(user_id)
+            if generation is MISSING:
+                generation = self._bump_generation(user_id)
+            return generation
+
+    def _bump_generation(self, user_id):
+        # Вызывается под generations_lock
+        generation = next(self.generation_counter)
+        self.list_generations.set(user_id, generation)
+        return generation
+
+    def invalidate_user_lists(self, user_id, cursor=None):
+        """Сброс всех закешированных списков меток и версии пользователя"""
+        def bump():
+            with self.generations_lock:
+                self._bump_generation(user_id)
+            self.versions_cache.delete(user_id)
+        self._invalidate(bump, cursor)
+
+    def invalidate_mark(self, mark_id, cursor=None):
+        """Сброс закешированной метки с фото"""
+        self._invalidate(lambda: self.marks_cache.delete(mark_id), cursor)
+
+    def clear_caches(self):
+        """Полный сброс кешей, например после удаления данных в обход DAO"""
+        self.users_cache.clear()
+        self.marks_cache.clear()
+        self.lists_cache.clear()
+        self.versions_cache.clear()
+
+    def _cached_list(self, user_id, key, load):
+        key = (user_id, self._list_generation(user_id)) + key
+        value = self.lists_cache.get(key)
+        if value is MISSING:
+            value = load()
+            self.lists_cache.set(key, value)
+        return value
+
+    def cache_stats(self):
+        """Счетчики попаданий и промахов по всем кешам"""
+        return {
+            'users': self.users_cache.stats(),
+            'marks': self.marks_cache.stats(),
+            'lists': self.lists_cache.stats(),
+            'versions': self.versions_cache.stats()
+        }
+
+    # ЧТЕНИЕ ЧЕРЕЗ КЕШ
+    def get_user_by_telegram_id(self, telegram_id, cursor=None):
+        # Внутри транзакции читаем из БД, чтобы видеть свои же изменения
+        if cursor is not None:
+            return super().get_user_by_telegram_id(telegram_id, cursor)
+
+        key = int(telegram_id)
+        user = self.users_cache.get(key)
+        if user is MISSING:
+            user = super().get_user_by_telegram_id(telegram_id)
+            # Отсутствие пользователя не кешируем - его тут же могут создать
+            if user:
+                self.users_cache.set(key, user)
+        return user
+
+    def get_mark_with_photos(self, mark_id):
+        mark = self.marks_cache.get(mark_id)
+        if mark is MISSING:
+            mark = super().get_mark_with_photos(mark_id)
+            if mark:
+                self.marks_cache.set(mark_id, mark)
+        return mark
+
+    def get_user_marks_page(self, user_id, fields=None, limit=None, after=None):
+        return self._cached_list(
+            user_id,
+            ('page', fields, limit, after),
+            lambda: super(CachedDatabaseManager, self).get_user_marks_page(user_id, fields, limit, after)
+        )
+
+    def get_marks_version(self, user_id):
+        # Версия живет в кеше недолго: если ее сменил другой процесс,
+        # списки пользователя в этом процессе сбрасываются раньше TTL
+        version = self.versions_cache.get(user_id)
+        if version is MISSING:
+            version = super().get_marks_version(user_id)
+            self.versions_cache.set(user_id, version)
+            with self.generations_lock:
+                if self.seen_versions.get(user_id) != version:
+                    self.seen_versions.set(user_id, version)
+                    self._bump_generation(user_id)
+        return version
+
+    def get_mark_changes(self, user_id, since, fields=None, limit=None):
+        return self._cached_list(
+            user_id,
+            ('changes', since, fields, limit),
+            lambda: super(CachedDatabaseManager, self).get_mark_changes(user_id, since, fields, limit)
+        )
+
+    def get_user_marks_in_bbox(self, user_id, boxes, limit=None):
+        return self._cached_list(
+            user_id,
+            ('bbox', tuple(boxes), limit),
+            lambda: super(CachedDatabaseManager, self).get_user_marks_in_bbox(user_id, boxes, limit)
+        )
+
+    def search_marks(self, user_id, text, prefix_query, boxes=None, date_from=None, date_to=None,
+                     limit=20, after=None):
+        return self._cached_list(
+            user_id,
+            ('search', text, tuple(boxes or ()), date_from, date_to, limit, after),
+            lambda: super(CachedDatabaseManager, self).search_marks(
+                user_id, text, prefix_query, boxes, date_from, date_to, limit, after
+            )
+        )
+
+    def get_mark_clusters(self, user_id, zoom, cell_ranges):
+        return self._cached_list(
+            user_id,
+            ('clusters', zoom, tuple(cell_ranges)),
+            lambda: super(CachedDatabaseManager, self).get_mark_clusters(user_id, zoom, cell_ranges)
+        )
+
+    def get_mark_stats(self, user_id, top_cells=50):
+        return self._cached_list(
+            user_id,
+            ('stats', top_cells),
+            lambda: super(CachedDatabaseManager, self).get_mark_stats(user_id, top_cells)
+        )
+
+    # ЗАПИСЬ СО СБРОСОМ КЕША
+    def create_user(self, telegram_id):
+        result = super().create_user(telegram_id)
+        self.users_cache.delete(int(telegram_id))
+        return result
+
+    def create_mark(self, user_id, title, coords, visit_date=None, description=None, address=None, cursor=None):
+        result = super().create_mark(user_id, title, coords, visit_date, description, address, cursor=cursor)
+        self.invalidate_user_lists(user_id, cursor)
+        return result
+
+    def update_mark(self, mark_id, user_id, cursor=None, **kwargs):
+        result = super().update_mark(mark_id, user_id, cursor=cursor, **kwargs)
+        self.invalidate_mark(mark_id, cursor)
+        self.invalidate_user_lists(user_id, cursor)
+        return result
+
+    def delete_mark(self, mark_id, user_id, cursor=None):
+        result = super().delete_mark(mark_id, user_id, cursor=cursor)
+        self.invalidate_mark(mark_id, cursor)
+        self.invalidate_user_lists(user_id, cursor)
+        return result
+
+    def create_marks(self, user_id, marks, cursor):
+        result = super().create_marks(user_id, marks, cursor)
+        self.invalidate_user_lists(user_id, cursor)
+        return result
+
+    def update_marks(self, user_id, updates, cursor):
+        result = super().update_marks(user_id, updates, cursor)
+        for mark_id, fields in updates:
+            self.invalidate_mark(mark_id, cursor)
+        self.invalidate_user_lists(user_id, cursor)
+        return result
+
+    def delete_marks(self, user_id, mark_ids, cursor):
+        result = super().delete_marks(user_id, mark_ids, cursor)
+        for mark_id in mark_ids:
+            self.invalidate_mark(mark_id, cursor)
+        self.invalidate_user_lists(user_id, cursor)
+        return result
+
+    def copy_marks(self, user_id, marks, chunk_size=5000):
+        result = super().copy_marks(user_id, marks, chunk_size)
+        self.invalidate_user_lists(user_id)
+        return result
+
+    def add_photo(self, mark_id, filename, is_main=False, cursor=None):
+        result = super().add_photo(mark_id, filename, is_main, cursor=cursor)
+        self.invalidate_mark(mark_id, cursor)
+        return result
+
+    def delete_mark_photos(self, mark_id, is_main=None, cursor=None):
+        result = super().delete_mark_photos(mark_id, is_main, cursor=cursor)
+        self.invalidate_mark(mark_id, cursor)
+        return result
+
+    def add_photos(self, photos, cursor):
+        result = super().add_photos(photos, cursor)
+        for mark_id in {photo[0] for photo in photos}:
+            self.invalidate_mark(mark_id, cursor)
+        return result
+
+    def delete_marks_photos(self, mark_ids, is_main=None, cursor=None):
+        result = super().delete_marks_photos(mark_ids, is_main, cursor=cursor)
+        for mark_id in mark_ids:
+            self.invalidate_mark(mark_id, cursor)
+        return result
+
+    def set_photo_variants(self, photo_id, variants):
+        mark_id = super().set_photo_variants(photo_id, variants)
+        if mark_id is not None:
+            self.invalidate_mark(mark_id)
+        return mark_id
+
+    def add_marks_to_clusters(self, user_id, marks, cursor=None):
+        result = super().add_marks_to_clusters(user_id, marks, cursor=cursor)
+        self.invalidate_user_lists(user_id, cursor)
+        return result
+
+    def remove_mark_from_clusters(self, user_id, mark_id, lat, lon, cursor=None):
+        result = super().remove_mark_from_clusters(user_id, mark_id, lat, lon, cursor=cursor)
+        self.invalidate_user_lists(user_id, cursor)
+        return result
+
+    def remove_marks_from_clusters(self, user_id, marks, cursor):
+        result = super().remove_marks_from_clusters(user_id, marks, cursor)
+        self.invalidate_user_lists(user_id, cursor)
+        return result
+
+    def rebuild_mark_clusters(self, user_id=None, cursor=None):
+        result = super().rebuild_mark_clusters(user_id, cursor)
+        if user_id is None:
+            self._invalidate(self.lists_cache.clear, cursor)
+        else:
+            self.invalidate_user_lists(user_id, cursor)
+        return result
+
+    def apply_mark_stats(self, user_id, deltas, cursor=None):
+        result = super().apply_mark_stats(user_id, deltas, cursor=cursor)
+        self.invalidate_user_lists(user_id, cursor)
+        return result
+
+    def rebuild_mark_stats(self):
+        result = super().rebuild_mark_stats()
+        self.lists_cache.clear()
+        return result
@@ -1,55 +1,200 @@
 import psycopg2 # type: ignore
-from psycopg2 import pool # type: ignore
+from psycopg2.extras import Json, execute_values # type: ignore
 import os
+import csv
+import hashlib
+import io
+import queue
+import re
+import threading
+from contextlib import contextmanager
 from datetime import datetime
+from functools import lru_cache
 from dotenv import load_dotenv
+import geo
+import mark_stats
+from db_pool import ManagedConnectionPool
+from instrumentation import register_statement
+import pagination
+from records import MarkRecord, MarkSearchRecord, MarkStatsRecord, UserRecord, record_type, to_records
 
 
 load_dotenv()
 
 
+# Колонки метки, которые можно менять через update_mark
+MARK_UPDATABLE_FIELDS = {'title', 'description', 'visit_date', 'address', 'lat', 'lon'}
+# Типы колонок для параметров в VALUES пакетного обновления
+MARK_COLUMN_TYPES = {
+    'title': 'varchar',
+    'description': 'text',
+    'visit_date': 'date',
+    'address': 'text',
+    'lat': 'numeric',
+    'lon': 'numeric'
+}
+
+# Что возвращает _execute_query: все строки, одну строку или число затронутых строк
+FETCH_ALL = 'all'
+FETCH_ONE = 'one'
+FETCH_ROWCOUNT = 'rowcount'
+
+# Больше подготовленных запросов на соединение не держим: у страницы меток
+# текст запроса зависит от набора полей, и вариантов может быть много
+MAX_PREPARED_STATEMENTS = 256
+# Пространство advisory-блокировок имен файлов фото (второй ключ - hashtext имени)
+PHOTO_FILE_LOCK_SPACE = 7203002
+
+PLACEHOLDER_RE = re.compile(r'%%|%s')
+
+
+@lru_cache(maxsize=1024)
+def query_kind(query):
+    """Режим выборки по умолчанию и нужен ли commit; текст разбирается один раз"""
+    words = query.split(None, 1)
+    verb = words[0].upper() if words else ''
+    if verb == 'SELECT':
+        return FETCH_ALL, False
+    if verb == 'INSERT':
+        return FETCH_ONE, True
+    return FETCH_ROWCOUNT, True
+
+
+@lru_cache(maxsize=1024)
+def prepared_statement(query):
+    """Имя, текст для PREPARE (с $1, $2...) и число параметров запроса"""
+    count = 0
+
+    def placeholder(match):
+        nonlocal count
+        if match.group() == '%%':
+            return '%'
+        count += 1
+        return f"${count}"
+
+    sql = PLACEHOLDER_RE.sub(placeholder, query.strip().rstrip(';'))
+    name = 'q_' + hashlib.md5(query.encode('utf-8')).hexdigest()[:16]
+    return name, sql, count
+
+
 class DatabaseManager:
     def __init__(self):
         self.connection_pool = None
+        # Через pgbouncer в режиме transaction подготовленные запросы не работают
+        self.use_prepared = os.getenv('DB_PREPARED_STATEMENTS', '1') == '1'
+        # Поиск с опечатками - если в БД есть pg_trgm (проверяется в create_indexes)
+        self.fuzzy_search = os.getenv('SEARCH_FUZZY', '1') == '1'
+        self.fuzzy_threshold = float(os.getenv('SEARCH_FUZZY_THRESHOLD', '0.4'))
+
+    def _execute_query(self, query, params=None, cursor=None, fetch=None, prepare=False):
+        """Универсальный метод для выполнения SQL запросов
+
+        Если передан cursor, запрос выполняется в его транзакции без commit.
+        fetch - FETCH_ALL, FETCH_ONE или FETCH_ROWCOUNT (по умолчанию - по
+        типу запроса), prepare - выполнить как подготовленный запрос.
+        """
+        default_fetch, needs_commit = query_kind(query)
+        fetch = fetch or default_fetch
+        if cursor is not None:
+            self._run(cursor, query, params, prepare)
+            return self._fetch_result(cursor, fetch)
 
-    def _execute_query(self, query, params=None):
-        """Универсальный метод для выполнения SQL запросов"""
         conn = self.get_connection()
         try:
             with conn.cursor() as cursor:
-                cursor.execute(query, params or ())
-                
-                # Для SELECT запросов возвращаем результаты
-                if query.strip().upper().startswith('SELECT'):
-                    return cursor.fetchall()
-                # Для INSERT с RETURNING возвращаем одну запись
-                elif query.strip().upper().startswith('INSERT'):
-                    conn.commit()
-                    return cursor.fetchone() if cursor.description else None
-                # Для UPDATE/DELETE возвращаем количество затронутых строк
-                else:
+                self._run(cursor, query, params, prepare)
+                result = self._fetch_result(cursor, fetch)
+                if needs_commit:
                     conn.commit()
-                    return cursor.rowcount
+                return result
                 
         except Exception as e:
-            if conn:
-                conn.rollback()
+            self._rollback(conn)
             print(f"❌ Ошибка выполнения запроса: {e}")
             raise e
         finally:
             self.return_connection(conn)
+
+    @staticmethod
+    def _rollback(conn):
+        """Откат, который не подменяет исходную ошибку"""
+        # У разорванного соединения rollback тоже падает, pool выбросит его при возврате
+        try:
+            conn.rollback()
+        except psycopg2.Error:
+            pass
+
+    def _run(self, cursor, query, params, prepare):
+        """Выполнение запроса; с prepare - через PREPARE/EXECUTE
+
+        Подготовленный запрос разбирается и планируется сервером один раз на
+        соединение, дальше передаются только параметры.
+        """
+        prepared = getattr(cursor.connection, 'prepared', None)
+        if not prepare or not self.use_prepared or prepared is None:
+            cursor.execute(query, params or ())
+            return
+
+        name, sql, count = prepared_statement(query)
+        if name not in prepared:
+            if len(prepared) >= MAX_PREPARED_STATEMENTS:
+                cursor.execute("DEALLOCATE ALL;")
+                prepared.clear()
+            cursor.execute(f"PREPARE {name} AS {sql};")
+            prepared.add(name)
+            register_statement(name, sql)
+        if count:
+            cursor.execute(f"EXECUTE {name} ({', '.join(['%s'] * count)});", params)
+        else:
+            cursor.execute(f"EXECUTE {name};")
+
+    @staticmethod
+    def _fetch_result(cursor, fetch):
+        """Результат запроса в выбранном режиме"""
+        if fetch == FETCH_ALL:
+            return cursor.fetchall()
+        # Одна запись - для INSERT/UPDATE с RETURNING
+        if fetch == FETCH_ONE:
+            return cursor.fetchone() if cursor.description else None
+        # Для UPDATE/DELETE возвращаем количество затронутых строк
+        return cursor.rowcount
+
+    @contextmanager
+    def transaction(self):
+        """Одна транзакция на одном соединении: commit при выходе, rollback при ошибке"""
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                yield cursor
+            conn.commit()
+        except Exception as e:
+            self._rollback(conn)
+            print(f"❌ Ошибка транзакции: {e}")
+            raise e
+        finally:
+            self.return_connection(conn)
         
-    def init_pool(self, min_conn=1, max_conn=10):
-        """Инициализация connection pool"""
+    @staticmethod
+    def connection_params():
+        """Параметры подключения к БД из окружения (пул и отдельные соединения)"""
+        return {
+            'host': os.getenv('DB_HOST', 'localhost'),
+            'database': os.getenv('DB_NAME', 'bilodelo'),
+            'user': os.getenv('DB_USER', 'postgres'),
+            'password': os.getenv('DB_PASSWORD', ''),
+            'port': os.getenv('DB_PORT', '5432')
+        }
+
+    def init_pool(self, min_conn=None, max_conn=None):
+        """Инициализация connection pool (размер и таймауты - из DB_POOL_*)"""
         try:
-            self.connection_pool = pool.ThreadedConnectionPool(
-                minconn=min_conn,
-                maxconn=max_conn,
-                host=os.getenv('DB_HOST', 'localhost'),
-                database=os.getenv('DB_NAME', 'bilodelo'),
-                user=os.getenv('DB_USER', 'postgres'),
-                password=os.getenv('DB_PASSWORD', ''),
-                port=os.getenv('DB_PORT', '5432')
+            self.connection_pool = ManagedConnectionPool(
+                min_conn=int(os.getenv('DB_POOL_MIN', '1')) if min_conn is None else min_conn,
+                max_conn=int(os.getenv('DB_POOL_MAX', '10')) if max_conn is None else max_conn,
+                checkout_timeout=float(os.getenv('DB_POOL_TIMEOUT', '10')),
+                check_after=float(os.getenv('DB_POOL_CHECK_AFTER', '30')),
+                max_lifetime=float(os.getenv('DB_POOL_MAX_LIFETIME', '3600')),
+                **self.connection_params()
             )
             print("✅ Connection pool инициализирован")
             return True
@@ -58,18 +203,25 @@ class DatabaseManager:
             return False
     
     def get_connection(self):
-        """Получение соединения из pool"""
-        if self.connection_pool:
-            return self.connection_pool.getconn()
-        return None
+        """Получение соединения из pool; ждет свободное не дольше DB_POOL_TIMEOUT"""
+        if not self.connection_pool:
+            raise Exception("Connection pool не инициализирован")
+        return self.connection_pool.getconn()
     
     def return_connection(self, conn):
         """Возврат соединения в pool"""
         if self.connection_pool and conn:
             self.connection_pool.putconn(conn)
+
+    def pool_stats(self):
+        """Метрики connection pool"""
+        if not self.connection_pool:
+            return None
+        return self.connection_pool.stats()
     
     def create_tables(self):
         """Создание всех таблиц"""
+        conn = None
         try:
             conn = self.get_connection()
             if not conn:
@@ -81,6 +233,7 @@ class DatabaseManager:
                     CREATE TABLE IF NOT EXISTS users (
                         id SERIAL PRIMARY KEY,
                         telegram_id BIGINT UNIQUE NOT NULL,
+                        marks_version BIGINT NOT NULL DEFAULT 0,
                         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                     );
                 """)
@@ -97,6 +250,8 @@ class DatabaseManager:
                         lat DECIMAL(10, 8) NOT NULL,
                         lon DECIMAL(11, 8) NOT NULL,
                         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        change_seq BIGINT NOT NULL DEFAULT 0,
                         
                         CONSTRAINT valid_coordinates CHECK (
                             lat BETWEEN -90 AND 90 AND 
@@ -112,9 +267,139 @@ class DatabaseManager:
                         mark_id INTEGER NOT NULL REFERENCES marks(id) ON DELETE CASCADE,
                         filename VARCHAR(255) NOT NULL,
                         is_main BOOLEAN DEFAULT FALSE,
+                        variants JSONB NOT NULL DEFAULT '{}'::jsonb,
                         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                     );
                 """)
+
+                # Роли пользователей (дополняют static/admins.json)
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS roles (
+                        telegram_id BIGINT NOT NULL,
+                        role VARCHAR(32) NOT NULL,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        PRIMARY KEY (telegram_id, role)
+                    );
+                """)
+                
+                # Кластеры меток по сетке для каждого масштаба карты
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS mark_clusters (
+                        user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+                        zoom SMALLINT NOT NULL,
+                        cell_x INTEGER NOT NULL,
+                        cell_y INTEGER NOT NULL,
+                        mark_count INTEGER NOT NULL DEFAULT 0,
+                        sum_lat DOUBLE PRECISION NOT NULL DEFAULT 0,
+                        sum_lon DOUBLE PRECISION NOT NULL DEFAULT 0,
+                        mark_id INTEGER,
+                        PRIMARY KEY (user_id, zoom, cell_x, cell_y)
+                    );
+                """)
+                
+                # Удаленные метки для ленты изменений /api/marks/changes
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS mark_tombstones (
+                        mark_id INTEGER PRIMARY KEY,
+                        user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+                        change_seq BIGINT NOT NULL,
+                        deleted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    );
+                """)
+                
+                # Очередь удаления файлов фото: пишется в одной транзакции
+                # с удалением строк photos, файлы удаляет фоновый сборщик
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS pending_deletes (
+                        id BIGSERIAL PRIMARY KEY,
+                        filename VARCHAR(255) NOT NULL,
+                        attempts INTEGER NOT NULL DEFAULT 0,
+                        last_error TEXT,
+                        run_after TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    );
+                """)
+                
+                # Кеш ответов геокодера: ключ - округленные координаты или
+                # нормализованный запрос, см. geocoding.GeocodingService
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS geocode_cache (
+                        cache_key TEXT PRIMARY KEY,
+                        response JSONB NOT NULL,
+                        hits INTEGER NOT NULL DEFAULT 0,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        expires_at TIMESTAMP NOT NULL
+                    );
+                """)
+                
+                # Очередь фоновых задач для процессов job_worker.py: задачу
+                # забирают через FOR UPDATE SKIP LOCKED и держат lease до locked_until
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS jobs (
+                        id BIGSERIAL PRIMARY KEY,
+                        kind VARCHAR(64) NOT NULL,
+                        payload JSONB NOT NULL DEFAULT '{}'::jsonb,
+                        status VARCHAR(16) NOT NULL DEFAULT 'queued',
+                        attempts INTEGER NOT NULL DEFAULT 0,
+                        max_attempts INTEGER NOT NULL DEFAULT 5,
+                        last_error TEXT,
+                        run_after TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                        locked_until TIMESTAMP,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    );
+                """)
+                
+                # Счетчики меток по срезам (см. mark_stats): пользователя и общие.
+                # Обновляются в транзакции изменения меток, статистика их только читает
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS mark_stats (
+                        user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+                        kind VARCHAR(16) NOT NULL,
+                        bucket VARCHAR(16) NOT NULL,
+                        mark_count INTEGER NOT NULL DEFAULT 0,
+                        PRIMARY KEY (user_id, kind, bucket)
+                    );
+                """)
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS mark_stats_global (
+                        kind VARCHAR(16) NOT NULL,
+                        bucket VARCHAR(16) NOT NULL,
+                        mark_count BIGINT NOT NULL DEFAULT 0,
+                        user_count INTEGER NOT NULL DEFAULT 0,
+                        PRIMARY KEY (kind, bucket)
+                    );
+                """)
+                
+                # Производные размеры фото для баз, созданных до их появления
+                cursor.execute("""
+                    ALTER TABLE photos
+                    ADD COLUMN IF NOT EXISTS variants JSONB NOT NULL DEFAULT '{}'::jsonb;
+                """)
+                
+                # Версии списка меток для баз, созданных до ленты изменений
+                cursor.execute("""
+                    ALTER TABLE users
+                    ADD COLUMN IF NOT EXISTS marks_version BIGINT NOT NULL DEFAULT 0;
+                """)
+                cursor.execute("""
+                    ALTER TABLE marks
+                    ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    ADD COLUMN IF NOT EXISTS change_seq BIGINT NOT NULL DEFAULT 0;
+                """)
+                
+                # Поисковый вектор метки: название (A), адрес (B), описание (C).
+                # russian - морфология, simple - имена и слова не из словаря.
+                # Для существующей таблицы добавление колонки - разовая перезапись.
+                cursor.execute("""
+                    ALTER TABLE marks
+                    ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+                        setweight(to_tsvector('russian'::regconfig, coalesce(title, '')), 'A') ||
+                        setweight(to_tsvector('simple'::regconfig, coalesce(title, '')), 'A') ||
+                        setweight(to_tsvector('russian'::regconfig, coalesce(address, '')), 'B') ||
+                        setweight(to_tsvector('simple'::regconfig, coalesce(address, '')), 'B') ||
+                        setweight(to_tsvector('russian'::regconfig, coalesce(description, '')), 'C')
+                    ) STORED;
+                """)
                 
                 conn.commit()
                 print("✅ Таблицы созданы успешно")
@@ -128,17 +413,46 @@ class DatabaseManager:
     
     def create_indexes(self):
         """Создание индексов для оптимизации"""
+        conn = None
         try:
             conn = self.get_connection()
             with conn.cursor() as cursor:
                 indexes = [
                     "CREATE INDEX IF NOT EXISTS idx_users_telegram_id ON users(telegram_id);",
                     "CREATE INDEX IF NOT EXISTS idx_marks_user_id ON marks(user_id);",
+                    # Порядок списка меток и курсор пагинации (visit_date, created_at, id)
+                    "CREATE INDEX IF NOT EXISTS idx_marks_user_keyset ON marks(user_id, visit_date DESC, created_at DESC, id DESC);",
                     "CREATE INDEX IF NOT EXISTS idx_marks_coordinates ON marks(lat, lon);",
+                    # Лента изменений: метки и удаления пользователя после версии
+                    "CREATE INDEX IF NOT EXISTS idx_marks_user_change_seq ON marks(user_id, change_seq);",
+                    "CREATE INDEX IF NOT EXISTS idx_mark_tombstones_user_seq ON mark_tombstones(user_id, change_seq);",
+                    # GiST по точке для запросов "метки в прямоугольнике карты"
+                    "CREATE INDEX IF NOT EXISTS idx_marks_point ON marks USING GIST (point(lon::float8, lat::float8));",
                     "CREATE INDEX IF NOT EXISTS idx_photos_mark_id ON photos(mark_id);",
-                    "CREATE INDEX IF NOT EXISTS idx_photos_is_main ON photos(is_main);"
+                    "CREATE INDEX IF NOT EXISTS idx_photos_is_main ON photos(is_main);",
+                    # Подсчет ссылок на общий файл фото (имя файла = хеш содержимого)
+                    "CREATE INDEX IF NOT EXISTS idx_photos_filename ON photos(filename);",
+                    "CREATE INDEX IF NOT EXISTS idx_pending_deletes_run_after ON pending_deletes(run_after);",
+                    "CREATE INDEX IF NOT EXISTS idx_pending_deletes_filename ON pending_deletes(filename);",
+                    "CREATE INDEX IF NOT EXISTS idx_geocode_cache_expires_at ON geocode_cache(expires_at);",
+                    # Выборка готовых к запуску задач; упавшие окончательно в индекс не попадают
+                    "CREATE INDEX IF NOT EXISTS idx_jobs_queued ON jobs(run_after, id) WHERE status = 'queued';"
                 ]
                 
+                # btree_gin - user_id в том же GIN-индексе: поиск не перебирает
+                # совпадения всех пользователей. Без него - GIN только по тексту.
+                user_prefix = "user_id, " if self.create_extension(cursor, 'btree_gin') else ""
+                indexes.append(
+                    f"CREATE INDEX IF NOT EXISTS idx_marks_search ON marks USING GIN ({user_prefix}search_vector);"
+                )
+                if self.fuzzy_search and self.create_extension(cursor, 'pg_trgm'):
+                    indexes += [
+                        f"CREATE INDEX IF NOT EXISTS idx_marks_title_trgm ON marks USING GIN ({user_prefix}title gin_trgm_ops);",
+                        f"CREATE INDEX IF NOT EXISTS idx_marks_address_trgm ON marks USING GIN ({user_prefix}address gin_trgm_ops);"
+                    ]
+                else:
+                    self.fuzzy_search = False
+                
                 for index_query in indexes:
                     cursor.execute(index_query)
                 
@@ -152,6 +466,37 @@ class DatabaseManager:
         finally:
             self.return_connection(conn)
 
+    def bootstrap(self):
+        """Схема, индексы и первичное заполнение кластеров и статистики
+
+        Выполняется одним процессом до запуска воркеров (supervisor.py,
+        asgi_app.py): параллельные пересчеты на пустой базе конфликтуют.
+        """
+        self.create_tables()
+        self.create_indexes()
+        self.ensure_mark_clusters()
+        self.ensure_mark_stats()
+
+    def check_extensions(self):
+        """Поиск с опечатками - только если pg_trgm уже установлен (без bootstrap)"""
+        if not self.fuzzy_search:
+            return
+        result = self._execute_query("SELECT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm');")
+        self.fuzzy_search = bool(result and result[0][0])
+
+    @staticmethod
+    def create_extension(cursor, name):
+        """CREATE EXTENSION в точке сохранения: без прав транзакция не прерывается"""
+        cursor.execute("SAVEPOINT create_extension;")
+        try:
+            cursor.execute(f"CREATE EXTENSION IF NOT EXISTS {name};")
+            cursor.execute("RELEASE SAVEPOINT create_extension;")
+            return True
+        except psycopg2.Error as e:
+            cursor.execute("ROLLBACK TO SAVEPOINT create_extension;")
+            print(f"⚠️ Расширение {name} недоступно: {e}")
+            return False
+
     # DAO МЕТОДЫ ДЛЯ ПОЛЬЗОВАТЕЛЕЙ
     def create_user(self, telegram_id):
         """Создание нового пользователя"""
@@ -168,35 +513,62 @@ class DatabaseManager:
             }
         return None
     
-    def get_user_by_telegram_id(self, telegram_id):
+    def get_user_by_telegram_id(self, telegram_id, cursor=None):
         """Получение пользователя по Telegram ID"""
         query = """
         SELECT id, telegram_id, created_at 
         FROM users 
         WHERE telegram_id = %s;
         """
-        result = self._execute_query(query, (telegram_id,))
-        if result:
-            return {
-                "id": result[0][0],
-                "telegram_id": result[0][1],
-                "created_at": result[0][2]
-            }
-        return None
+        result = self._execute_query(query, (telegram_id,), cursor, fetch=FETCH_ONE, prepare=True)
+        return UserRecord(*result) if result else None
+    
+    def get_role_telegram_ids(self, role):
+        """Telegram ID всех пользователей с ролью"""
+        query = "SELECT telegram_id FROM roles WHERE role = %s;"
+        result = self._execute_query(query, (role,))
+        return [row[0] for row in result] if result else []
     
     # DAO МЕТОДЫ ДЛЯ МЕТОК
-    def create_mark(self, user_id, title, coords, visit_date=None, description=None, address=None):
+    def bump_marks_version(self, user_id, cursor):
+        """Следующая версия списка меток пользователя
+
+        Строка users блокируется до конца транзакции, поэтому версии одного
+        пользователя коммитятся строго по порядку и лента изменений их не теряет.
+        """
+        row = self._execute_query(
+            "UPDATE users SET marks_version = marks_version + 1 WHERE id = %s RETURNING marks_version;",
+            (user_id,), cursor, fetch=FETCH_ONE, prepare=True
+        )
+        return row[0] if row else None
+
+    def get_marks_version(self, user_id):
+        """Текущая версия списка меток пользователя (для ETag и ленты изменений)"""
+        result = self._execute_query(
+            "SELECT marks_version FROM users WHERE id = %s;", (user_id,), fetch=FETCH_ONE, prepare=True
+        )
+        return result[0] if result else None
+
+    def create_mark(self, user_id, title, coords, visit_date=None, description=None, address=None, cursor=None):
         """Создание новой метки"""
+        if cursor is None:
+            with self.transaction() as cursor:
+                return self.create_mark(user_id, title, coords, visit_date, description, address, cursor=cursor)
+
+        version = self.bump_marks_version(user_id, cursor)
         query = """
         INSERT INTO marks 
-        (user_id, title, description, visit_date, address, lat, lon) 
-        VALUES (%s, %s, %s, %s, %s, %s, %s)
-        RETURNING id;
+        (user_id, title, description, visit_date, address, lat, lon, change_seq) 
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+        RETURNING id, visit_date;
         """
-        result = self._execute_query(query, (user_id, title, description, visit_date, address, coords[0], coords[1]))
+        result = self._execute_query(
+            query, (user_id, title, description, visit_date, address, coords[0], coords[1], version), cursor, prepare=True
+        )
         if result:
             return {
-                "id": result[0]
+                "id": result[0],
+                "visit_date": result[1]
             }
         return None
     
@@ -208,24 +580,169 @@ class DatabaseManager:
         WHERE user_id = %s
         ORDER BY visit_date DESC, created_at DESC;
         """
-        result = self._execute_query(query, (user_id,))
-        if result:
-            marks = []
-            for mark in result:
-                marks.append({
-                    "id": mark[0],
-                    "user_id": mark[1],
-                    "title": mark[2],
-                    "description": mark[3],
-                    "visit_date": mark[4],
-                    "address": mark[5],
-                    "lat": mark[6],
-                    "lon": mark[7],
-                    "created_at": mark[8]
-                })
-            return marks
-        return []
+        result = self._execute_query(query, (user_id,), prepare=True)
+        return to_records(MarkRecord, result or [])
     
+    def get_user_marks_page(self, user_id, fields=None, limit=None, after=None):
+        """Страница меток пользователя с курсором по (visit_date, created_at, id)
+
+        fields - выбранные колонки (по умолчанию все), after - ключ последней
+        метки предыдущей страницы. Возвращает (marks, last), где last - ключ
+        последней метки, если есть следующая страница.
+        """
+        fields = fields or pagination.MARK_FIELDS
+        query = f"""
+        SELECT {", ".join(fields)}, visit_date, created_at, id
+        FROM marks 
+        WHERE user_id = %s"""
+        params = [user_id]
+        if after:
+            query += " AND (visit_date, created_at, id) < (%s, %s, %s)"
+            params.extend(after)
+        query += " ORDER BY visit_date DESC, created_at DESC, id DESC"
+        if limit:
+            # Лишняя строка показывает, что есть следующая страница
+            query += " LIMIT %s"
+            params.append(limit + 1)
+
+        result = self._execute_query(query + ";", params, prepare=True) or []
+        has_more = limit is not None and len(result) > limit
+        if has_more:
+            result = result[:limit]
+
+        row_type = record_type('MarkRow', tuple(fields))
+        count = len(fields)
+        marks = [row_type(*mark[:count]) for mark in result]
+        last = tuple(result[-1][len(fields):]) if has_more else None
+        return marks, last
+    
+    def get_mark_changes(self, user_id, since, fields=None, limit=None):
+        """Метки, измененные после версии since, и id удаленных
+
+        Возвращает (changed, deleted) или None, если изменений больше limit -
+        тогда клиенту проще загрузить список заново.
+        """
+        fields = fields or pagination.MARK_FIELDS
+        if 'id' not in fields:
+            # Без id клиент не поймет, какую метку заменить
+            fields = ('id',) + tuple(fields)
+        query = f"""
+        SELECT {", ".join(fields)}
+        FROM marks
+        WHERE user_id = %s AND change_seq > %s
+        ORDER BY change_seq"""
+        params = [user_id, since]
+        if limit:
+            query += " LIMIT %s"
+            params.append(limit + 1)
+        result = self._execute_query(query + ";", params, prepare=True) or []
+        if limit and len(result) > limit:
+            return None
+
+        deleted = self._execute_query(
+            "SELECT mark_id FROM mark_tombstones WHERE user_id = %s AND change_seq > %s ORDER BY change_seq;",
+            (user_id, since), prepare=True
+        ) or []
+        return to_records(record_type('MarkRow', tuple(fields)), result), [row[0] for row in deleted]
+
+    def get_user_marks_in_bbox(self, user_id, boxes, limit=None):
+        """Получение меток пользователя внутри видимой области карты
+
+        boxes - список (south, west, north, east); несколько прямоугольников,
+        если область пересекает 180-й меридиан. Выражение point(lon, lat)
+        совпадает с индексом idx_marks_point.
+        """
+        if not boxes:
+            return []
+
+        box_conditions = " OR ".join(
+            ["point(lon::float8, lat::float8) <@ box(point(%s, %s), point(%s, %s))"] * len(boxes)
+        )
+        params = [user_id]
+        for south, west, north, east in boxes:
+            params.extend([west, south, east, north])
+
+        query = f"""
+        SELECT id, user_id, title, description, visit_date, address, lat, lon, created_at
+        FROM marks 
+        WHERE user_id = %s AND ({box_conditions})
+        ORDER BY visit_date DESC, created_at DESC
+        """
+        if limit:
+            query += " LIMIT %s"
+            params.append(limit)
+
+        result = self._execute_query(query + ";", params, prepare=True)
+        return to_records(MarkRecord, result or [])
+    
+    def search_marks(self, user_id, text, prefix_query, boxes=None, date_from=None, date_to=None,
+                     limit=20, after=None):
+        """Поиск меток пользователя по названию, адресу и описанию
+
+        Совпадения полнотекстового поиска (или по началу слов) идут выше
+        совпадений только по триграммам: score = 1 + ts_rank_cd для первых,
+        плюс сходство названия или адреса с запросом. Страницы - по курсору
+        (score, id); snippet считается только для строк страницы.
+        """
+        if self.fuzzy_search:
+            similarity = "GREATEST(word_similarity(q.text, m.title), word_similarity(q.text, coalesce(m.address, '')))"
+            fuzzy_condition = "OR q.text <%% m.title OR q.text <%% m.address"
+        else:
+            similarity = "0"
+            fuzzy_condition = ""
+
+        filters = ""
+        params = [text, prefix_query, text, user_id]
+        if boxes:
+            filters += " AND (" + " OR ".join(
+                ["point(m.lon::float8, m.lat::float8) <@ box(point(%s, %s), point(%s, %s))"] * len(boxes)
+            ) + ")"
+            for south, west, north, east in boxes:
+                params.extend([west, south, east, north])
+        if date_from:
+            filters += " AND m.visit_date >= %s"
+            params.append(date_from)
+        if date_to:
+            filters += " AND m.visit_date <= %s"
+            params.append(date_to)
+
+        page_condition = ""
+        if after:
+            page_condition = "WHERE (score, id) < (%s::float8, %s)"
+            params.extend(after)
+        params.append(limit)
+
+        query = f"""
+        SELECT id, title, visit_date, address, lat, lon, score,
+               ts_headline('russian', coalesce(description, ''), query,
+                           'MaxFragments=1, MaxWords=20, MinWords=5') AS snippet
+        FROM (
+            SELECT m.id, m.title, m.description, m.visit_date, m.address, m.lat, m.lon, q.query,
+                   ((CASE WHEN m.search_vector @@ q.query
+                          THEN 1 + ts_rank_cd(m.search_vector, q.query, 32) ELSE 0 END)
+                    + {similarity})::float8 AS score
+            FROM marks m, (
+                SELECT websearch_to_tsquery('russian', %s) || to_tsquery('simple', %s) AS query,
+                       %s::text AS text
+            ) q
+            WHERE m.user_id = %s
+              AND (m.search_vector @@ q.query {fuzzy_condition})
+              {filters}
+        ) found
+        {page_condition}
+        ORDER BY score DESC, id DESC
+        LIMIT %s;
+        """
+        with self.transaction() as cursor:
+            if self.fuzzy_search:
+                # Порог оператора <%: по умолчанию 0.6 отсекает слова с одной опечаткой
+                cursor.execute(
+                    "SELECT set_config('pg_trgm.word_similarity_threshold', %s, true);",
+                    (str(self.fuzzy_threshold),)
+                )
+            cursor.execute(query, params)
+            return to_records(MarkSearchRecord, cursor.fetchall())
+
     def get_user_marks_coords(self, user_id):
         """Получение всех координат меток пользователя"""
         query = """
@@ -248,59 +765,286 @@ class DatabaseManager:
         return []
     
     
-    def get_mark_by_id(self, mark_id):
+    def get_mark_by_id(self, mark_id, cursor=None):
         """Получение метки по ID"""
         query = """
         SELECT id, user_id, title, description, visit_date, address, lat, lon, created_at
         FROM marks 
         WHERE id = %s;
         """
-        result = self._execute_query(query, (mark_id,))
-        if result:
-            return {
-                "id": result[0][0],
-                "user_id": result[0][1],
-                "title": result[0][2],
-                "description": result[0][3],
-                "visit_date": result[0][4],
-                "address": result[0][5],
-                "lan": result[0][6],
-                "log": result[0][7],
-                "created_at": result[0][8]
-            }
-        return None
+        result = self._execute_query(query, (mark_id,), cursor, fetch=FETCH_ONE, prepare=True)
+        return MarkRecord(*result) if result else None
     
-    def delete_mark(self, mark_id, user_id):
-        """Удаление метки"""
+    def delete_mark(self, mark_id, user_id, cursor=None):
+        """Удаление метки с записью в mark_tombstones для ленты изменений"""
+        if cursor is None:
+            with self.transaction() as cursor:
+                return self.delete_mark(mark_id, user_id, cursor=cursor)
+
         query = "DELETE FROM marks WHERE id = %s AND user_id = %s;"
-        return self._execute_query(query, (mark_id, user_id))
+        deleted = self._execute_query(query, (mark_id, user_id), cursor, prepare=True)
+        if deleted:
+            version = self.bump_marks_version(user_id, cursor)
+            self._execute_query("""
+                INSERT INTO mark_tombstones (mark_id, user_id, change_seq)
+                VALUES (%s, %s, %s)
+                ON CONFLICT (mark_id) DO UPDATE SET change_seq = EXCLUDED.change_seq;
+            """, (mark_id, user_id, version), cursor, prepare=True)
+        return deleted
     
-    def update_mark(self, mark_id, user_id, **kwargs):
+    def update_mark(self, mark_id, user_id, cursor=None, **kwargs):
         """Обновление метки"""
         if not kwargs:
             return 0
+
+        # Имена колонок подставляются в SQL, поэтому пропускаем только известные
+        unknown = set(kwargs) - MARK_UPDATABLE_FIELDS
+        if unknown:
+            raise ValueError(f"Нельзя изменить поля: {', '.join(sorted(unknown))}")
         
+        if cursor is None:
+            with self.transaction() as cursor:
+                return self.update_mark(mark_id, user_id, cursor=cursor, **kwargs)
+
+        version = self.bump_marks_version(user_id, cursor)
         set_clause = ", ".join([f"{key} = %s" for key in kwargs.keys()])
-        query = f"UPDATE marks SET {set_clause} WHERE id = %s AND user_id = %s;"
-        params = list(kwargs.values()) + [mark_id, user_id]
-        return self._execute_query(query, params)
+        query = f"""
+        UPDATE marks SET {set_clause}, updated_at = CURRENT_TIMESTAMP, change_seq = %s
+        WHERE id = %s AND user_id = %s;
+        """
+        params = list(kwargs.values()) + [version, mark_id, user_id]
+        return self._execute_query(query, params, cursor)
     
+    # ПАКЕТНЫЕ ОПЕРАЦИИ С МЕТКАМИ
+    def create_marks(self, user_id, marks, cursor):
+        """Вставка меток одним INSERT ... VALUES, возвращает id в порядке marks
+
+        marks - кортежи (title, description, visit_date, address, lat, lon).
+        Id берутся из последовательности заранее: порядок строк RETURNING
+        не гарантирован, а клиенту нужно сопоставить id со своими операциями.
+        """
+        if not marks:
+            return []
+        ids = [row[0] for row in self._execute_query(
+            "SELECT nextval(pg_get_serial_sequence('marks', 'id')) FROM generate_series(1, %s);",
+            (len(marks),), cursor
+        )]
+        version = self.bump_marks_version(user_id, cursor)
+        execute_values(cursor, """
+            INSERT INTO marks
+            (id, user_id, title, description, visit_date, address, lat, lon, change_seq)
+            VALUES %s;
+        """, [(mark_id, user_id, *mark, version) for mark_id, mark in zip(ids, marks)], page_size=1000)
+        return ids
+
+    def update_marks(self, user_id, updates, cursor):
+        """Обновление меток через UPDATE ... FROM (VALUES ...)
+
+        updates - пары (mark_id, {поле: значение}); метки с одинаковым набором
+        полей обновляются одним запросом. Возвращает (id, старые lat, lon,
+        новые lat, lon) обновленных меток - для переноса в кластерах.
+        """
+        groups = {}
+        for mark_id, fields in updates:
+            unknown = set(fields) - MARK_UPDATABLE_FIELDS
+            if unknown:
+                raise ValueError(f"Нельзя изменить поля: {', '.join(sorted(unknown))}")
+            groups.setdefault(tuple(sorted(fields)), []).append((mark_id, fields))
+        if not groups:
+            return []
+
+        version = self.bump_marks_version(user_id, cursor)
+        updated = []
+        for names, group in groups.items():
+            # Без явных типов VALUES из параметров - text, а колонки DATE/DECIMAL
+            row = "(" + ", ".join(["%s::integer"] + [f"%s::{MARK_COLUMN_TYPES[name]}" for name in names]) + ")"
+            params = []
+            for mark_id, fields in group:
+                params.append(mark_id)
+                params.extend(fields[name] for name in names)
+            set_clause = "".join(f"{name} = v.{name}, " for name in names)
+            cursor.execute(f"""
+                UPDATE marks m SET {set_clause}updated_at = CURRENT_TIMESTAMP, change_seq = %s
+                FROM (VALUES {", ".join([row] * len(group))}) AS v(id, {", ".join(names)}), marks old
+                WHERE m.id = v.id AND old.id = m.id AND m.user_id = %s
+                RETURNING m.id, old.lat, old.lon, m.lat, m.lon;
+            """, [version] + params + [user_id])
+            updated.extend(cursor.fetchall())
+        return updated
+
+    def delete_marks(self, user_id, mark_ids, cursor):
+        """Удаление меток пользователя одним DELETE ... ANY с записью в mark_tombstones
+
+        Возвращает (id, lat, lon) удаленных меток; чужие и уже удаленные пропускаются.
+        """
+        if not mark_ids:
+            return []
+        deleted = self._execute_query(
+            "DELETE FROM marks WHERE id = ANY(%s) AND user_id = %s RETURNING id, lat, lon;",
+            (list(mark_ids), user_id), cursor, fetch=FETCH_ALL
+        )
+        if deleted:
+            version = self.bump_marks_version(user_id, cursor)
+            self._execute_query("""
+                INSERT INTO mark_tombstones (mark_id, user_id, change_seq)
+                SELECT unnest(%s::integer[]), %s, %s
+                ON CONFLICT (mark_id) DO UPDATE SET change_seq = EXCLUDED.change_seq;
+            """, ([row[0] for row in deleted], user_id, version), cursor)
+        return deleted
+
+    def lock_user_marks(self, user_id, mark_ids, cursor):
+        """Метки пользователя из списка id, заблокированные до конца транзакции"""
+        if not mark_ids:
+            return []
+        query = """
+        SELECT id, user_id, title, description, visit_date, address, lat, lon, created_at
+        FROM marks
+        WHERE id = ANY(%s) AND user_id = %s
+        ORDER BY id
+        FOR UPDATE;
+        """
+        return to_records(MarkRecord, self._execute_query(query, (list(mark_ids), user_id), cursor))
+
+    def copy_marks(self, user_id, marks, chunk_size=5000):
+        """Массовая вставка меток через COPY FROM STDIN порциями по chunk_size
+
+        marks - итератор кортежей (title, description, visit_date, address, lat, lon),
+        уже проверенных на ограничения таблицы. Все порции, статистика и
+        кластеры - одна транзакция.
+        """
+        copy_query = """
+        COPY marks (user_id, title, description, visit_date, address, lat, lon, change_seq)
+        FROM STDIN WITH (FORMAT csv)
+        """
+        imported = 0
+        with self.transaction() as cursor:
+            # Весь импорт - одна версия списка меток
+            version = self.bump_marks_version(user_id, cursor)
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            rows_in_chunk = 0
+            # Счетчики статистики копятся по ходу чтения, файл второй раз не читаем
+            deltas = mark_stats.stats_deltas()
+            for mark in marks:
+                writer.writerow((user_id, *mark, version))
+                mark_stats.count_mark(deltas, mark[2], mark[4], mark[5])
+                rows_in_chunk += 1
+                if rows_in_chunk >= chunk_size:
+                    buffer.seek(0)
+                    cursor.copy_expert(copy_query, buffer)
+                    imported += rows_in_chunk
+                    buffer = io.StringIO()
+                    writer = csv.writer(buffer)
+                    rows_in_chunk = 0
+
+            if rows_in_chunk:
+                buffer.seek(0)
+                cursor.copy_expert(copy_query, buffer)
+                imported += rows_in_chunk
+
+            deltas.update(mark_stats.stats_deltas(changes=imported))
+            self.apply_mark_stats(user_id, deltas, cursor)
+            # COPY не возвращает id, поэтому кластеры пользователя пересчитываются
+            # целиком - в той же транзакции, карта не видит меток без кластеров
+            if imported:
+                self.rebuild_mark_clusters(user_id, cursor)
+        return imported
+
+    def copy_out(self, query, params=None, options="FORMAT csv", flush_size=64 * 1024):
+        """Потоковая выгрузка COPY (query) TO STDOUT порциями байт
+
+        COPY выполняется в отдельном потоке и пишет в ограниченную очередь,
+        поэтому в памяти одновременно лежит лишь несколько порций.
+        """
+        chunks = queue.Queue(maxsize=8)
+        stop = threading.Event()
+        finished = object()
+
+        class QueueWriter:
+            def __init__(self):
+                self.buffer = bytearray()
+
+            def write(self, data):
+                # psycopg2 пишет по одной строке COPY за вызов
+                self.buffer += data
+                if len(self.buffer) >= flush_size:
+                    self.flush()
+                return len(data)
+
+            def flush(self):
+                if self.buffer:
+                    if not send(bytes(self.buffer)):
+                        raise Exception("Выгрузка прервана клиентом")
+                    self.buffer = bytearray()
+
+        def send(item):
+            # Ушедший клиент очередь больше не читает: ждем место, только пока он слушает
+            while not stop.is_set():
+                try:
+                    chunks.put(item, timeout=1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def run_copy(conn):
+            result = finished
+            try:
+                with conn.cursor() as cursor:
+                    copy_query = cursor.mogrify(query, params).decode('utf-8')
+                    writer = QueueWriter()
+                    cursor.copy_expert(f"COPY ({copy_query}) TO STDOUT WITH ({options})", writer)
+                    writer.flush()
+                conn.rollback()
+            except Exception as e:
+                # После оборванного COPY состояние соединения неизвестно - закрываем его
+                conn.close()
+                result = e
+            finally:
+                # Соединение возвращаем до сигнала читателю: тот может уже не ждать
+                self.return_connection(conn)
+            send(result)
+
+        conn = self.get_connection()
+        if not conn:
+            raise Exception("Не удалось получить соединение")
+        threading.Thread(target=run_copy, args=(conn,), daemon=True).start()
+
+        try:
+            while True:
+                chunk = chunks.get()
+                if chunk is finished:
+                    return
+                if isinstance(chunk, Exception):
+                    raise chunk
+                yield chunk
+        finally:
+            stop.set()
+
     # DAO МЕТОДЫ ДЛЯ ФОТОГРАФИЙ
-    def add_photo(self, mark_id, filename, is_main=False):
+    def add_photo(self, mark_id, filename, is_main=False, cursor=None):
         """Добавление фотографии к метке"""
         # Если это главное фото, снимаем флаг с предыдущего
         if is_main:
             self._execute_query(
                 "UPDATE photos SET is_main = FALSE WHERE mark_id = %s AND is_main = TRUE;",
-                (mark_id,)
+                (mark_id,),
+                cursor
             )
         
+        # Тот же файл загрузили снова - он больше не мусор
+        self._execute_query(
+            "DELETE FROM pending_deletes WHERE filename = %s;",
+            (filename,),
+            cursor
+        )
+
         query = """
         INSERT INTO photos (mark_id, filename, is_main) 
         VALUES (%s, %s, %s)
         RETURNING id, mark_id, filename, is_main, created_at;
         """
-        result = self._execute_query(query, (mark_id, filename, is_main))
+        result = self._execute_query(query, (mark_id, filename, is_main), cursor)
         if result:
             return {
                 'id': result[0],
@@ -313,20 +1057,20 @@ class DatabaseManager:
     def get_mark_photos_filename(self, mark_id):
         """Получение всех фотографий метки"""
         query = """
-        SELECT filename 
+        SELECT filename, variants
         FROM photos 
         WHERE mark_id = %s AND is_main = FALSE
         ORDER BY is_main DESC, created_at ASC;
         """
         result = self._execute_query(query, (mark_id,))
         if result:
-            return [{"filename": photo_data[0]} for photo_data in result]
+            return [{"filename": photo_data[0], "variants": photo_data[1]} for photo_data in result]
         return []
     
     def get_main_photo_filename(self, mark_id):
         """Получение главной фотографии метки"""
         query = """
-        SELECT filename
+        SELECT filename, variants
         FROM photos 
         WHERE mark_id = %s AND is_main = TRUE 
         LIMIT 1;
@@ -336,6 +1080,210 @@ class DatabaseManager:
             return result[0]
         return None
     
+    def set_photo_variants(self, photo_id, variants):
+        """Сохранение имен файлов производных размеров фото, возвращает id метки"""
+        query = "UPDATE photos SET variants = %s WHERE id = %s RETURNING mark_id;"
+        with self.transaction() as cursor:
+            cursor.execute(query, (Json(variants), photo_id))
+            result = cursor.fetchone()
+        return result[0] if result else None
+    
+    def get_mark_with_photos(self, mark_id):
+        """Получение метки вместе с главным и дополнительными фото одним запросом"""
+        query = """
+        SELECT m.id, m.user_id, m.title, m.description, m.visit_date, m.address, m.lat, m.lon, m.created_at,
+               main.filename, main.variants,
+               COALESCE(
+                   (SELECT json_agg(json_build_object('filename', p.filename, 'variants', p.variants)
+                                    ORDER BY p.created_at)
+                    FROM photos p
+                    WHERE p.mark_id = m.id AND p.is_main = FALSE),
+                   '[]'
+               )
+        FROM marks m
+        LEFT JOIN LATERAL (
+            SELECT filename, variants FROM photos
+            WHERE mark_id = m.id AND is_main = TRUE
+            LIMIT 1
+        ) main ON TRUE
+        WHERE m.id = %s;
+        """
+        mark = self._execute_query(query, (mark_id,), fetch=FETCH_ONE, prepare=True)
+        if mark:
+            return {
+                "id": mark[0],
+                "user_id": mark[1],
+                "title": mark[2],
+                "description": mark[3],
+                "visit_date": mark[4],
+                "address": mark[5],
+                "lat": mark[6],
+                "lon": mark[7],
+                "created_at": mark[8],
+                "main_photo": {"filename": mark[9], "variants": mark[10]} if mark[9] else None,
+                "photos": mark[11]
+            }
+        return None
+
+    def delete_mark_photos(self, mark_id, is_main=None, cursor=None):
+        """Удаление фото метки (всех, только главного или только дополнительных)
+
+        Файлы ставятся в очередь pending_deletes той же транзакцией,
+        с диска их уберет PhotoGarbageCollector после commit.
+        """
+        condition = "mark_id = %s"
+        params = [mark_id]
+        if is_main is not None:
+            condition += " AND is_main = %s"
+            params.append(is_main)
+        query = f"""
+        WITH deleted AS (
+            DELETE FROM photos WHERE {condition}
+            RETURNING filename, variants
+        ), queued AS (
+            INSERT INTO pending_deletes (filename)
+            SELECT DISTINCT filename FROM deleted
+        )
+        SELECT filename, variants FROM deleted;
+        """
+
+        if cursor is not None:
+            cursor.execute(query, params)
+            result = cursor.fetchall()
+        else:
+            with self.transaction() as cursor:
+                cursor.execute(query, params)
+                result = cursor.fetchall()
+        return [{"filename": photo[0], "variants": photo[1]} for photo in result]
+
+    def add_photos(self, photos, cursor):
+        """Добавление фото к нескольким меткам одним INSERT
+
+        photos - кортежи (mark_id, filename, is_main); у меток с новым главным
+        фото флаг снимается с прежнего.
+        """
+        if not photos:
+            return []
+        main_mark_ids = [mark_id for mark_id, filename, is_main in photos if is_main]
+        if main_mark_ids:
+            self._execute_query(
+                "UPDATE photos SET is_main = FALSE WHERE mark_id = ANY(%s) AND is_main = TRUE;",
+                (main_mark_ids,), cursor
+            )
+        # Те же файлы загрузили снова - они больше не мусор
+        self._execute_query(
+            "DELETE FROM pending_deletes WHERE filename = ANY(%s);",
+            (list({photo[1] for photo in photos}),), cursor
+        )
+        result = execute_values(cursor, """
+            INSERT INTO photos (mark_id, filename, is_main)
+            VALUES %s
+            RETURNING id, mark_id, filename, is_main;
+        """, photos, page_size=1000, fetch=True)
+        return [
+            {'id': row[0], 'mark_id': row[1], 'filename': row[2], 'is_main': row[3]}
+            for row in result
+        ]
+
+    def delete_marks_photos(self, mark_ids, is_main=None, cursor=None):
+        """Удаление фото нескольких меток одним запросом, файлы - в pending_deletes"""
+        if not mark_ids:
+            return []
+        condition = "mark_id = ANY(%s)"
+        params = [list(mark_ids)]
+        if is_main is not None:
+            condition += " AND is_main = %s"
+            params.append(is_main)
+        query = f"""
+        WITH deleted AS (
+            DELETE FROM photos WHERE {condition}
+            RETURNING mark_id, filename, variants
+        ), queued AS (
+            INSERT INTO pending_deletes (filename)
+            SELECT DISTINCT filename FROM deleted
+        )
+        SELECT mark_id, filename, variants FROM deleted;
+        """
+        result = self._execute_query(query, params, cursor, fetch=FETCH_ALL)
+        return [{"mark_id": photo[0], "filename": photo[1], "variants": photo[2]} for photo in result]
+
+    def get_referenced_filenames(self, filenames, cursor=None):
+        """Какие из файлов еще используются хотя бы одной фотографией"""
+        if not filenames:
+            return set()
+        query = "SELECT DISTINCT filename FROM photos WHERE filename = ANY(%s);"
+        result = self._execute_query(query, (list(filenames),), cursor)
+        return {row[0] for row in result} if result else set()
+
+    def get_all_photo_filenames(self, cursor=None):
+        """Все имена файлов, на которые ссылается таблица photos"""
+        result = self._execute_query("SELECT DISTINCT filename FROM photos;", cursor=cursor)
+        return {row[0] for row in result} if result else set()
+
+    # ОЧЕРЕДЬ УДАЛЕНИЯ ФАЙЛОВ
+    def enqueue_photo_deletes(self, filenames, cursor=None):
+        """Постановка файлов в очередь на удаление"""
+        if not filenames:
+            return None
+        query = "INSERT INTO pending_deletes (filename) SELECT unnest(%s::varchar[]);"
+        return self._execute_query(query, (list(filenames),), cursor)
+
+    def claim_pending_deletes(self, limit, delay, cursor):
+        """Пачка записей очереди старше delay секунд, заблокированная до конца транзакции
+
+        SKIP LOCKED позволяет нескольким сборщикам разбирать очередь параллельно.
+        """
+        query = """
+        SELECT id, filename, attempts FROM pending_deletes
+        WHERE run_after <= CURRENT_TIMESTAMP - make_interval(secs => %s)
+        ORDER BY id
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED;
+        """
+        result = self._execute_query(query, (delay, limit), cursor)
+        return [{'id': row[0], 'filename': row[1], 'attempts': row[2]} for row in result]
+
+    def finish_pending_deletes(self, done_ids, failed, retry_delay, cursor):
+        """Удаление обработанных записей и откладывание неудачных (id, ошибка)"""
+        if done_ids:
+            self._execute_query(
+                "DELETE FROM pending_deletes WHERE id = ANY(%s);",
+                (list(done_ids),),
+                cursor
+            )
+        for delete_id, error in failed:
+            # Повтор с растущей паузой, чтобы битый файл не занимал каждую пачку
+            self._execute_query("""
+                UPDATE pending_deletes
+                SET attempts = attempts + 1,
+                    last_error = %s,
+                    run_after = CURRENT_TIMESTAMP + make_interval(secs => %s * (attempts + 1))
+                WHERE id = %s;
+            """, (error, retry_delay, delete_id), cursor)
+
+    def try_advisory_lock(self, key, cursor):
+        """Неблокирующая advisory-блокировка до конца транзакции"""
+        result = self._execute_query("SELECT pg_try_advisory_xact_lock(%s);", (key,), cursor)
+        return bool(result and result[0][0])
+
+    def lock_photo_files(self, filenames, cursor):
+        """Блокировка имен файлов фото до конца транзакции (ждет сборщик, если он их держит)"""
+        # Порядок захвата один для всех запросов - взаимной блокировки загрузок нет
+        query = """
+            SELECT pg_advisory_xact_lock(%s, hashtext(filename))
+            FROM (SELECT DISTINCT unnest(%s::text[]) AS filename ORDER BY 1) AS files;
+        """
+        self._execute_query(query, (PHOTO_FILE_LOCK_SPACE, sorted(filenames)), cursor)
+
+    def try_lock_photo_files(self, filenames, cursor):
+        """Неблокирующая блокировка имен файлов фото, возвращает захваченные имена"""
+        query = """
+            SELECT filename FROM unnest(%s::text[]) AS filename
+            WHERE pg_try_advisory_xact_lock(%s, hashtext(filename));
+        """
+        result = self._execute_query(query, (sorted(filenames), PHOTO_FILE_LOCK_SPACE), cursor)
+        return {row[0] for row in result or []}
+
     def delete_photo(self, photo_id):
         """Удаление фотографии"""
         query = "DELETE FROM photos WHERE id = %s;"
@@ -372,6 +1320,501 @@ class DatabaseManager:
         query = "DELETE FROM photos WHERE mark_id = %s AND is_main = False;"
         return self._execute_query(query, (mark_id,))
 
+    # DAO МЕТОДЫ ДЛЯ КЛАСТЕРОВ
+    def add_mark_to_clusters(self, user_id, mark_id, lat, lon, cursor=None):
+        """Добавление метки в ячейки кластеров всех масштабов"""
+        return self.add_marks_to_clusters(user_id, [(mark_id, lat, lon)], cursor)
+
+    def add_marks_to_clusters(self, user_id, marks, cursor=None):
+        """Добавление меток (mark_id, lat, lon) в кластеры одним INSERT ... ON CONFLICT"""
+        # ON CONFLICT не может менять одну строку дважды - суммируем по ячейкам заранее
+        clusters = {}
+        for mark_id, lat, lon in marks:
+            lat, lon = float(lat), float(lon)
+            for cell in geo.cluster_cells(lat, lon):
+                cluster = clusters.setdefault(cell, [0, 0.0, 0.0, mark_id])
+                cluster[0] += 1
+                cluster[1] += lat
+                cluster[2] += lon
+        if not clusters:
+            return 0
+
+        values = ", ".join(["(%s, %s, %s, %s, %s, %s, %s, %s)"] * len(clusters))
+        params = []
+        for cell, cluster in clusters.items():
+            params.extend([user_id, *cell, *cluster])
+
+        query = f"""
+        INSERT INTO mark_clusters
+        (user_id, zoom, cell_x, cell_y, mark_count, sum_lat, sum_lon, mark_id)
+        VALUES {values}
+        ON CONFLICT (user_id, zoom, cell_x, cell_y) DO UPDATE SET
+            mark_count = mark_clusters.mark_count + EXCLUDED.mark_count,
+            sum_lat = mark_clusters.sum_lat + EXCLUDED.sum_lat,
+            sum_lon = mark_clusters.sum_lon + EXCLUDED.sum_lon,
+            mark_id = COALESCE(mark_clusters.mark_id, EXCLUDED.mark_id);
+        """
+        return self._execute_query(query, params, cursor)
+
+    def remove_mark_from_clusters(self, user_id, mark_id, lat, lon, cursor=None):
+        """Удаление метки из ячеек кластеров всех масштабов"""
+        if cursor is None:
+            with self.transaction() as cursor:
+                return self.remove_mark_from_clusters(user_id, mark_id, lat, lon, cursor)
+
+        lat, lon = float(lat), float(lon)
+        cells = geo.cluster_cells(lat, lon)
+        values = ", ".join(["(%s, %s, %s)"] * len(cells))
+        params = [lat, lon, mark_id]
+        for cell in cells:
+            params.extend(cell)
+        params.append(user_id)
+
+        cursor.execute(f"""
+            UPDATE mark_clusters c SET
+                mark_count = c.mark_count - 1,
+                sum_lat = c.sum_lat - %s,
+                sum_lon = c.sum_lon - %s,
+                mark_id = NULLIF(c.mark_id, %s)
+            FROM (VALUES {values}) AS v(zoom, cell_x, cell_y)
+            WHERE c.zoom = v.zoom AND c.cell_x = v.cell_x AND c.cell_y = v.cell_y
+              AND c.user_id = %s
+            RETURNING c.zoom, c.mark_count, c.mark_id;
+        """, params)
+        orphaned_zooms = sorted(
+            (zoom for zoom, mark_count, cell_mark_id in cursor.fetchall()
+             if mark_count > 0 and cell_mark_id is None),
+            reverse=True
+        )
+
+        cursor.execute(
+            "DELETE FROM mark_clusters WHERE user_id = %s AND mark_count <= 0;",
+            (user_id,)
+        )
+
+        # Ячейки вложены друг в друга, поэтому метка из самой мелкой
+        # ячейки без представителя подходит и для всех более крупных
+        if orphaned_zooms:
+            zoom = orphaned_zooms[0]
+            cell = geo.cluster_cell(lat, lon, zoom)
+            south, west, north, east = geo.cluster_cell_bounds(zoom, *cell)
+            cursor.execute("""
+                SELECT id, lat, lon FROM marks
+                WHERE user_id = %s AND id <> %s
+                  AND point(lon::float8, lat::float8) <@ box(point(%s, %s), point(%s, %s))
+                LIMIT 5;
+            """, (user_id, mark_id, west, south, east, north))
+            for other_id, other_lat, other_lon in cursor.fetchall():
+                if geo.cluster_cell(float(other_lat), float(other_lon), zoom) == cell:
+                    cursor.execute("""
+                        UPDATE mark_clusters SET mark_id = %s
+                        WHERE user_id = %s AND mark_id IS NULL AND zoom = ANY(%s);
+                    """, (other_id, user_id, orphaned_zooms))
+                    break
+
+    def remove_marks_from_clusters(self, user_id, marks, cursor):
+        """Удаление меток (mark_id, lat, lon) из кластеров: одно UPDATE ... FROM (VALUES ...)
+
+        Ячейкам, потерявшим представителя, он подбирается снизу вверх: на
+        CLUSTER_MAX_ZOOM - из меток в границах ячейки, выше - из вложенных ячеек
+        следующего масштаба (ячейка z+1 лежит в ячейке z с координатами // 2).
+        """
+        removed_ids = []
+        clusters = {}
+        for mark_id, lat, lon in marks:
+            lat, lon = float(lat), float(lon)
+            removed_ids.append(mark_id)
+            for cell in geo.cluster_cells(lat, lon):
+                cluster = clusters.setdefault(cell, [0, 0.0, 0.0])
+                cluster[0] += 1
+                cluster[1] += lat
+                cluster[2] += lon
+        if not clusters:
+            return
+
+        values = ", ".join(["(%s::integer, %s::integer, %s::integer, %s::integer, %s::float8, %s::float8)"] * len(clusters))
+        params = [removed_ids]
+        for cell, cluster in clusters.items():
+            params.extend([*cell, *cluster])
+        params.append(user_id)
+        cursor.execute(f"""
+            UPDATE mark_clusters c SET
+                mark_count = c.mark_count - v.mark_count,
+                sum_lat = c.sum_lat - v.sum_lat,
+                sum_lon = c.sum_lon - v.sum_lon,
+                mark_id = CASE WHEN c.mark_id = ANY(%s) THEN NULL ELSE c.mark_id END
+            FROM (VALUES {values}) AS v(zoom, cell_x, cell_y, mark_count, sum_lat, sum_lon)
+            WHERE c.zoom = v.zoom AND c.cell_x = v.cell_x AND c.cell_y = v.cell_y
+              AND c.user_id = %s
+            RETURNING c.zoom, c.cell_x, c.cell_y, c.mark_count, c.mark_id;
+        """, params)
+        orphaned = [
+            (zoom, cell_x, cell_y) for zoom, cell_x, cell_y, mark_count, cell_mark_id in cursor.fetchall()
+            if mark_count > 0 and cell_mark_id is None
+        ]
+
+        cursor.execute(
+            "DELETE FROM mark_clusters WHERE user_id = %s AND mark_count <= 0;",
+            (user_id,)
+        )
+        if not orphaned:
+            return
+
+        finest = [cell for cell in orphaned if cell[0] == geo.CLUSTER_MAX_ZOOM]
+        if finest:
+            boxes = []
+            box_params = [user_id]
+            for zoom, cell_x, cell_y in finest:
+                south, west, north, east = geo.cluster_cell_bounds(zoom, cell_x, cell_y)
+                boxes.append("point(lon::float8, lat::float8) <@ box(point(%s, %s), point(%s, %s))")
+                box_params.extend([west, south, east, north])
+            cursor.execute(f"""
+                SELECT id, lat, lon FROM marks
+                WHERE user_id = %s AND ({" OR ".join(boxes)});
+            """, box_params)
+            representatives = {}
+            for other_id, other_lat, other_lon in cursor.fetchall():
+                cell = geo.cluster_cell(float(other_lat), float(other_lon), geo.CLUSTER_MAX_ZOOM)
+                representatives.setdefault(cell, other_id)
+            for zoom, cell_x, cell_y in finest:
+                if (cell_x, cell_y) in representatives:
+                    cursor.execute("""
+                        UPDATE mark_clusters SET mark_id = %s
+                        WHERE user_id = %s AND zoom = %s AND cell_x = %s AND cell_y = %s;
+                    """, (representatives[(cell_x, cell_y)], user_id, zoom, cell_x, cell_y))
+
+        for zoom in sorted({cell[0] for cell in orphaned if cell[0] < geo.CLUSTER_MAX_ZOOM}, reverse=True):
+            cursor.execute("""
+                UPDATE mark_clusters c SET mark_id = (
+                    SELECT child.mark_id FROM mark_clusters child
+                    WHERE child.user_id = c.user_id AND child.zoom = c.zoom + 1
+                      AND child.cell_x IN (c.cell_x * 2, c.cell_x * 2 + 1)
+                      AND child.cell_y IN (c.cell_y * 2, c.cell_y * 2 + 1)
+                      AND child.mark_id IS NOT NULL
+                    LIMIT 1
+                )
+                WHERE c.user_id = %s AND c.zoom = %s AND c.mark_id IS NULL;
+            """, (user_id, zoom))
+
+    def get_mark_clusters(self, user_id, zoom, cell_ranges):
+        """Получение кластеров пользователя на масштабе в диапазонах ячеек"""
+        if not cell_ranges:
+            return []
+
+        range_conditions = " OR ".join(
+            ["(cell_x BETWEEN %s AND %s AND cell_y BETWEEN %s AND %s)"] * len(cell_ranges)
+        )
+        params = [user_id, zoom]
+        for cell_range in cell_ranges:
+            params.extend(cell_range)
+
+        query = f"""
+        SELECT mark_count, sum_lat / mark_count, sum_lon / mark_count, mark_id
+        FROM mark_clusters
+        WHERE user_id = %s AND zoom = %s AND ({range_conditions});
+        """
+        result = self._execute_query(query, params)
+        if result:
+            return [{
+                "count": cluster[0],
+                "lat": cluster[1],
+                "lon": cluster[2],
+                "mark_id": cluster[3] if cluster[0] == 1 else None
+            } for cluster in result]
+        return []
+
+    def rebuild_mark_clusters(self, user_id=None, cursor=None):
+        """Полный пересчет кластеров (всех или одного пользователя)"""
+        if cursor is None:
+            with self.transaction() as cursor:
+                return self.rebuild_mark_clusters(user_id, cursor)
+
+        if user_id is None:
+            cursor.execute("DELETE FROM mark_clusters;")
+            cursor.execute("SELECT id, user_id, lat, lon FROM marks;")
+        else:
+            cursor.execute("DELETE FROM mark_clusters WHERE user_id = %s;", (user_id,))
+            cursor.execute("SELECT id, user_id, lat, lon FROM marks WHERE user_id = %s;", (user_id,))
+
+        clusters = {}
+        for mark_id, mark_user_id, lat, lon in cursor.fetchall():
+            lat, lon = float(lat), float(lon)
+            for zoom, cell_x, cell_y in geo.cluster_cells(lat, lon):
+                cluster = clusters.setdefault(
+                    (mark_user_id, zoom, cell_x, cell_y), [0, 0.0, 0.0, mark_id]
+                )
+                cluster[0] += 1
+                cluster[1] += lat
+                cluster[2] += lon
+
+        execute_values(cursor, """
+            INSERT INTO mark_clusters
+            (user_id, zoom, cell_x, cell_y, mark_count, sum_lat, sum_lon, mark_id)
+            VALUES %s;
+        """, [key + tuple(value) for key, value in clusters.items()], page_size=1000)
+        print(f"✅ Кластеры пересчитаны: {len(clusters)} ячеек")
+
+    def ensure_mark_clusters(self):
+        """Первичное заполнение кластеров для уже существующих меток"""
+        result = self._execute_query("""
+            SELECT EXISTS (SELECT 1 FROM marks), EXISTS (SELECT 1 FROM mark_clusters);
+        """)
+        if result and result[0][0] and not result[0][1]:
+            self.rebuild_mark_clusters()
+
+    # DAO МЕТОДЫ ДЛЯ СТАТИСТИКИ
+    def update_mark_stats(self, user_id, added=(), removed=(), changes=0, cursor=None):
+        """Учет добавленных и удаленных меток (visit_date, lat, lon) в статистике"""
+        return self.apply_mark_stats(user_id, mark_stats.stats_deltas(added, removed, changes), cursor)
+
+    def apply_mark_stats(self, user_id, deltas, cursor=None):
+        """Изменения счетчиков {(kind, bucket): diff} пользователя и общих одним запросом
+
+        Общий user_count меняется, когда счетчик пользователя переходит через
+        ноль. Строки обновляются в порядке (kind, bucket), чтобы параллельные
+        транзакции брали блокировки в одном порядке и не ловили deadlock.
+        """
+        deltas = sorted((bucket, diff) for bucket, diff in deltas.items() if diff)
+        if not deltas:
+            return 0
+        if cursor is None:
+            with self.transaction() as cursor:
+                return self.apply_mark_stats(user_id, dict(deltas), cursor)
+
+        values = ", ".join(["(%s, %s, %s::integer)"] * len(deltas))
+        params = []
+        for (kind, bucket), diff in deltas:
+            params.extend([kind, bucket, diff])
+        params.append(user_id)
+
+        query = f"""
+        WITH delta (kind, bucket, diff) AS (VALUES {values}),
+        changed AS (
+            INSERT INTO mark_stats (user_id, kind, bucket, mark_count)
+            SELECT %s, kind, bucket, diff FROM delta
+            ORDER BY kind, bucket
+            ON CONFLICT (user_id, kind, bucket) DO UPDATE SET
+                mark_count = mark_stats.mark_count + EXCLUDED.mark_count
+            RETURNING kind, bucket, mark_count
+        )
+        INSERT INTO mark_stats_global (kind, bucket, mark_count, user_count)
+        SELECT d.kind, d.bucket, d.diff,
+               (c.mark_count > 0)::integer - (c.mark_count - d.diff > 0)::integer
+        FROM changed c JOIN delta d ON d.kind = c.kind AND d.bucket = c.bucket
+        ORDER BY d.kind, d.bucket
+        ON CONFLICT (kind, bucket) DO UPDATE SET
+            mark_count = mark_stats_global.mark_count + EXCLUDED.mark_count,
+            user_count = mark_stats_global.user_count + EXCLUDED.user_count;
+        """
+        result = self._execute_query(query, params, cursor)
+        if any(diff < 0 for bucket, diff in deltas):
+            self._execute_query(
+                "DELETE FROM mark_stats WHERE user_id = %s AND mark_count <= 0;", (user_id,), cursor
+            )
+        return result
+
+    def remove_users_from_mark_stats(self, user_ids, cursor):
+        """Вычитание счетчиков пользователей из общих - перед удалением самих пользователей"""
+        query = """
+        WITH removed AS (
+            DELETE FROM mark_stats WHERE user_id = ANY(%s) AND mark_count > 0
+            RETURNING kind, bucket, mark_count
+        )
+        UPDATE mark_stats_global g SET
+            mark_count = g.mark_count - r.mark_count,
+            user_count = g.user_count - r.users
+        FROM (
+            SELECT kind, bucket, sum(mark_count) AS mark_count, count(*) AS users
+            FROM removed GROUP BY kind, bucket
+        ) r
+        WHERE g.kind = r.kind AND g.bucket = r.bucket;
+        """
+        return self._execute_query(query, (list(user_ids),), cursor)
+
+    def get_mark_stats(self, user_id, top_cells=mark_stats.DEFAULT_TOP_CELLS):
+        """Счетчики пользователя; ячеек geohash - только top_cells самых заполненных"""
+        query = """
+        SELECT kind, bucket, mark_count, NULL, cells FROM (
+            SELECT kind, bucket, mark_count,
+                   count(*) OVER (PARTITION BY kind) AS cells,
+                   row_number() OVER (PARTITION BY kind ORDER BY mark_count DESC, bucket) AS position
+            FROM mark_stats
+            WHERE user_id = %s AND mark_count > 0
+        ) ranked
+        WHERE kind NOT LIKE 'geohash%%' OR position <= %s;
+        """
+        return to_records(MarkStatsRecord, self._execute_query(query, (user_id, top_cells)))
+
+    def get_global_mark_stats(self, top_cells=mark_stats.DEFAULT_TOP_CELLS):
+        """Общие счетчики всех пользователей с числом пользователей в каждом срезе"""
+        query = """
+        SELECT kind, bucket, mark_count, user_count, cells FROM (
+            SELECT kind, bucket, mark_count, user_count,
+                   count(*) OVER (PARTITION BY kind) AS cells,
+                   row_number() OVER (PARTITION BY kind ORDER BY mark_count DESC, bucket) AS position
+            FROM mark_stats_global
+            WHERE mark_count > 0
+        ) ranked
+        WHERE kind NOT LIKE 'geohash%%' OR position <= %s;
+        """
+        return to_records(MarkStatsRecord, self._execute_query(query, (top_cells,)))
+
+    def rebuild_mark_stats(self):
+        """Полный пересчет статистики по таблице marks
+
+        activity из меток не восстановить - счетчики пользователей за прошлые
+        месяцы остаются, общие пересобираются из счетчиков пользователей.
+        """
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                # Изменения меток ждут конца пересчета: их счетчики лягут поверх
+                # пересчитанных, а не потеряются и не посчитаются дважды
+                cursor.execute("LOCK TABLE mark_stats, mark_stats_global IN EXCLUSIVE MODE;")
+                cursor.execute("DELETE FROM mark_stats WHERE kind <> %s;", (mark_stats.ACTIVITY,))
+                cursor.execute("SELECT user_id, visit_date, lat, lon FROM marks;")
+
+                counts = {}
+                for user_id, visit_date, lat, lon in cursor.fetchall():
+                    for kind, bucket in mark_stats.mark_buckets(visit_date, lat, lon):
+                        key = (user_id, kind, bucket)
+                        counts[key] = counts.get(key, 0) + 1
+
+                execute_values(cursor, """
+                    INSERT INTO mark_stats (user_id, kind, bucket, mark_count)
+                    VALUES %s;
+                """, [key + (count,) for key, count in counts.items()], page_size=1000)
+
+                cursor.execute("DELETE FROM mark_stats_global;")
+                cursor.execute("""
+                    INSERT INTO mark_stats_global (kind, bucket, mark_count, user_count)
+                    SELECT kind, bucket, sum(mark_count), count(*)
+                    FROM mark_stats
+                    WHERE mark_count > 0
+                    GROUP BY kind, bucket;
+                """)
+
+                conn.commit()
+                print(f"✅ Статистика пересчитана: {len(counts)} счетчиков")
+        except Exception as e:
+            if conn:
+                conn.rollback()
+            print(f"❌ Ошибка пересчета статистики: {e}")
+            raise e
+        finally:
+            self.return_connection(conn)
+
+    def ensure_mark_stats(self):
+        """Первичное заполнение статистики для уже существующих меток"""
+        result = self._execute_query("""
+            SELECT EXISTS (SELECT 1 FROM marks),
+                   EXISTS (SELECT 1 FROM mark_stats_global WHERE kind = %s);
+        """, (mark_stats.TOTAL,))
+        if result and result[0][0] and not result[0][1]:
+            self.rebuild_mark_stats()
+
+    # DAO МЕТОДЫ ДЛЯ КЕША ГЕОКОДЕРА
+    def get_geocode_cache(self, cache_key):
+        """Непросроченный ответ геокодера из кеша или None"""
+        query = """
+        UPDATE geocode_cache SET hits = hits + 1
+        WHERE cache_key = %s AND expires_at > CURRENT_TIMESTAMP
+        RETURNING response;
+        """
+        result = self._execute_query(query, (cache_key,), fetch=FETCH_ONE, prepare=True)
+        return result[0] if result else None
+
+    def put_geocode_cache(self, cache_key, response, ttl):
+        """Сохранение ответа геокодера на ttl секунд"""
+        query = """
+        INSERT INTO geocode_cache (cache_key, response, expires_at)
+        VALUES (%s, %s, CURRENT_TIMESTAMP + make_interval(secs => %s))
+        ON CONFLICT (cache_key) DO UPDATE
+        SET response = EXCLUDED.response, created_at = CURRENT_TIMESTAMP, expires_at = EXCLUDED.expires_at;
+        """
+        return self._execute_query(query, (cache_key, Json(response), ttl), prepare=True)
+
+    def purge_geocode_cache(self):
+        """Удаление просроченных ответов геокодера"""
+        return self._execute_query("DELETE FROM geocode_cache WHERE expires_at <= CURRENT_TIMESTAMP;")
+
+    # DAO МЕТОДЫ ДЛЯ ОЧЕРЕДИ ЗАДАЧ
+    def enqueue_job(self, kind, payload, delay=0, max_attempts=5, cursor=None):
+        """Постановка задачи в очередь и уведомление воркеров (NOTIFY jobs)"""
+        query = """
+        WITH job AS (
+            INSERT INTO jobs (kind, payload, max_attempts, run_after)
+            VALUES (%s, %s, %s, CURRENT_TIMESTAMP + make_interval(secs => %s))
+            RETURNING id
+        )
+        SELECT id, pg_notify('jobs', %s) FROM job;
+        """
+        params = (kind, Json(payload), max_attempts, delay, kind)
+        result = self._execute_query(query, params, cursor=cursor, fetch=FETCH_ONE, prepare=True)
+        return result[0] if result else None
+
+    def enqueue_jobs(self, kind, payloads, cursor=None):
+        """Постановка нескольких задач одного типа одним INSERT и одним NOTIFY"""
+        if not payloads:
+            return []
+        values = ", ".join(["(%s, %s)"] * len(payloads))
+        params = []
+        for payload in payloads:
+            params.extend([kind, Json(payload)])
+        query = f"""
+        WITH job AS (
+            INSERT INTO jobs (kind, payload) VALUES {values}
+            RETURNING id
+        ), notified AS (
+            SELECT pg_notify('jobs', %s)
+        )
+        SELECT job.id FROM job, notified;
+        """
+        result = self._execute_query(query, params + [kind], cursor=cursor, fetch=FETCH_ALL)
+        return [row[0] for row in result]
+
+    def claim_jobs(self, kinds, limit, lease):
+        """Захват готовых задач на lease секунд; занятые другими воркерами пропускаются"""
+        query = """
+        UPDATE jobs
+        SET attempts = attempts + 1,
+            locked_until = CURRENT_TIMESTAMP + make_interval(secs => %s)
+        WHERE id IN (
+            SELECT id FROM jobs
+            WHERE status = 'queued'
+              AND kind = ANY(%s)
+              AND run_after <= CURRENT_TIMESTAMP
+              AND (locked_until IS NULL OR locked_until < CURRENT_TIMESTAMP)
+            ORDER BY run_after, id
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING id, kind, payload, attempts, max_attempts;
+        """
+        return self._execute_query(query, (lease, list(kinds), limit), fetch=FETCH_ALL, prepare=True)
+
+    def complete_job(self, job_id):
+        """Удаление выполненной задачи"""
+        return self._execute_query("DELETE FROM jobs WHERE id = %s;", (job_id,), prepare=True)
+
+    def fail_job(self, job_id, error, retry_delay):
+        """Повтор задачи через retry_delay секунд или пометка failed после max_attempts"""
+        query = """
+        UPDATE jobs
+        SET status = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE 'queued' END,
+            run_after = CURRENT_TIMESTAMP + make_interval(secs => %s),
+            locked_until = NULL,
+            last_error = %s
+        WHERE id = %s;
+        """
+        return self._execute_query(query, (retry_delay, error[:2000], job_id), prepare=True)
+
+    def get_job_stats(self):
+        """Число задач по типу и статусу"""
+        return self._execute_query("""
+            SELECT kind, status, COUNT(*) FROM jobs GROUP BY kind, status ORDER BY kind, status;
+        """)
+
     # УТИЛИТНЫЕ МЕТОДЫ
     def get_user_with_marks_coords(self, telegram_id):
         """Получение пользователя со всеми его метками и фото"""
@@ -379,19 +1822,19 @@ class DatabaseManager:
         if not user:
             return None
         
-        marks = self.get_user_marks(user[0])  # user[0] - id пользователя
+        marks = self.get_user_marks(user.id)
         result_user = {
-            'id': user[0],
-            'telegram_id': user[1],
-            'created_at': user[2],
+            'id': user.id,
+            'telegram_id': user.telegram_id,
+            'created_at': user.created_at,
             'marks': []
         }
         
         for mark in marks:
             mark_dict = {
-                'id': mark[0],
-                'x': float(mark[6]),
-                'y': float(mark[7])
+                'id': mark.id,
+                'x': float(mark.lat),
+                'y': float(mark.lon)
             }
             result_user['marks'].append(mark_dict)
         
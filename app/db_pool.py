@@ -0,0 +1,196 @@
+import threading
+import time
+from collections import deque
+import psycopg2 # type: ignore
+from psycopg2 import extensions # type: ignore
+from instrumentation import Histogram, TracingCursor
+
+
+# Границы корзин гистограммы времени выдачи соединения, в миллисекундах
+CHECKOUT_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+# Соединение помнит имена подготовленных на нем запросов (PREPARE живет
+# до закрытия сессии), чтобы DatabaseManager готовил каждый запрос один раз.
+# Курсоры по умолчанию учитывают время запросов для метрик и Server-Timing.
+class PreparingConnection(extensions.connection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+        self.cursor_factory = TracingCursor
+
+
+# Пул соединений psycopg2 с ожиданием свободного соединения (вместо ошибки
+# "connection pool exhausted"), проверкой соединения при выдаче и заменой
+# разорванных соединений - после рестарта Postgres пул восстанавливается сам.
+class ManagedConnectionPool:
+    def __init__(self, min_conn, max_conn, checkout_timeout=10, check_after=30, max_lifetime=3600, **connect_kwargs):
+        self.min_conn = min_conn
+        self.max_conn = max_conn
+        self.checkout_timeout = checkout_timeout
+        # Соединение, пролежавшее без дела дольше check_after, проверяется SELECT 1
+        self.check_after = check_after
+        self.max_lifetime = max_lifetime
+        connect_kwargs.setdefault('connection_factory', PreparingConnection)
+        self.connect_kwargs = connect_kwargs
+
+        self.condition = threading.Condition()
+        self.idle = deque()
+        self.created_at = {}
+        self.size = 0
+        self.in_use = 0
+        self.waiting = 0
+        self.closed = False
+
+        self.checkouts = 0
+        self.timeouts = 0
+        self.connects = 0
+        self.discarded = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+        self.checkout_histogram = Histogram(CHECKOUT_BUCKETS_MS)
+
+        for _ in range(min_conn):
+            conn = self._connect()
+            with self.condition:
+                self.size += 1
+                self.idle.append((conn, time.monotonic()))
+
+    def _connect(self):
+        conn = psycopg2.connect(**self.connect_kwargs)
+        with self.condition:
+            self.created_at[id(conn)] = time.monotonic()
+            self.connects += 1
+        return conn
+
+    def _discard(self, conn):
+        with self.condition:
+            self.created_at.pop(id(conn), None)
+            self.discarded += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _is_usable(self, conn, idle_since):
+        """Проверка соединения перед выдачей"""
+        if conn.closed:
+            return False
+        now = time.monotonic()
+        if self.max_lifetime and now - self.created_at.get(id(conn), now) > self.max_lifetime:
+            return False
+        if now - idle_since < self.check_after:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1;")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self, timeout=None):
+        """Соединение из пула; ждет освобождения не дольше timeout секунд"""
+        timeout = self.checkout_timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+        waited = 0.0
+
+        conn = None
+        idle_since = None
+        with self.condition:
+            if self.closed:
+                raise PoolTimeout("Пул соединений закрыт")
+            while not self.idle and self.size >= self.max_conn:
+                if self.closed:
+                    raise PoolTimeout("Пул соединений закрыт")
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.timeouts += 1
+                    raise PoolTimeout(f"Нет свободного соединения за {timeout} с (занято {self.in_use})")
+                self.waiting += 1
+                wait_started = time.monotonic()
+                self.condition.wait(remaining)
+                waited += time.monotonic() - wait_started
+                self.waiting -= 1
+            if self.idle:
+                conn, idle_since = self.idle.pop()
+            else:
+                self.size += 1
+            self.in_use += 1
+
+        # Проверка и подключение - вне блокировки, чтобы не держать других
+        try:
+            if conn is None:
+                conn = self._connect()
+            elif not self._is_usable(conn, idle_since):
+                self._discard(conn)
+                conn = self._connect()
+        except Exception:
+            with self.condition:
+                self.size -= 1
+                self.in_use -= 1
+                self.condition.notify()
+            raise
+
+        with self.condition:
+            self.checkouts += 1
+            self.wait_time_total += waited
+            self.wait_time_max = max(self.wait_time_max, waited)
+            self.checkout_histogram.observe((time.monotonic() - started) * 1000)
+        return conn
+
+    def putconn(self, conn, close=False):
+        """Возврат соединения; разорванные и закрытые выбрасываются из пула"""
+        if not close and not conn.closed:
+            try:
+                # Незавершенная транзакция не должна достаться следующему
+                if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                close = True
+
+        with self.condition:
+            self.in_use -= 1
+            if close or conn.closed or self.closed:
+                self.size -= 1
+                discard = True
+            else:
+                self.idle.append((conn, time.monotonic()))
+                discard = False
+            self.condition.notify()
+        if discard:
+            self._discard(conn)
+
+    def closeall(self):
+        with self.condition:
+            self.closed = True
+            idle = list(self.idle)
+            self.idle.clear()
+            self.size -= len(idle)
+            self.condition.notify_all()
+        for conn, _ in idle:
+            self._discard(conn)
+
+    def stats(self):
+        """Метрики пула для подбора размера под реальную нагрузку"""
+        with self.condition:
+            return {
+                'min': self.min_conn,
+                'max': self.max_conn,
+                'size': self.size,
+                'in_use': self.in_use,
+                'idle': len(self.idle),
+                'waiting': self.waiting,
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'connects': self.connects,
+                'discarded': self.discarded,
+                'wait_time_total_s': round(self.wait_time_total, 3),
+                'wait_time_max_s': round(self.wait_time_max, 3),
+                'checkout_ms': self.checkout_histogram.snapshot()
+            }
@@ -42,6 +42,90 @@ class TableDropper:
         finally:
             self.connection_pool.putconn(conn)
     
+    def drop_mark_clusters_table(self):
+        """Удаление таблицы mark_clusters"""
+        try:
+            query = "DROP TABLE IF EXISTS mark_clusters CASCADE;"
+            success = self._execute_query(query)
+            if success:
+                print("✅ Таблица mark_clusters удалена")
+            return success
+        except Exception as e:
+            print(f"❌ Ошибка при удалении таблицы mark_clusters: {e}")
+            return False
+    
+    def drop_roles_table(self):
+        """Удаление таблицы roles"""
+        try:
+            query = "DROP TABLE IF EXISTS roles CASCADE;"
+            success = self._execute_query(query)
+            if success:
+                print("✅ Таблица roles удалена")
+            return success
+        except Exception as e:
+            print(f"❌ Ошибка при удалении таблицы roles: {e}")
+            return False
+    
+    def drop_mark_tombstones_table(self):
+        """Удаление таблицы mark_tombstones"""
+        try:
+            query = "DROP TABLE IF EXISTS mark_tombstones CASCADE;"
+            success = self._execute_query(query)
+            if success:
+                print("✅ Таблица mark_tombstones удалена")
+            return success
+        except Exception as e:
+            print(f"❌ Ошибка при удалении таблицы mark_tombstones: {e}")
+            return False
+    
+    def drop_pending_deletes_table(self):
+        """Удаление таблицы pending_deletes"""
+        try:
+            query = "DROP TABLE IF EXISTS pending_deletes CASCADE;"
+            success = self._execute_query(query)
+            if success:
+                print("✅ Таблица pending_deletes удалена")
+            return success
+        except Exception as e:
+            print(f"❌ Ошибка при удалении таблицы pending_deletes: {e}")
+            return False
+    
+    def drop_geocode_cache_table(self):
+        """Удаление таблицы geocode_cache"""
+        try:
+            query = "DROP TABLE IF EXISTS geocode_cache CASCADE;"
+            success = self._execute_query(query)
+            if success:
+                print("✅ Таблица geocode_cache удалена")
+            return success
+        except Exception as e:
+            print(f"❌ Ошибка при удалении таблицы geocode_cache: {e}")
+            return False
+    
+    def drop_jobs_table(self):
+        """Удаление таблицы jobs"""
+        try:
+            query = "DROP TABLE IF EXISTS jobs CASCADE;"
+            success = self._execute_query(query)
+            if success:
+                print("✅ Таблица jobs удалена")
+            return success
+        except Exception as e:
+            print(f"❌ Ошибка при удалении таблицы jobs: {e}")
+            return False
+    
+    def drop_mark_stats_tables(self):
+        """Удаление таблиц mark_stats и mark_stats_global"""
+        try:
+            query = "DROP TABLE IF EXISTS mark_stats, mark_stats_global CASCADE;"
+            success = self._execute_query(query)
+            if success:
+                print("✅ Таблицы mark_stats и mark_stats_global удалены")
+            return success
+        except Exception as e:
+            print(f"❌ Ошибка при удалении таблиц статистики: {e}")
+            return False
+    
     def drop_photos_table(self):
         """Удаление таблицы photos"""
         try:
@@ -83,11 +167,18 @@ class TableDropper:
         print("🗑️  Начинаем удаление таблиц...")
         
         # Порядок важен: сначала дочерние таблицы, потом родительские
+        success_clusters = self.drop_mark_clusters_table()
+        success_roles = self.drop_roles_table()
+        success_pending_deletes = self.drop_pending_deletes_table()
+        success_tombstones = self.drop_mark_tombstones_table()
+        success_geocode_cache = self.drop_geocode_cache_table()
+        success_jobs = self.drop_jobs_table()
+        success_mark_stats = self.drop_mark_stats_tables()
         success_photos = self.drop_photos_table()
         success_marks = self.drop_marks_table() 
         success_users = self.drop_users_table()
         
-        all_success = success_photos and success_marks and success_users
+        all_success = success_clusters and success_roles and success_pending_deletes and success_tombstones and success_geocode_cache and success_jobs and success_mark_stats and success_photos and success_marks and success_users
         
         if all_success:
             print("🎉 Все таблицы успешно удалены!")
@@ -105,7 +196,7 @@ class TableDropper:
                     SELECT table_name 
                     FROM information_schema.tables 
                     WHERE table_schema = 'public' 
-                    AND table_name IN ('users', 'marks', 'photos');
+                    AND table_name IN ('users', 'marks', 'photos', 'mark_clusters', 'roles', 'pending_deletes', 'mark_tombstones', 'geocode_cache', 'jobs', 'mark_stats', 'mark_stats_global');
                 """)
                 existing_tables = [row[0] for row in cursor.fetchall()]
                 return existing_tables
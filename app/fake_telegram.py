@@ -0,0 +1,189 @@
+import argparse
+import logging
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import httpx # type: ignore
+from flask import Flask, jsonify, request
+from benchmark import percentile
+
+
+# Локальная заглушка Bot API и прогон вебхука под нагрузкой:
+#   python fake_telegram.py --port 8081
+#   TELEGRAM_API_URL=http://127.0.0.1:8081 BOT_TOKEN=1:test BOT_MODE=webhook python asgi_app.py
+#   python fake_telegram.py --port 8081 --webhook http://127.0.0.1:5000/telegram/webhook --updates 500
+# Прогон шлет --updates команд /start от разных чатов и меряет время до ответа
+# бота (вызова sendMessage в заглушке) и время ответа самого вебхука.
+
+DEFAULT_CHAT_BASE = 9_200_000_000
+FAKE_BOT = {
+    'id': 1,
+    'is_bot': True,
+    'first_name': 'Fake',
+    'username': 'fake_bot',
+    'can_join_groups': False,
+    'can_read_all_group_messages': False,
+    'supports_inline_queries': False
+}
+
+
+class FakeTelegram:
+    def __init__(self):
+        self.app = Flask(__name__)
+        self.app.add_url_rule('/bot<token>/<method>', 'api', self.api, methods=['GET', 'POST'])
+        self.calls = Counter()
+        self.replies = {}
+        self.webhook = {}
+        self.message_id = 0
+        self.condition = threading.Condition()
+
+    def api(self, token, method):
+        """Вызов метода Bot API: параметры формой (так шлет python-telegram-bot) или JSON"""
+        params = request.form.to_dict() or request.get_json(silent=True) or request.args.to_dict()
+        method = method.lower()
+        with self.condition:
+            self.calls[method] += 1
+        handler = getattr(self, f"method_{method}", None)
+        return jsonify({'ok': True, 'result': handler(params) if handler else True})
+
+    def method_getme(self, params):
+        return FAKE_BOT
+
+    def method_sendmessage(self, params):
+        chat_id = int(params['chat_id'])
+        with self.condition:
+            self.message_id += 1
+            message_id = self.message_id
+            self.replies.setdefault(chat_id, time.monotonic())
+            self.condition.notify_all()
+        return {
+            'message_id': message_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': FAKE_BOT,
+            'text': params.get('text', '')
+        }
+
+    def method_setwebhook(self, params):
+        self.webhook = params
+        return True
+
+    def method_deletewebhook(self, params):
+        self.webhook = {}
+        return True
+
+    def method_getwebhookinfo(self, params):
+        return {'url': self.webhook.get('url', ''), 'has_custom_certificate': False, 'pending_update_count': 0}
+
+    def wait_replies(self, chat_ids, timeout):
+        """Ожидание ответов во все чаты; возвращает {chat_id: время ответа}"""
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            while not all(chat_id in self.replies for chat_id in chat_ids):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            return {chat_id: self.replies[chat_id] for chat_id in chat_ids if chat_id in self.replies}
+
+
+def make_update(update_id, chat_id, text='/start'):
+    """Обновление с командой от пользователя в личном чате"""
+    user = {'id': chat_id, 'is_bot': False, 'first_name': 'Load'}
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': dict(user, type='private'),
+            'from': user,
+            'text': text,
+            'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(text)}]
+        }
+    }
+
+
+def run_load(fake, webhook_url, updates, concurrency, secret=None, chat_base=DEFAULT_CHAT_BASE, timeout=60):
+    """Параллельная отправка обновлений в вебхук и сбор задержек"""
+    headers = {'X-Telegram-Bot-Api-Secret-Token': secret} if secret else {}
+    sent_at = {}
+    acks = []
+    statuses = Counter()
+    lock = threading.Lock()
+
+    with httpx.Client(timeout=30, limits=httpx.Limits(max_connections=concurrency)) as client:
+        def send(index):
+            chat_id = chat_base + index
+            started = time.monotonic()
+            try:
+                status = client.post(webhook_url, json=make_update(index + 1, chat_id), headers=headers).status_code
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            with lock:
+                if status == 200:
+                    sent_at[chat_id] = started
+                acks.append((time.monotonic() - started) * 1000)
+                statuses[status] += 1
+
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(send, range(updates)))
+
+    replies = fake.wait_replies(list(sent_at), timeout)
+    elapsed = max(replies.values(), default=time.monotonic()) - started
+    latencies = sorted((replies[chat_id] - sent_at[chat_id]) * 1000 for chat_id in replies)
+    return {
+        'updates': updates,
+        'concurrency': concurrency,
+        'statuses': {str(status): count for status, count in statuses.items()},
+        'replies': len(replies),
+        'missing': updates - len(replies),
+        'elapsed_s': elapsed,
+        'ack_ms': {p: percentile(sorted(acks), p) for p in (50, 95, 99)},
+        'reply_ms': {p: percentile(latencies, p) for p in (50, 95, 99)}
+    }
+
+
+def print_report(result):
+    statuses = ', '.join(f"{status}: {count}" for status, count in sorted(result['statuses'].items()))
+    print(f"Обновлений: {result['updates']} (параллельно {result['concurrency']}), ответы вебхука - {statuses}")
+    print(f"Ответов бота: {result['replies']}, без ответа: {result['missing']}, за {result['elapsed_s']:.2f}с")
+    for name, values in (('вебхук', result['ack_ms']), ('ответ бота', result['reply_ms'])):
+        if values[50] is None:
+            continue
+        print(f"  {name:<11} p50 {values[50]:8.1f} ms  p95 {values[95]:8.1f} ms  p99 {values[99]:8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Заглушка Bot API и нагрузочный прогон вебхука")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--webhook', help="адрес вебхука бота; без него - только заглушка")
+    parser.add_argument('--secret', help="WEBHOOK_SECRET бота")
+    parser.add_argument('--updates', type=int, default=200, help="сколько /start отправить")
+    parser.add_argument('--concurrency', type=int, default=50, help="параллельных отправок")
+    parser.add_argument('--timeout', type=float, default=60, help="сколько ждать ответов, с")
+    args = parser.parse_args()
+
+    from werkzeug.serving import make_server
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    fake = FakeTelegram()
+    server = make_server(args.host, args.port, fake.app, threaded=True)
+    print(f"✅ Заглушка Bot API: http://{args.host}:{args.port}")
+
+    if not args.webhook:
+        server.serve_forever()
+        return
+
+    thread = threading.Thread(target=server.serve_forever, name='fake-telegram', daemon=True)
+    thread.start()
+    try:
+        print_report(run_load(fake, args.webhook, args.updates, args.concurrency, args.secret, timeout=args.timeout))
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
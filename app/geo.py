@@ -0,0 +1,185 @@
+import math
+
+
+TILE_SIZE = 256
+MAX_ZOOM = 21
+
+
+def parse_bbox(value):
+    """Разбор строки 'south,west,north,east' (как map.getBounds() в Яндекс Картах)"""
+    if not value:
+        raise ValueError("bbox не указан")
+
+    parts = value.split(',')
+    if len(parts) != 4:
+        raise ValueError("bbox должен содержать 4 числа: south,west,north,east")
+
+    south, west, north, east = (float(part) for part in parts)
+    # float() пропускает 'inf' и 'nan', а долготу normalize_lon превратит в nan
+    if not all(math.isfinite(part) for part in (south, west, north, east)):
+        raise ValueError("bbox должен содержать конечные числа")
+    if not (-90 <= south <= 90 and -90 <= north <= 90):
+        raise ValueError("Широта bbox вне диапазона [-90, 90]")
+    if south > north:
+        raise ValueError("south больше north")
+    # Долготу за пределами [-180, 180] карта отдает при прокрутке мира
+    west = normalize_lon(west)
+    east = normalize_lon(east)
+    return south, west, north, east
+
+
+def parse_zoom(value, default=None):
+    """Разбор уровня масштаба карты"""
+    if value is None or value == '':
+        return default
+    zoom = int(value)
+    if not 0 <= zoom <= MAX_ZOOM:
+        raise ValueError(f"zoom должен быть от 0 до {MAX_ZOOM}")
+    return zoom
+
+
+def normalize_lon(lon):
+    """Приведение долготы к диапазону [-180, 180]"""
+    if -180 <= lon <= 180:
+        return lon
+    return (lon + 180) % 360 - 180
+
+
+def degrees_per_pixel(zoom):
+    """Сколько градусов долготы занимает один пиксель на заданном масштабе"""
+    return 360 / (TILE_SIZE * 2 ** zoom)
+
+
+def pad_bbox(bbox, zoom, pixels):
+    """Расширение bbox на несколько пикселей, чтобы метки у края не пропадали"""
+    south, west, north, east = bbox
+    if zoom is None or pixels <= 0:
+        return bbox
+
+    margin = degrees_per_pixel(zoom) * pixels
+    south = max(south - margin, -90)
+    north = min(north + margin, 90)
+
+    # Ширина области с учетом перехода через 180-й меридиан
+    span = east - west if west <= east else east - west + 360
+    if span + 2 * margin >= 360:
+        return south, -180.0, north, 180.0
+    return south, normalize_lon(west - margin), north, normalize_lon(east + margin)
+
+
+def split_bbox(bbox):
+    """Разбиение bbox, пересекающего 180-й меридиан, на два прямоугольника"""
+    south, west, north, east = bbox
+    if west <= east:
+        return [bbox]
+    return [(south, west, north, 180.0), (south, -180.0, north, east)]
+
+
+# Сетка кластеров: ячейки CLUSTER_CELL_PX x CLUSTER_CELL_PX пикселей в проекции
+# Web Mercator. Ячейка масштаба z целиком лежит в одной ячейке масштаба z - 1.
+CLUSTER_CELL_PX = 64
+CLUSTER_MAX_ZOOM = 18
+MERCATOR_MAX_LAT = 85.05112878
+
+
+def world_pixel(lat, lon, zoom):
+    """Координаты точки в пикселях карты мира на заданном масштабе"""
+    world_size = TILE_SIZE * 2 ** zoom
+    lat = max(min(lat, MERCATOR_MAX_LAT), -MERCATOR_MAX_LAT)
+    sin_lat = math.sin(math.radians(lat))
+    x = (lon + 180) / 360 * world_size
+    y = (0.5 - math.log((1 + sin_lat) / (1 - sin_lat)) / (4 * math.pi)) * world_size
+    return x, y
+
+
+def pixel_to_latlon(x, y, zoom):
+    """Обратное преобразование пикселей карты мира в широту и долготу"""
+    world_size = TILE_SIZE * 2 ** zoom
+    lon = x / world_size * 360 - 180
+    n = math.pi - 2 * math.pi * y / world_size
+    lat = math.degrees(math.atan(math.sinh(n)))
+    return lat, lon
+
+
+def cluster_cell(lat, lon, zoom):
+    """Ячейка сетки кластеров, в которую попадает точка"""
+    cells_count = TILE_SIZE * 2 ** zoom // CLUSTER_CELL_PX
+    x, y = world_pixel(lat, lon, zoom)
+    cell_x = min(int(x // CLUSTER_CELL_PX), cells_count - 1)
+    cell_y = min(max(int(y // CLUSTER_CELL_PX), 0), cells_count - 1)
+    return cell_x, cell_y
+
+
+def cluster_cells(lat, lon):
+    """Ячейки точки на всех масштабах: [(zoom, cell_x, cell_y), ...]"""
+    return [(zoom, *cluster_cell(lat, lon, zoom)) for zoom in range(CLUSTER_MAX_ZOOM + 1)]
+
+
+def cluster_cell_bounds(zoom, cell_x, cell_y):
+    """Границы ячейки сетки: (south, west, north, east)"""
+    north, west = pixel_to_latlon(cell_x * CLUSTER_CELL_PX, cell_y * CLUSTER_CELL_PX, zoom)
+    south, east = pixel_to_latlon((cell_x + 1) * CLUSTER_CELL_PX, (cell_y + 1) * CLUSTER_CELL_PX, zoom)
+    return south, west, north, east
+
+
+def cluster_cell_ranges(bbox, zoom):
+    """Диапазоны ячеек, покрывающих bbox: [(x_from, x_to, y_from, y_to), ...]"""
+    ranges = []
+    for south, west, north, east in split_bbox(bbox):
+        x_from, y_from = cluster_cell(north, west, zoom)
+        x_to, y_to = cluster_cell(south, east, zoom)
+        ranges.append((x_from, x_to, y_from, y_to))
+    return ranges
+
+
+# Geohash: строка из base32-символов, каждый следующий делит ячейку на 32 части.
+# Ячейка длины p целиком лежит в ячейке своего префикса длины p - 1.
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+
+def geohash(lat, lon, precision):
+    """Geohash точки заданной длины"""
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    value = bits = 0
+    even = True
+    while len(chars) < precision:
+        coord_range, coord = (lon_range, lon) if even else (lat_range, lat)
+        middle = (coord_range[0] + coord_range[1]) / 2
+        if coord >= middle:
+            value = value * 2 + 1
+            coord_range[0] = middle
+        else:
+            value = value * 2
+            coord_range[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(GEOHASH_ALPHABET[value])
+            value = bits = 0
+    return ''.join(chars)
+
+
+def geohash_bounds(value):
+    """Границы ячейки geohash: (south, west, north, east)"""
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    even = True
+    for char in value:
+        index = GEOHASH_ALPHABET.index(char)
+        for shift in range(4, -1, -1):
+            coord_range = lon_range if even else lat_range
+            middle = (coord_range[0] + coord_range[1]) / 2
+            if index >> shift & 1:
+                coord_range[0] = middle
+            else:
+                coord_range[1] = middle
+            even = not even
+    return lat_range[0], lon_range[0], lat_range[1], lon_range[1]
+
+
+def geohash_center(value):
+    """Центр ячейки geohash: (lat, lon)"""
+    south, west, north, east = geohash_bounds(value)
+    return (south + north) / 2, (west + east) / 2
@@ -0,0 +1,350 @@
+import hashlib
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from dotenv import load_dotenv
+from cache import TTLCache, MISSING
+
+
+load_dotenv()
+
+# Координаты округляются до 4 знаков (~11 м): соседние клики - один адрес
+COORD_PRECISION = 4
+# Видимая область карты только смещает поиск, поэтому округляем ее грубо (~10 км)
+BBOX_PRECISION = 1
+MAX_QUERY_LENGTH = 200
+SUGGEST_RESULTS = 5
+# Сколько хранить ответы в таблице geocode_cache; пустые ответы - меньше
+GEOCODE_CACHE_TTL = 30 * 24 * 60 * 60
+SUGGEST_CACHE_TTL = 7 * 24 * 60 * 60
+EMPTY_CACHE_TTL = 24 * 60 * 60
+# Устаревшие строки geocode_cache чистятся раз в столько запросов к геокодеру
+PURGE_EVERY = 1000
+
+
+class GeocodingError(Exception):
+    pass
+
+
+class RateLimitExceeded(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"Слишком много запросов, повторите через {retry_after:.0f} с")
+        self.retry_after = retry_after
+
+
+def normalize_query(query):
+    """Запрос без лишних пробелов и регистра - ключ кеша"""
+    query = ' '.join((query or '').split()).lower()
+    if not query:
+        raise ValueError("Пустой запрос")
+    if len(query) > MAX_QUERY_LENGTH:
+        raise ValueError(f"Запрос длиннее {MAX_QUERY_LENGTH} символов")
+    return query
+
+
+def round_bbox(bbox):
+    """Область, расширенная до сетки BBOX_PRECISION: и ключ кеша, и то, что уйдет геокодеру"""
+    if bbox is None:
+        return None
+    scale = 10 ** BBOX_PRECISION
+    south, west, north, east = bbox
+    return (
+        math.floor(south * scale) / scale,
+        math.floor(west * scale) / scale,
+        math.ceil(north * scale) / scale,
+        math.ceil(east * scale) / scale
+    )
+
+
+def round_coords(lat, lon):
+    lat, lon = float(lat), float(lon)
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise ValueError("Координаты вне допустимого диапазона")
+    return round(lat, COORD_PRECISION), round(lon, COORD_PRECISION)
+
+
+class GeocodingProvider:
+    """Внешний геокодер; результаты - списки dict в едином формате
+
+    geocode/reverse: {'name', 'address', 'lat', 'lon', 'kind'},
+    suggest: {'value', 'title', 'tags'}.
+    """
+
+    name = 'base'
+
+    def geocode(self, query, bbox=None, results=1):
+        raise NotImplementedError
+
+    def reverse(self, lat, lon):
+        raise NotImplementedError
+
+    def suggest(self, query, bbox=None, results=SUGGEST_RESULTS):
+        raise NotImplementedError
+
+
+# HTTP Геокодер и Геосаджест Яндекса. Ключ Геосаджеста выдается отдельно;
+# без него подсказки строятся по результатам геокодера.
+class YandexGeocodingProvider(GeocodingProvider):
+    name = 'yandex'
+    GEOCODE_URL = 'https://geocode-maps.yandex.ru/1.x/'
+    SUGGEST_URL = 'https://suggest-maps.yandex.ru/v1/suggest'
+
+    def __init__(self, api_key, suggest_key=None, timeout=5.0):
+        import httpx # type: ignore
+
+        self.httpx = httpx
+        self.api_key = api_key
+        self.suggest_key = suggest_key
+        self.client = httpx.Client(timeout=timeout)
+
+    def _get(self, url, params):
+        try:
+            response = self.client.get(url, params=params)
+            response.raise_for_status()
+            return response.json()
+        except (self.httpx.HTTPError, ValueError) as e:
+            raise GeocodingError(f"Ошибка геокодера: {e}") from e
+
+    @staticmethod
+    def _bbox_param(bbox):
+        # Яндекс ждет "долгота,широта~долгота,широта" (юго-запад~северо-восток)
+        south, west, north, east = bbox
+        return f"{west},{south}~{east},{north}"
+
+    def _geocode(self, geocode, bbox=None, results=1):
+        if not self.api_key:
+            raise GeocodingError("Не задан ключ геокодера YANDEX_GEOCODER_API_KEY")
+        params = {'apikey': self.api_key, 'geocode': geocode, 'format': 'json', 'lang': 'ru_RU', 'results': results}
+        if bbox:
+            # rspn=0: область только повышает приоритет, поиск идет и за ее пределами
+            params['bbox'] = self._bbox_param(bbox)
+            params['rspn'] = 0
+        data = self._get(self.GEOCODE_URL, params)
+
+        found = []
+        members = data.get('response', {}).get('GeoObjectCollection', {}).get('featureMember', [])
+        for member in members:
+            geo_object = member.get('GeoObject', {})
+            meta = geo_object.get('metaDataProperty', {}).get('GeocoderMetaData', {})
+            lon, lat = (float(value) for value in geo_object['Point']['pos'].split())
+            found.append({
+                'name': geo_object.get('name'),
+                'address': meta.get('text') or geo_object.get('name'),
+                'lat': lat,
+                'lon': lon,
+                'kind': meta.get('kind')
+            })
+        return found
+
+    def geocode(self, query, bbox=None, results=1):
+        return self._geocode(query, bbox, results)
+
+    def reverse(self, lat, lon):
+        return self._geocode(f"{lon},{lat}")
+
+    def suggest(self, query, bbox=None, results=SUGGEST_RESULTS):
+        if not self.suggest_key:
+            return [
+                {'value': item['address'], 'title': item['name'], 'tags': [item['kind']] if item['kind'] else []}
+                for item in self._geocode(query, bbox, results)
+            ]
+
+        params = {'apikey': self.suggest_key, 'text': query, 'lang': 'ru', 'results': results, 'print_address': 1}
+        if bbox:
+            params['bbox'] = self._bbox_param(bbox)
+        data = self._get(self.SUGGEST_URL, params)
+
+        suggestions = []
+        for item in data.get('results', []):
+            title = item.get('title', {}).get('text', '')
+            subtitle = item.get('subtitle', {}).get('text')
+            value = item.get('address', {}).get('formatted_address') or (f"{subtitle}, {title}" if subtitle else title)
+            suggestions.append({'value': value, 'title': title, 'tags': item.get('tags', [])})
+        return suggestions
+
+
+# Детерминированный геокодер без сети - для локального запуска и тестов
+class StubGeocodingProvider(GeocodingProvider):
+    name = 'stub'
+
+    def __init__(self):
+        self.calls = 0
+
+    def _point(self, query):
+        digest = hashlib.md5(query.encode('utf-8')).digest()
+        lat = 40 + digest[0] / 255 * 30
+        lon = 20 + digest[1] / 255 * 100
+        return round(lat, 6), round(lon, 6)
+
+    def geocode(self, query, bbox=None, results=1):
+        self.calls += 1
+        lat, lon = self._point(query)
+        return [{'name': query, 'address': f"Тестовый адрес, {query}", 'lat': lat, 'lon': lon, 'kind': 'locality'}][:results]
+
+    def reverse(self, lat, lon):
+        self.calls += 1
+        return [{'name': f"{lat}, {lon}", 'address': f"Тестовый адрес, {lat}, {lon}", 'lat': lat, 'lon': lon, 'kind': 'house'}]
+
+    def suggest(self, query, bbox=None, results=SUGGEST_RESULTS):
+        self.calls += 1
+        return [{'value': f"{query} {i}", 'title': f"{query} {i}", 'tags': ['street']} for i in range(1, results + 1)]
+
+
+def create_geocoding_provider():
+    """Геокодер по настройкам окружения: GEOCODER=yandex|stub"""
+    backend = os.getenv('GEOCODER', 'yandex')
+    if backend == 'stub':
+        return StubGeocodingProvider()
+    if backend != 'yandex':
+        raise ValueError(f"Неизвестный геокодер: {backend}")
+    return YandexGeocodingProvider(
+        api_key=os.getenv('YANDEX_GEOCODER_API_KEY') or os.getenv('YANDEX_MAPS_API_KEY'),
+        suggest_key=os.getenv('YANDEX_SUGGEST_API_KEY') or None,
+        timeout=float(os.getenv('GEOCODER_TIMEOUT_SECONDS', '5'))
+    )
+
+
+class InFlightCall:
+    __slots__ = ('event', 'result', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+# Одинаковые одновременные запросы: к геокодеру идет только первый,
+# остальные ждут его ответ
+class RequestCoalescer:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.coalesced = 0
+
+    def run(self, key, func):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = InFlightCall()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.event.set()
+
+
+# Token bucket на пользователя: rate запросов в секунду, всплеск до burst
+class RateLimiter:
+    def __init__(self, rate, burst, maxsize=10000):
+        self.rate = rate
+        self.burst = burst
+        self.maxsize = maxsize
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+        self.rejected = 0
+
+    def acquire(self, key):
+        """0, если запрос разрешен, иначе сколько секунд подождать"""
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated = self.buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0.0
+            else:
+                wait = (1 - tokens) / self.rate
+                self.rejected += 1
+            self.buckets[key] = (tokens, now)
+            while len(self.buckets) > self.maxsize:
+                self.buckets.popitem(last=False)
+            return wait
+
+
+# Прокси к геокодеру: память -> таблица geocode_cache -> геокодер. Лимит на
+# пользователя считается только для запросов, ушедших к геокодеру: популярные
+# места из кеша квоту не тратят.
+class GeocodingService:
+    def __init__(self, provider, db_manager, rate=1.0, burst=20, memory_ttl=300, memory_size=4096):
+        self.provider = provider
+        self.db_manager = db_manager
+        self.memory_cache = TTLCache(maxsize=memory_size, ttl=memory_ttl)
+        self.coalescer = RequestCoalescer()
+        self.limiter = RateLimiter(rate, burst)
+        self.upstream_calls = 0
+        self.db_hits = 0
+
+    def geocode(self, user_key, query, bbox=None):
+        query = normalize_query(query)
+        bbox = round_bbox(bbox)
+        key = f"geocode:{query}|{bbox}"
+        return self._lookup(user_key, key, GEOCODE_CACHE_TTL, lambda: self.provider.geocode(query, bbox))
+
+    def reverse(self, user_key, lat, lon):
+        lat, lon = round_coords(lat, lon)
+        key = f"reverse:{lat:.{COORD_PRECISION}f},{lon:.{COORD_PRECISION}f}"
+        return self._lookup(user_key, key, GEOCODE_CACHE_TTL, lambda: self.provider.reverse(lat, lon))
+
+    def suggest(self, user_key, query, bbox=None):
+        query = normalize_query(query)
+        bbox = round_bbox(bbox)
+        key = f"suggest:{query}|{bbox}"
+        return self._lookup(user_key, key, SUGGEST_CACHE_TTL, lambda: self.provider.suggest(query, bbox))
+
+    def _lookup(self, user_key, key, ttl, fetch):
+        # Ключ с именем геокодера: ответы заглушки не смешиваются с настоящими
+        key = f"{self.provider.name}:{key}"
+        value = self.memory_cache.get(key)
+        if value is not MISSING:
+            return value
+
+        value = self.db_manager.get_geocode_cache(key)
+        if value is not None:
+            self.db_hits += 1
+            self.memory_cache.set(key, value)
+            return value
+
+        wait = self.limiter.acquire(user_key)
+        if wait:
+            raise RateLimitExceeded(wait)
+        return self.coalescer.run(key, lambda: self._fetch(key, ttl, fetch))
+
+    def _fetch(self, key, ttl, fetch):
+        self.upstream_calls += 1
+        value = fetch()
+        try:
+            self.db_manager.put_geocode_cache(key, value, ttl if value else EMPTY_CACHE_TTL)
+            if self.upstream_calls % PURGE_EVERY == 0:
+                self.db_manager.purge_geocode_cache()
+        except Exception as e:
+            # Ответ уже получен - отдаем его и без записи в кеш
+            print(f"❌ Ошибка записи в кеш геокодера: {e}")
+        self.memory_cache.set(key, value)
+        return value
+
+    def stats(self):
+        return {
+            'provider': self.provider.name,
+            'memory': self.memory_cache.stats(),
+            'db_hits': self.db_hits,
+            'upstream_calls': self.upstream_calls,
+            'coalesced': self.coalescer.coalesced,
+            'rate_limited': self.limiter.rejected
+        }
@@ -0,0 +1,116 @@
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image, ImageOps # type: ignore
+from photo_storage import iter_chunks
+
+
+# Производные размеры фото: имя -> максимальная сторона в пикселях
+VARIANT_SIZES = {
+    'thumb': 320,
+    'preview': 1080,
+    'full': 2048
+}
+VARIANT_FORMAT = 'WEBP'
+VARIANT_EXTENSION = '.webp'
+VARIANT_QUALITY = 80
+
+
+# Фото обрабатываются в пуле потоков процесса или, с use_queue, ставятся задачей
+# image_variants в очередь jobs и обрабатываются процессами job_worker.py
+class ImageVariantProcessor:
+    def __init__(self, storage, db_manager, max_workers=2, use_queue=False):
+        self.storage = storage
+        self.db_manager = db_manager
+        self.use_queue = use_queue
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix='image-variants'
+        )
+
+    @staticmethod
+    def variant_filename(filename, variant):
+        """Имя файла производного размера рядом с оригиналом"""
+        name, _ = os.path.splitext(filename)
+        return f"{name}__{variant}{VARIANT_EXTENSION}"
+
+    @classmethod
+    def variant_filenames(cls, filename):
+        """Имена всех производных размеров фото"""
+        return {variant: cls.variant_filename(filename, variant) for variant in VARIANT_SIZES}
+
+    @staticmethod
+    def choose_variant(variants, width=None, size=None):
+        """Выбор производного размера под ширину экрана (в физических пикселях)"""
+        if not variants:
+            return None
+        if size:
+            return variants.get(size)
+        if not width:
+            return None
+
+        for variant, max_side in sorted(VARIANT_SIZES.items(), key=lambda item: item[1]):
+            if max_side >= width and variant in variants:
+                return variants[variant]
+        return variants.get('full')
+
+    def submit(self, photo_id, filename):
+        """Постановка фото в очередь на обработку, запрос не ждет результата"""
+        if self.use_queue:
+            return self.db_manager.enqueue_job('image_variants', {'photo_id': photo_id, 'filename': filename})
+        return self.executor.submit(self.process, photo_id, filename)
+
+    def submit_many(self, photos):
+        """Постановка нескольких фото ({'id', 'filename'}) в очередь; в БД - одним запросом"""
+        if self.use_queue:
+            return self.db_manager.enqueue_jobs(
+                'image_variants',
+                [{'photo_id': photo['id'], 'filename': photo['filename']} for photo in photos]
+            )
+        return [self.executor.submit(self.process, photo['id'], photo['filename']) for photo in photos]
+
+    def process(self, photo_id, filename):
+        """Генерация производных размеров и запись их в таблицу photos"""
+        try:
+            variants = self.generate_variants(filename)
+            self.db_manager.set_photo_variants(photo_id, variants)
+            return variants
+        except Exception as e:
+            print(f"❌ Ошибка обработки фото {filename}: {e}")
+            return None
+
+    def generate_variants(self, filename):
+        """Пережатие оригинала в WebP нужных размеров без EXIF"""
+        variants = self.variant_filenames(filename)
+        # Файлы с одинаковым содержимым общие - варианты могли уже сделать
+        if all(self.storage.exists(name) for name in variants.values()):
+            return variants
+        variants = {}
+
+        source = self.storage.local_path(filename)
+        if source is None:
+            # Из S3 поток не перематывается, а Pillow нужен seek
+            source = io.BytesIO(b''.join(iter_chunks(self.storage.open(filename))))
+
+        with Image.open(source) as image:
+            # Поворачиваем по EXIF до того, как метаданные будут отброшены
+            image = ImageOps.exif_transpose(image)
+            if image.mode not in ('RGB', 'RGBA'):
+                image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+
+            for variant, max_side in VARIANT_SIZES.items():
+                resized = image.copy()
+                resized.thumbnail((max_side, max_side), Image.LANCZOS)
+
+                variant_name = self.variant_filename(filename, variant)
+                buffer = io.BytesIO()
+                # Без exif= Pillow не переносит метаданные в новый файл
+                resized.save(buffer, VARIANT_FORMAT, quality=VARIANT_QUALITY, method=4)
+                buffer.seek(0)
+                self.storage.put(variant_name, buffer)
+                variants[variant] = variant_name
+
+        return variants
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
@@ -0,0 +1,365 @@
+import bisect
+import contextvars
+import cProfile
+import os
+import pstats
+import re
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import wraps
+from psycopg2 import extensions # type: ignore
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+# Запросы дольше порога пишутся в лог (без значений параметров)
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', '200'))
+# Заголовок Server-Timing с разбивкой времени запроса (видно в DevTools браузера)
+SERVER_TIMING_ENABLED = os.getenv('SERVER_TIMING', '1') == '1'
+# Профилирование одного запроса: заголовок X-Profile со значением PROFILE_TOKEN;
+# без токена профилирование выключено
+PROFILE_TOKEN = os.getenv('PROFILE_TOKEN')
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+PROFILE_TOP = 25
+# Границы корзин гистограмм длительности, в секундах
+DURATION_BUCKETS_S = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Составляющие времени запроса: имя в Server-Timing и метриках
+SPAN_KINDS = ('db', 'io', 'serialize', 'compress')
+
+WHITESPACE_RE = re.compile(r'\s+')
+# execute_values и mogrify (COPY в copy_out) подставляют значения прямо в текст
+# SQL, и параметров у такого запроса нет - литералы в логе заменяются на ?
+STRING_LITERAL_RE = re.compile(r"(?<![\w$])[EeBbXx]?'(?:[^']|'')*'")
+NUMBER_LITERAL_RE = re.compile(r"(?<![\w$.])\d+(?:\.\d+)?(?:[eE][-+]?\d+)?")
+# Длинный VALUES (...), (...), ... - только первый кортеж
+REPEATED_TUPLES_RE = re.compile(r"(\([^()]*\))(?:\s*,\s*\([^()]*\))+")
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def snapshot(self):
+        """Накопительные счетчики по корзинам, как в Prometheus: le -> count"""
+        return {
+            'buckets': {str(bound): count for bound, count in self.cumulative()},
+            'sum': round(self.total, 3),
+            'count': self.count
+        }
+
+    def cumulative(self):
+        """Пары (граница, накопленное число) как у Prometheus; последняя - +Inf"""
+        result = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            cumulative += count
+            result.append((bound, cumulative))
+        return result
+
+
+# Разбивка времени одного запроса. Живет в contextvar: во Flask - на поток
+# запроса, в Starlette - на задачу asyncio.
+class RequestSpan:
+    __slots__ = ('endpoint', 'started', 'times', 'db_queries', 'io_bytes', 'profiler')
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.times = dict.fromkeys(SPAN_KINDS, 0.0)
+        self.db_queries = 0
+        self.io_bytes = 0
+        self.profiler = None
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self):
+        parts = [
+            f'db;dur={self.times["db"] * 1000:.1f};desc="{self.db_queries} queries"',
+            f'io;dur={self.times["io"] * 1000:.1f};desc="{self.io_bytes} bytes"',
+            f'serialize;dur={self.times["serialize"] * 1000:.1f}',
+            f'compress;dur={self.times["compress"] * 1000:.1f}',
+            f'total;dur={self.elapsed() * 1000:.1f}'
+        ]
+        return ', '.join(parts)
+
+
+current_span = contextvars.ContextVar('current_span', default=None)
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = defaultdict(int)
+        self.durations = defaultdict(lambda: Histogram(DURATION_BUCKETS_S))
+        self.span_times = defaultdict(float)
+        self.db_queries = defaultdict(int)
+        self.io_bytes = defaultdict(int)
+        self.query_durations = Histogram(DURATION_BUCKETS_S)
+        self.slow_queries = 0
+
+    def observe_request(self, span, method, status):
+        elapsed = span.elapsed()
+        with self.lock:
+            self.requests[(span.endpoint, method, status)] += 1
+            self.durations[span.endpoint].observe(elapsed)
+            for kind, value in span.times.items():
+                self.span_times[(span.endpoint, kind)] += value
+            self.db_queries[span.endpoint] += span.db_queries
+            self.io_bytes[span.endpoint] += span.io_bytes
+
+    def observe_query(self, elapsed, slow):
+        with self.lock:
+            self.query_durations.observe(elapsed)
+            if slow:
+                self.slow_queries += 1
+
+    def endpoint_totals(self, endpoint):
+        """Счетчики эндпоинта: число запросов, запросов к БД и время по составляющим"""
+        with self.lock:
+            return {
+                'requests': sum(count for (name, _, _), count in self.requests.items() if name == endpoint),
+                'db_queries': self.db_queries.get(endpoint, 0),
+                'io_bytes': self.io_bytes.get(endpoint, 0),
+                **{f"{kind}_seconds": self.span_times.get((endpoint, kind), 0.0) for kind in SPAN_KINDS}
+            }
+
+    def render(self, gauges=()):
+        """Текстовый формат Prometheus; gauges - доп. строки (имя, метки, значение)"""
+        lines = []
+        with self.lock:
+            lines.append('# TYPE http_requests_total counter')
+            for (endpoint, method, status), count in sorted(self.requests.items(), key=str):
+                lines.append(metric_line('http_requests_total', {'endpoint': endpoint, 'method': method, 'status': status}, count))
+
+            lines.append('# TYPE http_request_duration_seconds histogram')
+            for endpoint, histogram in sorted(self.durations.items(), key=str):
+                lines.extend(histogram_lines('http_request_duration_seconds', {'endpoint': endpoint}, histogram))
+
+            lines.append('# TYPE http_request_span_seconds_total counter')
+            for (endpoint, kind), value in sorted(self.span_times.items(), key=str):
+                lines.append(metric_line('http_request_span_seconds_total', {'endpoint': endpoint, 'span': kind}, value))
+
+            lines.append('# TYPE db_queries_total counter')
+            for endpoint, count in sorted(self.db_queries.items(), key=str):
+                lines.append(metric_line('db_queries_total', {'endpoint': endpoint}, count))
+
+            lines.append('# TYPE io_bytes_total counter')
+            for endpoint, count in sorted(self.io_bytes.items(), key=str):
+                lines.append(metric_line('io_bytes_total', {'endpoint': endpoint}, count))
+
+            lines.append('# TYPE db_query_duration_seconds histogram')
+            lines.extend(histogram_lines('db_query_duration_seconds', {}, self.query_durations))
+            lines.append('# TYPE db_slow_queries_total counter')
+            lines.append(metric_line('db_slow_queries_total', {}, self.slow_queries))
+
+        for name, labels, value in gauges:
+            if value is not None:
+                lines.append(metric_line(name, labels, value))
+        return '\n'.join(lines) + '\n'
+
+
+def metric_line(name, labels, value):
+    if labels:
+        label_text = ','.join(f'{key}="{escape_label(value)}"' for key, value in labels.items())
+        return f"{name}{{{label_text}}} {value}"
+    return f"{name} {value}"
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def histogram_lines(name, labels, histogram):
+    lines = [metric_line(f"{name}_bucket", {**labels, 'le': bound}, count) for bound, count in histogram.cumulative()]
+    lines.append(metric_line(f"{name}_sum", labels, round(histogram.total, 6)))
+    lines.append(metric_line(f"{name}_count", labels, histogram.count))
+    return lines
+
+
+METRICS = MetricsRegistry()
+
+# Текст подготовленных запросов по имени: в логе вместо EXECUTE q_... - сам SQL
+PREPARED_STATEMENTS = {}
+
+
+def register_statement(name, sql):
+    PREPARED_STATEMENTS[name] = sql
+
+
+def describe_query(query):
+    if isinstance(query, bytes):
+        query = query.decode('utf-8', 'replace')
+    query = str(query)
+    if query.startswith('EXECUTE '):
+        name = query.split(None, 2)[1].rstrip(';')
+        query = PREPARED_STATEMENTS.get(name, query)
+    query = STRING_LITERAL_RE.sub('?', query)
+    query = NUMBER_LITERAL_RE.sub('?', query)
+    query = REPEATED_TUPLES_RE.sub(r'\1, ...', WHITESPACE_RE.sub(' ', query))
+    return query.strip()[:1000]
+
+
+def redact_params(params):
+    """Вместо значений параметров - только их типы: в логе нет личных данных"""
+    if params is None:
+        return ''
+    if isinstance(params, dict):
+        return ', '.join(f"{key}={type(value).__name__}" for key, value in params.items())
+    return ', '.join(type(value).__name__ for value in params)
+
+
+def record_query(elapsed, query, params=None):
+    """Учет выполненного запроса к БД (psycopg2 и asyncpg)"""
+    span = current_span.get()
+    if span is not None:
+        span.times['db'] += elapsed
+        span.db_queries += 1
+    slow = elapsed * 1000 >= SLOW_QUERY_MS
+    METRICS.observe_query(elapsed, slow)
+    if slow:
+        endpoint = span.endpoint if span is not None else '-'
+        print(f"⚠️ Медленный запрос {elapsed * 1000:.0f} мс [{endpoint}]: {describe_query(query)} | параметры: ({redact_params(params)})")
+
+
+@contextmanager
+def measure(kind):
+    """Время блока в составляющую kind текущего запроса"""
+    span = current_span.get()
+    if span is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        span.times[kind] += time.perf_counter() - started
+
+
+def add_io_bytes(count):
+    span = current_span.get()
+    if span is not None:
+        span.io_bytes += count
+
+
+# Курсор psycopg2 с учетом времени каждого запроса
+class TracingCursor(extensions.cursor):
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            record_query(time.perf_counter() - started, query, vars)
+
+    def executemany(self, query, vars_list):
+        started = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            record_query(time.perf_counter() - started, query)
+
+    def copy_expert(self, sql, file, size=8192):
+        started = time.perf_counter()
+        try:
+            return super().copy_expert(sql, file, size)
+        finally:
+            record_query(time.perf_counter() - started, sql)
+
+
+def log_asyncpg_query(record):
+    """Логгер запросов asyncpg (Connection.add_query_logger)"""
+    record_query(record.elapsed, record.query, record.args)
+
+
+def start_profiler(span, token):
+    if not PROFILE_TOKEN or token != PROFILE_TOKEN:
+        return
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Уже идет профилирование другого запроса
+        return
+    span.profiler = profiler
+
+
+def finish_profiler(span):
+    """Сохранение профиля в PROFILE_DIR и короткая сводка в лог; возвращает путь"""
+    profiler = span.profiler
+    if profiler is None:
+        return None
+    profiler.disable()
+    span.profiler = None
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, f"{span.endpoint}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.prof")
+    profiler.dump_stats(path)
+    stats = pstats.Stats(profiler)
+    stats.sort_stats('cumulative').print_stats(PROFILE_TOP)
+    print(f"✅ Профиль запроса {span.endpoint} сохранен в {path}")
+    return path
+
+
+def install_flask(app):
+    """Хуки Flask: span на запрос, Server-Timing, метрики и профилирование
+
+    Вызывать до регистрации остальных after_request: Flask выполняет их в
+    обратном порядке, и так в span попадет и время сжатия ответа.
+    """
+    from flask import request
+
+    def before_request():
+        span = RequestSpan(request.endpoint or 'unknown')
+        request.environ['instrumentation.token'] = current_span.set(span)
+        start_profiler(span, request.headers.get('X-Profile'))
+
+    def after_request(response):
+        span = current_span.get()
+        if span is None:
+            return response
+        profile_path = finish_profiler(span)
+        if profile_path:
+            response.headers['X-Profile-File'] = os.path.basename(profile_path)
+        if SERVER_TIMING_ENABLED:
+            response.headers['Server-Timing'] = span.server_timing()
+        METRICS.observe_request(span, request.method, response.status_code)
+        return response
+
+    def teardown_request(exc=None):
+        token = request.environ.pop('instrumentation.token', None)
+        if token is not None:
+            span = current_span.get()
+            if span is not None and span.profiler is not None:
+                span.profiler.disable()
+            current_span.reset(token)
+
+    app.before_request(before_request)
+    app.after_request(after_request)
+    app.teardown_request(teardown_request)
+
+
+def traced(endpoint, handler):
+    """Обертка асинхронного обработчика Starlette: span, Server-Timing и метрики"""
+    @wraps(handler)
+    async def wrapper(request):
+        span = RequestSpan(endpoint)
+        token = current_span.set(span)
+        try:
+            response = await handler(request)
+            if SERVER_TIMING_ENABLED:
+                response.headers['Server-Timing'] = span.server_timing()
+            METRICS.observe_request(span, request.method, response.status_code)
+            return response
+        finally:
+            current_span.reset(token)
+    return wrapper
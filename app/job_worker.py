@@ -0,0 +1,186 @@
+import os
+import select
+import signal
+import threading
+import psycopg2 # type: ignore
+from dotenv import load_dotenv
+from database_manager import DatabaseManager
+from image_variants import ImageVariantProcessor
+from photo_gc import PhotoGarbageCollector
+from photo_storage import create_photo_storage
+from web_app import UPLOAD_FOLDER
+
+
+load_dotenv()
+# Сколько задач забирать за раз и на сколько секунд их за собой держать
+JOB_BATCH_SIZE = int(os.getenv('JOB_BATCH_SIZE', '10'))
+JOB_LEASE_SECONDS = int(os.getenv('JOB_LEASE_SECONDS', '300'))
+# Без NOTIFY очередь все равно опрашивается: отложенные задачи и потерянные уведомления
+JOB_POLL_SECONDS = float(os.getenv('JOB_POLL_SECONDS', '5'))
+# Повтор упавшей задачи: 5с, 10с, 20с ... не больше 10 минут
+JOB_RETRY_BASE_SECONDS = 5
+JOB_RETRY_MAX_SECONDS = 600
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', 'https://api.telegram.org')
+
+
+# Воркер очереди jobs. Задачи забираются пачками через FOR UPDATE SKIP LOCKED,
+# поэтому воркеров может быть сколько угодно. Пока очередь пуста, воркер ждет
+# NOTIFY jobs на отдельном соединении (enqueue_job шлет его в той же транзакции)
+# не дольше poll_interval. Если процесс умер с задачей, она вернется в очередь,
+# когда истечет lease.
+class JobWorker:
+    def __init__(self, db_manager, handlers, batch_size=JOB_BATCH_SIZE,
+                 poll_interval=JOB_POLL_SECONDS, lease=JOB_LEASE_SECONDS):
+        self.db_manager = db_manager
+        self.handlers = handlers
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.listen_conn = None
+        self.stop_event = threading.Event()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                processed = self.run_once()
+            except Exception as e:
+                print(f"❌ Ошибка выборки задач: {e}")
+                processed = 0
+            if processed < self.batch_size:
+                self.wait_for_jobs()
+        self.close_listener()
+
+    def run_once(self):
+        """Одна пачка задач, возвращает число обработанных"""
+        jobs = self.db_manager.claim_jobs(self.handlers.keys(), self.batch_size, self.lease)
+        for job_id, kind, payload, attempts, max_attempts in jobs:
+            self.execute(job_id, kind, payload, attempts, max_attempts)
+        return len(jobs)
+
+    def execute(self, job_id, kind, payload, attempts, max_attempts):
+        try:
+            self.handlers[kind](payload)
+        except Exception as e:
+            retry_delay = min(JOB_RETRY_BASE_SECONDS * 2 ** (attempts - 1), JOB_RETRY_MAX_SECONDS)
+            self.db_manager.fail_job(job_id, f"{type(e).__name__}: {e}", retry_delay)
+            if attempts >= max_attempts:
+                print(f"❌ Задача {kind} #{job_id} не выполнена после {attempts} попыток: {e}")
+            else:
+                print(f"⚠️ Задача {kind} #{job_id} упала, повтор через {retry_delay}с: {e}")
+            return False
+        self.db_manager.complete_job(job_id)
+        return True
+
+    def wait_for_jobs(self):
+        """Ожидание NOTIFY jobs или poll_interval"""
+        if self.listen_conn is None:
+            try:
+                self.listen_conn = psycopg2.connect(**DatabaseManager.connection_params())
+                self.listen_conn.autocommit = True
+                with self.listen_conn.cursor() as cursor:
+                    cursor.execute("LISTEN jobs;")
+            except psycopg2.Error as e:
+                print(f"❌ Ошибка подписки на уведомления очереди: {e}")
+                self.close_listener()
+                self.stop_event.wait(self.poll_interval)
+                return
+            # Задача могла появиться до LISTEN - сразу проверяем очередь еще раз
+            return
+
+        try:
+            ready, _, _ = select.select([self.listen_conn], [], [], self.poll_interval)
+            if ready:
+                self.listen_conn.poll()
+                self.listen_conn.notifies.clear()
+        except (OSError, psycopg2.Error) as e:
+            print(f"❌ Соединение уведомлений очереди разорвано: {e}")
+            self.close_listener()
+
+    def close_listener(self):
+        if self.listen_conn is not None:
+            try:
+                self.listen_conn.close()
+            except psycopg2.Error:
+                pass
+            self.listen_conn = None
+
+
+class TelegramSender:
+    def __init__(self, token, api_url=TELEGRAM_API_URL, timeout=10):
+        import httpx # type: ignore
+
+        self.url = f"{api_url.rstrip('/')}/bot{token}/sendMessage"
+        self.client = httpx.Client(timeout=timeout)
+
+    def send(self, payload):
+        """Задача telegram_message: {'chat_id': ..., 'text': ..., 'parse_mode': ...}"""
+        response = self.client.post(self.url, json=payload)
+        result = response.json()
+        if not result.get('ok'):
+            raise Exception(f"Telegram API {response.status_code}: {result.get('description')}")
+        return result['result']
+
+
+def create_handlers(storage, db_manager):
+    """Обработчики задач по типу"""
+    processor = ImageVariantProcessor(storage, db_manager, max_workers=1)
+
+    def image_variants(payload):
+        # Фото могли удалить до обработки - тогда делать нечего
+        if not storage.exists(payload['filename']):
+            return
+        variants = processor.generate_variants(payload['filename'])
+        db_manager.set_photo_variants(payload['photo_id'], variants)
+
+    handlers = {'image_variants': image_variants}
+    if os.getenv('BOT_TOKEN'):
+        handlers['telegram_message'] = TelegramSender(os.getenv('BOT_TOKEN')).send
+    return handlers
+
+
+def main():
+    """Запуск воркера очереди задач (обычно несколько процессов через supervisor.py)"""
+    worker_index = int(os.getenv('WORKER_INDEX', '0'))
+    db_manager = DatabaseManager()
+    if not db_manager.init_pool(
+        min_conn=1,
+        max_conn=int(os.getenv('JOB_DB_POOL_MAX', '4'))
+    ):
+        raise SystemExit(1)
+
+    storage = create_photo_storage(UPLOAD_FOLDER)
+    worker = JobWorker(db_manager, create_handlers(storage, db_manager))
+
+    # Сборщик безопасен в нескольких процессах, но одного достаточно
+    photo_gc = None
+    if os.getenv('PHOTO_GC_ENABLED', '1') == '1':
+        photo_gc = PhotoGarbageCollector(
+            storage,
+            db_manager,
+            interval=int(os.getenv('PHOTO_GC_INTERVAL_SECONDS', '30')),
+            batch_size=int(os.getenv('PHOTO_GC_BATCH_SIZE', '200')),
+            delete_delay=int(os.getenv('PHOTO_GC_DELAY_SECONDS', '60')),
+            orphan_grace=int(os.getenv('PHOTO_GC_ORPHAN_GRACE_SECONDS', str(24 * 60 * 60))),
+            reconcile_interval=int(os.getenv('PHOTO_GC_RECONCILE_SECONDS', str(6 * 60 * 60)))
+        )
+        photo_gc.start()
+
+    def handle_signal(signum, frame):
+        worker.stop()
+        if photo_gc:
+            photo_gc.stop()
+
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+
+    print(f"✅ Воркер очереди #{worker_index} запущен: {', '.join(worker.handlers)}")
+    worker.run()
+    db_manager.connection_pool.closeall()
+    print(f"✅ Воркер очереди #{worker_index} остановлен")
+
+
+if __name__ == '__main__':
+    main()
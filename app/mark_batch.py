@@ -0,0 +1,138 @@
+from mark_transfer import MarkImportError, TITLE_MAX_LENGTH, parse_visit_date, validate_mark
+
+
+# Пакет операций над метками (синхронизация офлайн-правок мини-приложения):
+#   {"operations": [
+#       {"op": "create", "ref": "tmp-1", "title": ..., "lat": ..., "lon": ..., "main_photo": "<поле файла>"},
+#       {"op": "update", "id": 12, "title": ..., "secondary_photos": ["<поле>", ...]},
+#       {"op": "delete", "id": 13}
+#   ]}
+# Пакет выполняется целиком или не выполняется вовсе, поэтому каждая метка может
+# встретиться в нем только один раз - порядок операций внутри пакета не важен.
+BATCH_MAX_OPERATIONS = 500
+BATCH_OPERATIONS = ('create', 'update', 'delete')
+MARK_FIELDS = ('title', 'description', 'visit_date', 'address', 'lat', 'lon')
+PHOTO_FIELDS = ('main_photo', 'secondary_photos')
+# Сколько ошибок проверки возвращать клиенту
+MAX_REPORTED_ERRORS = 50
+
+
+class MarkBatchError(ValueError):
+    def __init__(self, message, errors=None):
+        super().__init__(message)
+        self.errors = errors or []
+
+
+def validate_fields(raw):
+    """Проверка изменяемых полей метки; возвращает только переданные поля"""
+    fields = {}
+    if 'title' in raw:
+        title = (raw['title'] or '').strip()
+        if not title:
+            raise MarkImportError("Не указано название")
+        if len(title) > TITLE_MAX_LENGTH:
+            raise MarkImportError(f"Название длиннее {TITLE_MAX_LENGTH} символов")
+        fields['title'] = title
+
+    for name, limit in (('lat', 90), ('lon', 180)):
+        if name not in raw:
+            continue
+        try:
+            value = float(raw[name])
+        except (TypeError, ValueError):
+            raise MarkImportError("Некорректные координаты")
+        # CHECK valid_coordinates
+        if not -limit <= value <= limit:
+            raise MarkImportError("Координаты вне допустимого диапазона")
+        fields[name] = round(value, 8)
+
+    if 'visit_date' in raw:
+        try:
+            visit_date = parse_visit_date(raw['visit_date'])
+        except ValueError:
+            visit_date = None
+        # visit_date - NOT NULL, очистить ее нельзя
+        if visit_date is None:
+            raise MarkImportError("Некорректная дата посещения")
+        fields['visit_date'] = visit_date
+
+    for name in ('description', 'address'):
+        if name in raw:
+            fields[name] = raw[name] or None
+    return fields
+
+
+def validate_photos(raw):
+    """Имена полей с файлами фото: main_photo - строка, secondary_photos - список"""
+    main_photo = raw.get('main_photo')
+    if main_photo is not None and not isinstance(main_photo, str):
+        raise MarkImportError("main_photo - имя поля с файлом")
+
+    secondary_photos = raw.get('secondary_photos')
+    if secondary_photos is not None:
+        if not isinstance(secondary_photos, list) or not all(isinstance(name, str) for name in secondary_photos):
+            raise MarkImportError("secondary_photos - список имен полей с файлами")
+    return main_photo, secondary_photos
+
+
+def parse_mark_id(raw):
+    mark_id = raw.get('id')
+    if isinstance(mark_id, bool) or not isinstance(mark_id, (int, str)) or not str(mark_id).isdigit():
+        raise MarkImportError("Не указан id метки")
+    return int(mark_id)
+
+
+def parse_operation(index, raw, default_date):
+    if not isinstance(raw, dict):
+        raise MarkImportError("Операция должна быть объектом")
+    op = raw.get('op')
+    if op not in BATCH_OPERATIONS:
+        raise MarkImportError(f"Неизвестная операция: {op}")
+
+    operation = {'index': index, 'op': op, 'ref': raw.get('ref')}
+    for name in ('title', 'description', 'address', 'visit_date'):
+        if raw.get(name) is not None and not isinstance(raw[name], str):
+            raise MarkImportError(f"Поле {name} должно быть строкой")
+
+    if op == 'create':
+        operation['mark'] = validate_mark(raw, default_date)
+        operation['main_photo'], operation['secondary_photos'] = validate_photos(raw)
+        return operation
+
+    operation['id'] = parse_mark_id(raw)
+    if op == 'update':
+        unknown = set(raw) - set(MARK_FIELDS) - set(PHOTO_FIELDS) - {'op', 'id', 'ref'}
+        if unknown:
+            raise MarkImportError(f"Нельзя изменить поля: {', '.join(sorted(unknown))}")
+        operation['fields'] = validate_fields(raw)
+        operation['main_photo'], operation['secondary_photos'] = validate_photos(raw)
+    return operation
+
+
+def parse_operations(raw_operations, default_date, max_operations=BATCH_MAX_OPERATIONS):
+    """Проверка всего пакета до обращения к БД; при ошибках - MarkBatchError со списком"""
+    if not isinstance(raw_operations, list) or not raw_operations:
+        raise MarkBatchError("Не передан список операций")
+    if len(raw_operations) > max_operations:
+        raise MarkBatchError(f"Не больше {max_operations} операций в пакете")
+
+    operations = []
+    errors = []
+    seen_ids = set()
+    for index, raw in enumerate(raw_operations):
+        try:
+            operation = parse_operation(index, raw, default_date)
+            if 'id' in operation:
+                if operation['id'] in seen_ids:
+                    raise MarkImportError("Метка уже встречается в пакете")
+                seen_ids.add(operation['id'])
+            operations.append(operation)
+        except MarkImportError as e:
+            if len(errors) < MAX_REPORTED_ERRORS:
+                errors.append({'index': index, 'message': str(e)})
+            else:
+                break
+
+    if errors:
+        raise MarkBatchError("Пакет не прошел проверку", errors)
+    return operations
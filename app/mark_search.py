@@ -0,0 +1,47 @@
+import re
+from datetime import date
+
+
+# Поиск по своим меткам: полнотекстовый (tsvector marks.search_vector, русская
+# морфология + simple для имен и незнакомых слов), по началу слов - для ввода
+# на лету, и по триграммам pg_trgm - для опечаток в названии и адресе.
+SEARCH_MAX_QUERY_LENGTH = 200
+SEARCH_MAX_WORDS = 8
+DEFAULT_SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 100
+# Буквы и цифры без "_": подчеркивание парсер tsquery считает разделителем
+WORD_RE = re.compile(r'[^\W_]+')
+
+
+def parse_query(value):
+    """Запрос поиска: (текст для websearch_to_tsquery и триграмм, tsquery по началу слов)"""
+    text = ' '.join((value or '').split())
+    if not text:
+        raise ValueError("Пустой запрос")
+    if len(text) > SEARCH_MAX_QUERY_LENGTH:
+        raise ValueError(f"Запрос длиннее {SEARCH_MAX_QUERY_LENGTH} символов")
+
+    words = WORD_RE.findall(text.lower())[:SEARCH_MAX_WORDS]
+    if not words:
+        raise ValueError("В запросе нет слов")
+    return text, ' & '.join(f"{word}:*" for word in words)
+
+
+def parse_limit(value):
+    """Размер страницы результатов"""
+    if value is None or value == '':
+        return DEFAULT_SEARCH_LIMIT
+    limit = int(value)
+    if limit < 1:
+        raise ValueError("limit должен быть положительным")
+    return min(limit, MAX_SEARCH_LIMIT)
+
+
+def parse_date(value, name):
+    """Граница периода посещения из ?date_from= / ?date_to= (YYYY-MM-DD)"""
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(value)
+    except ValueError as e:
+        raise ValueError(f"Некорректная дата {name}") from e
@@ -0,0 +1,117 @@
+from collections import Counter
+from datetime import date
+import geo
+
+
+# Статистика по меткам без обхода таблицы marks: счетчики в mark_stats
+# (пользователь) и mark_stats_global (все пользователи) обновляются в той же
+# транзакции, что и сами метки. Срезы (kind, bucket):
+#   ('total', '')             - все метки
+#   ('month', 'YYYY-MM')      - месяц visit_date
+#   ('geohash2', 'u4')        - ячейка geohash (страна/крупный регион, ~1250 км)
+#   ('geohash4', 'u4pr')      - ячейка geohash (город с окрестностями, ~40 км)
+#   ('activity', 'YYYY-MM')   - изменения меток в месяце; не уменьшается при удалении
+# В глобальной таблице user_count - число пользователей с ненулевым счетчиком
+# среза: для total - пользователи с метками, для activity - активные за месяц.
+TOTAL = 'total'
+MONTH = 'month'
+ACTIVITY = 'activity'
+STATS_GEOHASH_PRECISIONS = (2, 4)
+GEOHASH_KIND_PREFIX = 'geohash'
+DEFAULT_TOP_CELLS = 50
+MAX_TOP_CELLS = 500
+
+
+def geohash_kind(precision):
+    return f"{GEOHASH_KIND_PREFIX}{precision}"
+
+
+def month_bucket(value):
+    """Месяц 'YYYY-MM' из date или строки 'YYYY-MM-DD'"""
+    return str(value)[:7]
+
+
+def mark_buckets(visit_date, lat, lon):
+    """Срезы, в которые попадает метка"""
+    lat, lon = float(lat), float(lon)
+    buckets = [(TOTAL, ''), (MONTH, month_bucket(visit_date))]
+    for precision in STATS_GEOHASH_PRECISIONS:
+        buckets.append((geohash_kind(precision), geo.geohash(lat, lon, precision)))
+    return buckets
+
+
+def count_mark(deltas, visit_date, lat, lon, diff=1):
+    """Учет метки (diff=1) или ее удаления (diff=-1) в Counter изменений"""
+    for bucket in mark_buckets(visit_date, lat, lon):
+        deltas[bucket] += diff
+
+
+def stats_deltas(added=(), removed=(), changes=0, today=None):
+    """Изменения счетчиков: added/removed - (visit_date, lat, lon), changes - для activity
+
+    Перенос метки внутри ячейки или месяца дает нулевые изменения, они
+    отбрасываются и до БД не доходят.
+    """
+    deltas = Counter()
+    for visit_date, lat, lon in removed:
+        count_mark(deltas, visit_date, lat, lon, -1)
+    for visit_date, lat, lon in added:
+        count_mark(deltas, visit_date, lat, lon)
+    if changes:
+        deltas[(ACTIVITY, month_bucket(today or date.today()))] += changes
+    return Counter({bucket: diff for bucket, diff in deltas.items() if diff})
+
+
+def parse_top(value):
+    """Сколько самых заполненных ячеек каждого уровня вернуть"""
+    if value is None or value == '':
+        return DEFAULT_TOP_CELLS
+    top = int(value)
+    if top < 1:
+        raise ValueError("top должен быть положительным")
+    return min(top, MAX_TOP_CELLS)
+
+
+def with_users(row, entry):
+    # user_count есть только у глобальной статистики
+    if row.user_count is not None:
+        entry['users'] = row.user_count
+    return entry
+
+
+def build_report(rows):
+    """Ответ API из строк MarkStatsRecord (kind, bucket, mark_count, user_count, cells)"""
+    report = {
+        'marks': 0,
+        'months': [],
+        'activity': [],
+        'regions': {
+            geohash_kind(precision): {'precision': precision, 'count': 0, 'top': []}
+            for precision in STATS_GEOHASH_PRECISIONS
+        }
+    }
+    for row in rows:
+        if row.kind == TOTAL:
+            report['marks'] = row.mark_count
+            if row.user_count is not None:
+                report['users'] = row.user_count
+        elif row.kind == MONTH:
+            report['months'].append(with_users(row, {'month': row.bucket, 'marks': row.mark_count}))
+        elif row.kind == ACTIVITY:
+            report['activity'].append(with_users(row, {'month': row.bucket, 'changes': row.mark_count}))
+        elif row.kind in report['regions']:
+            regions = report['regions'][row.kind]
+            regions['count'] = row.cells
+            lat, lon = geo.geohash_center(row.bucket)
+            regions['top'].append(with_users(row, {
+                'geohash': row.bucket,
+                'marks': row.mark_count,
+                'lat': lat,
+                'lon': lon
+            }))
+
+    report['months'].sort(key=lambda entry: entry['month'])
+    report['activity'].sort(key=lambda entry: entry['month'])
+    for regions in report['regions'].values():
+        regions['top'].sort(key=lambda entry: (-entry['marks'], entry['geohash']))
+    return report
@@ -0,0 +1,315 @@
+import csv
+import io
+import json
+import os
+from datetime import date, datetime
+from xml.etree.ElementTree import iterparse
+
+
+IMPORT_FORMATS = ('csv', 'geojson', 'gpx')
+EXPORT_FORMATS = ('csv', 'geojson', 'gpx')
+TITLE_MAX_LENGTH = 200
+# Сколько ошибок разбора возвращать клиенту, остальные только считаются
+MAX_REPORTED_ERRORS = 50
+
+
+class MarkImportError(ValueError):
+    pass
+
+
+def detect_format(filename, requested=None):
+    """Формат файла импорта: явно указанный или по расширению"""
+    if requested:
+        fmt = requested.lower()
+    else:
+        fmt = os.path.splitext(filename or '')[1].lstrip('.').lower()
+        fmt = {'json': 'geojson', 'geojsonl': 'geojson', 'geojsons': 'geojson'}.get(fmt, fmt)
+    if fmt not in IMPORT_FORMATS:
+        raise MarkImportError(f"Неподдерживаемый формат: {fmt or 'не указан'}")
+    return fmt
+
+
+def parse_visit_date(value):
+    """Дата посещения из ISO даты или ISO времени (как в GPX <time>)"""
+    if not value:
+        return None
+    value = value.strip()
+    if len(value) > 10:
+        return datetime.fromisoformat(value.replace('Z', '+00:00')).date()
+    return date.fromisoformat(value)
+
+
+def validate_mark(raw, default_date):
+    """Проверка метки до COPY - те же правила, что и у ограничений таблицы marks"""
+    title = (raw.get('title') or '').strip()
+    if not title:
+        raise MarkImportError("Не указано название")
+    if len(title) > TITLE_MAX_LENGTH:
+        raise MarkImportError(f"Название длиннее {TITLE_MAX_LENGTH} символов")
+
+    try:
+        lat = float(raw.get('lat'))
+        lon = float(raw.get('lon'))
+    except (TypeError, ValueError):
+        raise MarkImportError("Некорректные координаты")
+    # CHECK valid_coordinates
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise MarkImportError("Координаты вне допустимого диапазона")
+
+    try:
+        visit_date = parse_visit_date(raw.get('visit_date')) or default_date
+    except ValueError:
+        raise MarkImportError("Некорректная дата посещения")
+
+    return (
+        title,
+        raw.get('description') or None,
+        visit_date,
+        raw.get('address') or None,
+        round(lat, 8),
+        round(lon, 8)
+    )
+
+
+def iter_csv(stream):
+    """Метки из CSV с колонками title, lat, lon, visit_date, description, address"""
+    reader = csv.DictReader(io.TextIOWrapper(stream, encoding='utf-8-sig', newline=''))
+    for row in reader:
+        yield reader.line_num, row
+
+
+# GeoJSON читается порциями: в памяти держится одна Feature, а не весь файл
+GEOJSON_READ_SIZE = 64 * 1024
+# Битая Feature не должна заставить дочитать в буфер остаток файла
+GEOJSON_MAX_VALUE_SIZE = 1024 * 1024
+
+
+class JsonStreamReader:
+    def __init__(self, text_stream, read_size=GEOJSON_READ_SIZE):
+        self.text_stream = text_stream
+        self.read_size = read_size
+        self.buffer = ''
+        self.pos = 0
+        self.decoder = json.JSONDecoder()
+
+    def fill(self):
+        data = self.text_stream.read(self.read_size)
+        if not data:
+            return False
+        self.buffer = self.buffer[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Следующий значащий символ ('' - конец файла); \x1e разделяет записи GeoJSONSeq"""
+        while True:
+            while self.pos < len(self.buffer) and (self.buffer[self.pos].isspace() or self.buffer[self.pos] == '\x1e'):
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                return ''
+
+    def expect(self, chars):
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError(f"ожидался один из символов {chars!r}, позиция {self.pos}")
+        self.pos += 1
+        return char
+
+    def value(self):
+        """Одно JSON-значение целиком"""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except ValueError:
+                if len(self.buffer) - self.pos <= GEOJSON_MAX_VALUE_SIZE and self.fill():
+                    continue
+                raise
+            # Число на границе порции могло быть прочитано не полностью
+            if end == len(self.buffer) and end - self.pos <= GEOJSON_MAX_VALUE_SIZE and self.fill():
+                continue
+            self.pos = end
+            return value
+
+
+def iter_geojson(stream):
+    """Метки из GeoJSON: FeatureCollection или GeoJSONSeq (Feature подряд)
+
+    Объекты верхнего уровня разбираются по ключам, а массив features - по
+    одной Feature, поэтому большой файл не загружается в память целиком.
+    """
+    reader = JsonStreamReader(io.TextIOWrapper(stream, encoding='utf-8-sig'))
+    index = 0
+    while reader.peek():
+        members = {}
+        reader.expect('{')
+        while reader.peek() != '}':
+            key = reader.value()
+            reader.expect(':')
+            if key == 'features':
+                reader.expect('[')
+                while reader.peek() != ']':
+                    index += 1
+                    yield index, _feature_to_mark(reader.value())
+                    if reader.peek() != ']':
+                        reader.expect(',')
+                reader.expect(']')
+            else:
+                members[key] = reader.value()
+            if reader.peek() != '}':
+                reader.expect(',')
+        reader.expect('}')
+
+        # Запись GeoJSONSeq - сама Feature
+        if members.get('type') == 'Feature':
+            index += 1
+            yield index, _feature_to_mark(members)
+
+
+def _feature_to_mark(feature):
+    if not isinstance(feature, dict):
+        raise MarkImportError("Feature должна быть объектом")
+    geometry = feature.get('geometry') or {}
+    properties = feature.get('properties') or {}
+    coordinates = geometry.get('coordinates') or [None, None]
+    if geometry.get('type') != 'Point':
+        coordinates = [None, None]
+    return {
+        'title': properties.get('title') or properties.get('name'),
+        'description': properties.get('description'),
+        'visit_date': properties.get('visit_date') or properties.get('date'),
+        'address': properties.get('address'),
+        'lat': coordinates[1],
+        'lon': coordinates[0]
+    }
+
+
+def iter_gpx(stream):
+    """Метки из точек <wpt> GPX, файл разбирается потоково
+
+    Разобранные элементы сразу удаляются из дерева, поэтому в памяти только
+    текущая ветка, даже если в файле треки на сотни тысяч точек <trkpt>.
+    """
+    index = 0
+    path = []
+    for event, element in iterparse(stream, events=('start', 'end')):
+        if event == 'start':
+            path.append(element)
+            continue
+        path.pop()
+        parent = path[-1] if path else None
+        if parent is not None and _local_name(parent.tag) == 'wpt':
+            # Поля точки нужны, пока не закончится сама точка
+            continue
+        if _local_name(element.tag) == 'wpt':
+            index += 1
+            children = {_local_name(child.tag): (child.text or '').strip() for child in element}
+            yield index, {
+                'title': children.get('name'),
+                'description': children.get('desc') or children.get('cmt'),
+                'visit_date': children.get('time'),
+                'address': None,
+                'lat': element.get('lat'),
+                'lon': element.get('lon')
+            }
+        element.clear()
+        if parent is not None:
+            parent.remove(element)
+
+
+def _local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+PARSERS = {
+    'csv': iter_csv,
+    'geojson': iter_geojson,
+    'gpx': iter_gpx
+}
+
+
+def iter_valid_marks(stream, fmt, report):
+    """Проверенные метки для COPY; ошибки складываются в report"""
+    default_date = date.today()
+    try:
+        for position, raw in PARSERS[fmt](stream):
+            try:
+                yield validate_mark(raw, default_date)
+            except MarkImportError as e:
+                report['skipped'] += 1
+                if len(report['errors']) < MAX_REPORTED_ERRORS:
+                    report['errors'].append({'row': position, 'message': str(e)})
+    except (ValueError, SyntaxError, csv.Error) as e:
+        # Битый JSON/XML/CSV - прерываем импорт целиком
+        raise MarkImportError(f"Ошибка разбора файла: {e}")
+
+
+# Экспорт: каждая строка COPY - готовый фрагмент файла. Для GeoJSON и GPX
+# строка собирается в SQL, а переводы строк экранируются, чтобы одна метка
+# всегда занимала одну строку вывода COPY.
+EXPORT_QUERIES = {
+    'csv': """
+        SELECT title, lat, lon, visit_date, description, address
+        FROM marks WHERE user_id = %s
+        ORDER BY visit_date DESC, created_at DESC, id DESC
+    """,
+    'geojson': """
+        SELECT json_build_object(
+            'type', 'Feature',
+            'geometry', json_build_object('type', 'Point', 'coordinates', json_build_array(lon, lat)),
+            'properties', json_build_object(
+                'title', title, 'description', description,
+                'visit_date', visit_date, 'address', address
+            )
+        )::text
+        FROM marks WHERE user_id = %s
+        ORDER BY visit_date DESC, created_at DESC, id DESC
+    """,
+    'gpx': """
+        SELECT replace(replace(xmlelement(name wpt, xmlattributes(lat AS lat, lon AS lon),
+            xmlelement(name name, title),
+            xmlelement(name "desc", description),
+            xmlelement(name time, to_char(visit_date, 'YYYY-MM-DD"T"00:00:00"Z"'))
+        )::text, E'\\n', '&#10;'), E'\\r', '&#13;')
+        FROM marks WHERE user_id = %s
+        ORDER BY visit_date DESC, created_at DESC, id DESC
+    """
+}
+
+# CSV с "невозможными" кавычкой и разделителем - строки выходят без экранирования
+EXPORT_COPY_OPTIONS = {
+    'csv': "FORMAT csv, HEADER",
+    'geojson': "FORMAT csv, QUOTE E'\\x01', DELIMITER E'\\x02'",
+    'gpx': "FORMAT csv, QUOTE E'\\x01', DELIMITER E'\\x02'"
+}
+
+EXPORT_MIMETYPES = {
+    'csv': 'text/csv',
+    'geojson': 'application/geo+json',
+    'gpx': 'application/gpx+xml'
+}
+
+
+def wrap_export(fmt, chunks):
+    """Оборачивание строк COPY в итоговый файл нужного формата"""
+    if fmt == 'csv':
+        yield from chunks
+        return
+
+    if fmt == 'geojson':
+        yield b'{"type": "FeatureCollection", "features": ['
+        first = True
+        for chunk in chunks:
+            rows = chunk.rstrip(b'\n').replace(b'\n', b',')
+            if rows:
+                yield rows if first else b',' + rows
+                first = False
+        yield b']}\n'
+        return
+
+    yield (b'<?xml version="1.0" encoding="UTF-8"?>\n'
+           b'<gpx version="1.1" creator="bilodelo" xmlns="http://www.topografix.com/GPX/1/1">\n')
+    yield from chunks
+    yield b'</gpx>\n'
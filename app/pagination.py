@@ -0,0 +1,94 @@
+import base64
+import hashlib
+import json
+from datetime import date, datetime
+
+
+# Поля метки, которые можно запросить через ?fields=
+MARK_FIELDS = ('id', 'user_id', 'title', 'description', 'visit_date', 'address', 'lat', 'lon', 'created_at', 'updated_at')
+# Больше изменений - клиенту проще загрузить список заново
+MAX_CHANGES = 5000
+DEFAULT_PAGE_SIZE = 200
+MAX_PAGE_SIZE = 1000
+
+
+def parse_fields(value):
+    """Разбор ?fields=id,lat,lon,title; None - все поля"""
+    if not value:
+        return None
+
+    requested = {field.strip() for field in value.split(',') if field.strip()}
+    unknown = sorted(requested - set(MARK_FIELDS))
+    if unknown:
+        raise ValueError(f"Неизвестные поля: {', '.join(unknown)}")
+    # Порядок MARK_FIELDS, а не запроса: перестановки полей дают тот же
+    # запрос, тот же класс записи и тот же подготовленный запрос
+    return tuple(field for field in MARK_FIELDS if field in requested) or None
+
+
+def parse_limit(value, cursor=None):
+    """Размер страницы; None - старое поведение, весь список целиком"""
+    if value is None or value == '':
+        return DEFAULT_PAGE_SIZE if cursor else None
+
+    limit = int(value)
+    if limit < 1:
+        raise ValueError("limit должен быть положительным")
+    return min(limit, MAX_PAGE_SIZE)
+
+
+def encode_cursor(visit_date, created_at, mark_id):
+    """Курсор на последнюю отданную метку: (visit_date, created_at, id)"""
+    payload = json.dumps([visit_date.isoformat(), created_at.isoformat(), mark_id])
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(value):
+    """Разбор курсора из ?cursor=; None - первая страница"""
+    if not value:
+        return None
+
+    try:
+        padded = value + '=' * (-len(value) % 4)
+        visit_date, created_at, mark_id = json.loads(base64.urlsafe_b64decode(padded))
+        return date.fromisoformat(visit_date), datetime.fromisoformat(created_at), int(mark_id)
+    except (ValueError, TypeError) as e:
+        raise ValueError("Некорректный cursor") from e
+
+
+def encode_search_cursor(score, mark_id):
+    """Курсор поиска на последний отданный результат: (score, id)"""
+    payload = json.dumps([score, mark_id])
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_search_cursor(value):
+    """Разбор курсора поиска; None - первая страница"""
+    if not value:
+        return None
+
+    try:
+        padded = value + '=' * (-len(value) % 4)
+        score, mark_id = json.loads(base64.urlsafe_b64decode(padded))
+        return float(score), int(mark_id)
+    except (ValueError, TypeError) as e:
+        raise ValueError("Некорректный cursor") from e
+
+
+def parse_since(value):
+    """Версия списка меток из ?since=; 0 - все метки"""
+    if not value:
+        return 0
+    try:
+        since = int(value)
+    except ValueError as e:
+        raise ValueError("Некорректный since") from e
+    if since < 0:
+        raise ValueError("Некорректный since")
+    return since
+
+
+def marks_etag(user_id, version, path, query_string):
+    """ETag ответа со списком меток: версия списка и параметры запроса"""
+    key = f"{user_id}:{version}:{path}?{query_string}"
+    return hashlib.md5(key.encode('utf-8')).hexdigest()
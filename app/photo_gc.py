@@ -0,0 +1,136 @@
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from image_variants import ImageVariantProcessor, VARIANT_SIZES, VARIANT_EXTENSION
+
+
+# Ключ advisory-блокировки сверки: одновременно хранилище обходит один процесс
+RECONCILE_LOCK_KEY = 7203001
+
+
+# Файлы фото удаляются не в запросе, а фоновым сборщиком. Удаление строк photos
+# ставит файлы в очередь pending_deletes в той же транзакции; сборщик разбирает
+# очередь пачками (FOR UPDATE SKIP LOCKED), перед удалением еще раз проверяет,
+# что на файл никто не ссылается, и заодно иногда сверяет хранилище с таблицей
+# photos, подбирая файлы-сироты старше orphan_grace.
+class PhotoGarbageCollector:
+    def __init__(self, storage, db_manager, interval=30, batch_size=200, delete_delay=60,
+                 orphan_grace=24 * 60 * 60, reconcile_interval=6 * 60 * 60):
+        self.storage = storage
+        self.db_manager = db_manager
+        self.interval = interval
+        self.batch_size = batch_size
+        self.delete_delay = delete_delay
+        self.orphan_grace = orphan_grace
+        self.reconcile_interval = reconcile_interval
+        # Первая сверка - через reconcile_interval, а не при старте процесса
+        self.reconciled_at = time.monotonic()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='photo-gc', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            self.run_once()
+
+    def run_once(self):
+        """Один проход: очередь удаления и, если пора, сверка хранилища"""
+        try:
+            deleted = self.sweep()
+            if deleted:
+                print(f"✅ Сборщик фото: обработано записей очереди {deleted}")
+        except Exception as e:
+            print(f"❌ Ошибка разбора очереди удаления фото: {e}")
+
+        if time.monotonic() - self.reconciled_at >= self.reconcile_interval:
+            self.reconciled_at = time.monotonic()
+            try:
+                orphans = self.reconcile_orphans()
+                if orphans:
+                    print(f"✅ Сборщик фото: найдено файлов без ссылок {orphans}")
+            except Exception as e:
+                print(f"❌ Ошибка сверки хранилища фото: {e}")
+
+    def sweep(self):
+        """Разбор очереди пачками, пока она не опустеет"""
+        total = 0
+        while not self.stop_event.is_set():
+            processed = self.sweep_batch()
+            total += processed
+            if processed < self.batch_size:
+                break
+        return total
+
+    def sweep_batch(self):
+        """Одна пачка очереди в одной транзакции"""
+        with self.db_manager.transaction() as cursor:
+            batch = self.db_manager.claim_pending_deletes(self.batch_size, self.delete_delay, cursor)
+            if not batch:
+                return 0
+
+            # Имя файла - хеш содержимого: то же фото могли загрузить снова.
+            # Загрузка держит блокировку имени до commit ссылки (lock_photo_files),
+            # поэтому ссылки проверяются после захвата блокировки, а занятые
+            # файлы откладываются до следующего прохода
+            filenames = {item['filename'] for item in batch}
+            locked = self.db_manager.try_lock_photo_files(filenames, cursor)
+            referenced = self.db_manager.get_referenced_filenames(locked, cursor)
+            done_ids = []
+            failed = []
+            for item in batch:
+                if item['filename'] not in locked:
+                    failed.append((item['id'], "Файл занят загрузкой"))
+                    continue
+                if item['filename'] not in referenced:
+                    try:
+                        self.delete_files(item['filename'])
+                    except Exception as e:
+                        failed.append((item['id'], str(e)))
+                        continue
+                done_ids.append(item['id'])
+
+            self.db_manager.finish_pending_deletes(done_ids, failed, self.interval, cursor)
+        return len(batch)
+
+    def delete_files(self, filename):
+        """Удаление файла и всех его производных размеров"""
+        self.storage.delete(filename)
+        for variant_name in ImageVariantProcessor.variant_filenames(filename).values():
+            self.storage.delete(variant_name)
+
+    @staticmethod
+    def variant_stem(key):
+        """Имя оригинала без расширения для файла производного размера, иначе None"""
+        if not key.endswith(VARIANT_EXTENSION) or '__' not in key:
+            return None
+        stem, variant = key[:-len(VARIANT_EXTENSION)].rsplit('__', 1)
+        return stem if variant in VARIANT_SIZES else None
+
+    def reconcile_orphans(self):
+        """Постановка в очередь файлов хранилища, на которые нет ссылок в photos"""
+        with self.db_manager.transaction() as cursor:
+            if not self.db_manager.try_advisory_lock(RECONCILE_LOCK_KEY, cursor):
+                return 0
+
+            referenced = self.db_manager.get_all_photo_filenames(cursor)
+            stems = {os.path.splitext(filename)[0] for filename in referenced}
+            # Свежие файлы могут принадлежать еще не закоммиченной загрузке
+            cutoff = datetime.now(timezone.utc) - timedelta(seconds=self.orphan_grace)
+
+            orphans = []
+            for key in self.storage.iter_keys():
+                if key in referenced or self.variant_stem(key) in stems:
+                    continue
+                stat = self.storage.stat(key)
+                if stat and stat.mtime < cutoff:
+                    orphans.append(key)
+
+            self.db_manager.enqueue_photo_deletes(orphans, cursor)
+        return len(orphans)
@@ -0,0 +1,279 @@
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+from collections import namedtuple
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+PhotoStat = namedtuple('PhotoStat', ['size', 'mtime', 'etag'])
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def parse_range(header, size):
+    """Разбор заголовка Range: bytes=start-end; None - отдавать файл целиком"""
+    if not header or not header.startswith('bytes=') or ',' in header:
+        return None
+    start, _, end = header[len('bytes='):].strip().partition('-')
+    try:
+        if start:
+            start = int(start)
+            end = min(int(end), size - 1) if end else size - 1
+        else:
+            # bytes=-N - последние N байт
+            start = max(size - int(end), 0)
+            end = size - 1
+    except ValueError:
+        return None
+    if start > end or start >= size:
+        return None
+    return start, end
+
+
+def iter_chunks(file, length=None):
+    """Чтение файла кусками, не больше length байт"""
+    try:
+        while length is None or length > 0:
+            chunk = file.read(STREAM_CHUNK_SIZE if length is None else min(STREAM_CHUNK_SIZE, length))
+            if not chunk:
+                break
+            if length is not None:
+                length -= len(chunk)
+            yield chunk
+    finally:
+        file.close()
+
+
+class PhotoStorage:
+    """Хранилище фото: ключ - имя файла из таблицы photos"""
+
+    def open(self, key, start=None, end=None):
+        """Поток для чтения фото (или байт start..end включительно)"""
+        raise NotImplementedError
+
+    def put(self, key, fileobj):
+        """Запись фото из потока"""
+        raise NotImplementedError
+
+    def put_file(self, key, path):
+        """Перенос локального временного файла в хранилище, исходный файл удаляется"""
+        with open(path, 'rb') as file:
+            self.put(key, file)
+        os.remove(path)
+
+    def delete(self, key):
+        """Удаление фото; отсутствие файла ошибкой не считается"""
+        raise NotImplementedError
+
+    def stat(self, key):
+        """PhotoStat или None, если фото нет"""
+        raise NotImplementedError
+
+    def exists(self, key):
+        return self.stat(key) is not None
+
+    def local_path(self, key):
+        """Путь на локальном диске для отдачи через sendfile, если он есть"""
+        return None
+
+    def iter_keys(self):
+        """Все ключи хранилища"""
+        raise NotImplementedError
+
+
+# Файлы раскладываются по подпапкам из первых символов хеша ключа:
+# upload/ab/cd/<key>. Старые файлы из плоской папки читаются как раньше,
+# пока их не перенесет migrate_flat_layout().
+class LocalPhotoStorage(PhotoStorage):
+    def __init__(self, root, shard_depth=2, shard_width=2):
+        self.root = root
+        self.shard_depth = shard_depth
+        self.shard_width = shard_width
+        os.makedirs(root, exist_ok=True)
+
+    def shard_path(self, key):
+        if os.path.basename(key) != key or key.startswith('.'):
+            raise ValueError(f"Некорректный ключ фото: {key}")
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        shards = [digest[i * self.shard_width:(i + 1) * self.shard_width] for i in range(self.shard_depth)]
+        return os.path.join(self.root, *shards, key)
+
+    def local_path(self, key):
+        try:
+            path = self.shard_path(key)
+        except ValueError:
+            return None
+        if os.path.isfile(path):
+            return path
+        legacy_path = os.path.join(self.root, key)
+        if os.path.isfile(legacy_path):
+            return legacy_path
+        return None
+
+    def open(self, key, start=None, end=None):
+        path = self.local_path(key)
+        if path is None:
+            raise FileNotFoundError(key)
+        file = open(path, 'rb')
+        if start:
+            file.seek(start)
+        return file
+
+    def put(self, key, fileobj):
+        path = self.shard_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Ключ - хеш содержимого, тот же файл могут писать параллельно
+        # (поток обработки и job_worker): у каждой записи свой временный файл
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                shutil.copyfileobj(fileobj, file, STREAM_CHUNK_SIZE)
+            # mkstemp создает файл 0600, а фото отдает и nginx (X-Sendfile)
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+
+    def put_file(self, key, path):
+        target_path = self.shard_path(key)
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        # Временный файл загрузки тоже из mkstemp (0600) - см. put
+        os.chmod(path, 0o644)
+        os.replace(path, target_path)
+
+    def delete(self, key):
+        path = self.local_path(key)
+        if path:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def stat(self, key):
+        path = self.local_path(key)
+        if path is None:
+            return None
+        try:
+            stat_result = os.stat(path)
+        except FileNotFoundError:
+            return None
+        etag = f"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"
+        return PhotoStat(stat_result.st_size, datetime.fromtimestamp(stat_result.st_mtime, timezone.utc), etag)
+
+    def iter_keys(self):
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if not filename.startswith('.') and not filename.endswith('.tmp'):
+                    yield filename
+
+    def migrate_flat_layout(self):
+        """Перенос файлов из плоской папки в подпапки, возвращает их число"""
+        moved = 0
+        for entry in os.scandir(self.root):
+            if entry.is_file() and not entry.name.startswith('.'):
+                self.put_file(entry.name, entry.path)
+                moved += 1
+        return moved
+
+
+# Любое S3-совместимое хранилище (AWS S3, MinIO, Yandex Object Storage);
+# адрес задается через endpoint_url, поэтому локально можно поднять MinIO.
+class S3PhotoStorage(PhotoStorage):
+    def __init__(self, bucket, prefix='', endpoint_url=None, region=None, access_key=None, secret_key=None):
+        try:
+            import boto3 # type: ignore
+            from botocore.exceptions import ClientError # type: ignore
+        except ImportError as e:
+            raise RuntimeError("Для PHOTO_STORAGE=s3 нужен пакет boto3: pip install boto3") from e
+
+        self.ClientError = ClientError
+        self.bucket = bucket
+        self.prefix = prefix.strip('/') + '/' if prefix.strip('/') else ''
+        self.client = boto3.client(
+            's3',
+            endpoint_url=endpoint_url,
+            region_name=region,
+            aws_access_key_id=access_key,
+            aws_secret_access_key=secret_key
+        )
+
+    def object_key(self, key):
+        if os.path.basename(key) != key or key.startswith('.'):
+            raise ValueError(f"Некорректный ключ фото: {key}")
+        return f"{self.prefix}{key}"
+
+    def _is_not_found(self, error):
+        return error.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound')
+
+    def open(self, key, start=None, end=None):
+        params = {'Bucket': self.bucket, 'Key': self.object_key(key)}
+        if start is not None or end is not None:
+            params['Range'] = f"bytes={start or 0}-{'' if end is None else end}"
+        try:
+            return self.client.get_object(**params)['Body']
+        except self.ClientError as e:
+            if self._is_not_found(e):
+                raise FileNotFoundError(key) from e
+            raise
+
+    def put(self, key, fileobj):
+        self.client.upload_fileobj(fileobj, self.bucket, self.object_key(key))
+
+    def put_file(self, key, path):
+        self.client.upload_file(path, self.bucket, self.object_key(key))
+        os.remove(path)
+
+    def delete(self, key):
+        # DeleteObject в S3 не падает на отсутствующем ключе
+        self.client.delete_object(Bucket=self.bucket, Key=self.object_key(key))
+
+    def stat(self, key):
+        try:
+            head = self.client.head_object(Bucket=self.bucket, Key=self.object_key(key))
+        except self.ClientError as e:
+            if self._is_not_found(e):
+                return None
+            raise
+        return PhotoStat(head['ContentLength'], head['LastModified'], head['ETag'].strip('"'))
+
+    def iter_keys(self):
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for item in page.get('Contents', []):
+                yield item['Key'][len(self.prefix):]
+
+
+def create_photo_storage(upload_folder):
+    """Хранилище по настройкам окружения: PHOTO_STORAGE=local|s3"""
+    backend = os.getenv('PHOTO_STORAGE', 'local')
+    if backend == 's3':
+        return S3PhotoStorage(
+            bucket=os.getenv('S3_BUCKET', 'bilodelo-photos'),
+            prefix=os.getenv('S3_PREFIX', ''),
+            endpoint_url=os.getenv('S3_ENDPOINT_URL') or None,
+            region=os.getenv('S3_REGION') or None,
+            access_key=os.getenv('S3_ACCESS_KEY') or None,
+            secret_key=os.getenv('S3_SECRET_KEY') or None
+        )
+    if backend != 'local':
+        raise ValueError(f"Неизвестное хранилище фото: {backend}")
+    return LocalPhotoStorage(
+        upload_folder,
+        shard_depth=int(os.getenv('PHOTO_SHARD_DEPTH', '2'))
+    )
+
+
+if __name__ == '__main__':
+    # python photo_storage.py migrate - перенос плоской папки upload/ в подпапки
+    if len(sys.argv) > 1 and sys.argv[1] == 'migrate':
+        storage = LocalPhotoStorage(sys.argv[2] if len(sys.argv) > 2 else 'upload')
+        print(f"✅ Перенесено файлов: {storage.migrate_flat_layout()}")
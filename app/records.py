@@ -0,0 +1,50 @@
+from dataclasses import make_dataclass
+from functools import lru_cache
+
+
+# Строки из БД - компактные неизменяемые объекты со __slots__ вместо dict на
+# каждую строку. Доступ как к dict (row['id'], row.get('id')) оставлен, чтобы
+# обработчики и шаблоны не заметили разницы; JSON - через json_default/orjson.
+class Record:
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def __contains__(self, key):
+        return key in self.__dataclass_fields__
+
+    def keys(self):
+        return self.__dataclass_fields__.keys()
+
+    def _asdict(self):
+        return {field: getattr(self, field) for field in self.__dataclass_fields__}
+
+
+# Наборы полей - подмножества pagination.MARK_FIELDS в их порядке (не больше
+# 2^10) и несколько именованных записей; предел - на случай ошибки в вызывающем коде
+@lru_cache(maxsize=2048)
+def record_type(name, fields):
+    """Класс записи с указанными полями; один класс на набор полей"""
+    return make_dataclass(name, fields, bases=(Record,), slots=True, frozen=True)
+
+
+def to_records(record_class, rows):
+    """Строки курсора (кортежи) в записи record_class"""
+    return [record_class(*row) for row in rows]
+
+
+UserRecord = record_type('UserRecord', ('id', 'telegram_id', 'created_at'))
+MarkRecord = record_type('MarkRecord', (
+    'id', 'user_id', 'title', 'description', 'visit_date', 'address', 'lat', 'lon', 'created_at'
+))
+MarkSearchRecord = record_type('MarkSearchRecord', (
+    'id', 'title', 'visit_date', 'address', 'lat', 'lon', 'score', 'snippet'
+))
+MarkStatsRecord = record_type('MarkStatsRecord', ('kind', 'bucket', 'mark_count', 'user_count', 'cells'))
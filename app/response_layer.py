@@ -0,0 +1,247 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+from collections import namedtuple
+from datetime import date
+from decimal import Decimal
+from flask import Response, request, url_for
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.http import http_date
+from records import Record
+from instrumentation import measure
+
+try:
+    import orjson # type: ignore
+except ImportError:
+    orjson = None
+
+try:
+    import brotli # type: ignore
+except ImportError:
+    brotli = None
+
+
+# Сжимаем только текстовые ответы: фото и так сжаты
+COMPRESSIBLE_MIMETYPES = {
+    'application/json',
+    'application/geo+json',
+    'application/gpx+xml',
+    'application/javascript',
+    'text/javascript',
+    'text/html',
+    'text/css',
+    'text/csv',
+    'image/svg+xml'
+}
+# Что отдается через /assets: в static лежит и admins.json, его там быть не должно
+ASSET_MIMETYPES = {'text/css', 'application/javascript', 'text/javascript', 'image/svg+xml'}
+# Меньше этого размера заголовки и CPU стоят дороже экономии
+COMPRESS_MIN_SIZE = 1024
+# Динамические ответы жмем быстро, статику и страницу - один раз и максимально
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+STATIC_GZIP_LEVEL = 9
+STATIC_BROTLI_QUALITY = 11
+# Файлы с хешем содержимого в URL не меняются - кешируем на год
+ASSET_CACHE_MAX_AGE = 60 * 60 * 24 * 365
+
+Precompressed = namedtuple('Precompressed', ['data', 'gzip', 'br', 'etag', 'mimetype'])
+
+
+def json_default(o):
+    """Decimal и даты в том же виде, что и у стандартного jsonify во Flask"""
+    if isinstance(o, Record):
+        # orjson сериализует dataclass-записи сам, сюда они попадают только без него
+        return o._asdict()
+    if isinstance(o, date):
+        return http_date(o)
+    if isinstance(o, Decimal):
+        return str(o)
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+def dumps(obj):
+    """Сериализация в JSON (bytes): orjson, если установлен, иначе json"""
+    with measure('serialize'):
+        return _dumps(obj)
+
+
+def _dumps(obj):
+    if orjson is not None:
+        # Даты пропускаем в json_default, чтобы формат не отличался от прежнего
+        return orjson.dumps(
+            obj,
+            default=json_default,
+            option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS
+        )
+    return json.dumps(
+        obj,
+        default=json_default,
+        ensure_ascii=False,
+        sort_keys=True,
+        separators=(',', ':')
+    ).encode('utf-8')
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    def dumps(self, obj, **kwargs):
+        if kwargs.get('indent') is not None:
+            # Отладочный вывод с отступами - обычным json
+            return super().dumps(obj, **kwargs)
+        return dumps(obj).decode('utf-8')
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps(obj), mimetype=self.mimetype)
+
+
+def negotiate_encoding(accept_encoding):
+    """Кодировка сжатия по заголовку Accept-Encoding: br, gzip или None"""
+    if not accept_encoding:
+        return None
+    accepted = {}
+    for part in accept_encoding.split(','):
+        name, _, params = part.strip().partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+
+    def allowed(encoding):
+        return accepted.get(encoding, accepted.get('*', 0)) > 0
+
+    if brotli is not None and allowed('br'):
+        return 'br'
+    if allowed('gzip'):
+        return 'gzip'
+    return None
+
+
+def etag_matches(if_none_match, etag):
+    """Слабое сравнение If-None-Match с ETag (для 304): W/"x" и "x" совпадают"""
+    if not if_none_match:
+        return False
+    tags = {tag.strip().removeprefix('W/') for tag in if_none_match.split(',')}
+    return '*' in tags or etag.removeprefix('W/') in tags
+
+
+def compress(data, encoding, static=False):
+    with measure('compress'):
+        return _compress(data, encoding, static)
+
+
+def _compress(data, encoding, static):
+    if encoding == 'br':
+        return brotli.compress(data, quality=STATIC_BROTLI_QUALITY if static else BROTLI_QUALITY)
+    if encoding == 'gzip':
+        return gzip.compress(data, compresslevel=STATIC_GZIP_LEVEL if static else GZIP_LEVEL, mtime=0)
+    return data
+
+
+def precompress(data, mimetype):
+    """Все варианты тела заранее: исходное, gzip и br (если есть brotli)"""
+    return Precompressed(
+        data=data,
+        gzip=compress(data, 'gzip', static=True),
+        br=compress(data, 'br', static=True) if brotli is not None else None,
+        etag=hashlib.sha256(data).hexdigest()[:16],
+        mimetype=mimetype
+    )
+
+
+def precompressed_response(body, max_age=None, immutable=False):
+    """Ответ из заранее сжатого тела с ETag и 304"""
+    encoding = negotiate_encoding(request.headers.get('Accept-Encoding'))
+    if encoding == 'br' and body.br is None:
+        encoding = 'gzip'
+    data = getattr(body, encoding) if encoding else body.data
+    # Разные кодировки - разные байты, поэтому и ETag у них разный
+    etag = f"{body.etag}-{encoding}" if encoding else body.etag
+
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(data, mimetype=body.mimetype)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+    response.set_etag(etag)
+    response.vary.add('Accept-Encoding')
+    if max_age:
+        response.cache_control.public = True
+        response.cache_control.max_age = max_age
+        response.cache_control.immutable = immutable
+    else:
+        response.cache_control.no_cache = True
+    return response
+
+
+def compress_response(response):
+    """after_request: сжатие крупных текстовых ответов по Accept-Encoding"""
+    if (response.status_code != 200
+            or response.direct_passthrough
+            or response.is_streamed
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate_encoding(request.headers.get('Accept-Encoding'))
+    if not encoding:
+        return response
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_SIZE:
+        return response
+
+    response.set_data(compress(data, encoding))
+    response.headers['Content-Encoding'] = encoding
+    # Сжатое тело побайтно другое: сильный ETag становится слабым
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+# Статика загружается в память при старте и сразу сжимается. URL содержит
+# хеш содержимого (/assets/<hash>/style.css), поэтому браузер держит файл год
+# и не переспрашивает сервер, а после выкладки новой версии меняется URL.
+class StaticAssets:
+    def __init__(self, folder, endpoint='static_asset'):
+        self.folder = folder
+        self.endpoint = endpoint
+        self.assets = {}
+        self.load()
+
+    def load(self):
+        assets = {}
+        for dirpath, _, filenames in os.walk(self.folder):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                name = os.path.relpath(path, self.folder).replace(os.sep, '/')
+                mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+                if mimetype not in ASSET_MIMETYPES:
+                    continue
+                with open(path, 'rb') as file:
+                    assets[name] = precompress(file.read(), mimetype)
+        self.assets = assets
+
+    def url(self, filename):
+        """URL файла с хешем содержимого; для неизвестных файлов - обычный /static"""
+        asset = self.assets.get(filename)
+        if asset is None:
+            return url_for('static', filename=filename)
+        return url_for(self.endpoint, digest=asset.etag, filename=filename)
+
+    def serve(self, digest, filename):
+        asset = self.assets.get(filename)
+        if asset is None:
+            return Response(status=404)
+        # Старый хеш из закешированной страницы - отдаем текущий файл, но не на год
+        if digest != asset.etag:
+            return precompressed_response(asset)
+        return precompressed_response(asset, max_age=ASSET_CACHE_MAX_AGE, immutable=True)
@@ -0,0 +1,159 @@
+import argparse
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+import time
+from dotenv import load_dotenv
+from database_manager import DatabaseManager
+
+
+load_dotenv()
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+# Перезапуск упавшего процесса: 1с, 2с, 4с ... не чаще раза в 30с
+RESTART_BASE_SECONDS = 1
+RESTART_MAX_SECONDS = 30
+# Процесс, проработавший столько, считается здоровым - задержка сбрасывается
+RESTART_RESET_SECONDS = 60
+# Сколько ждать завершения дочерних процессов после SIGTERM
+SHUTDOWN_TIMEOUT_SECONDS = 15
+
+
+class ChildProcess:
+    def __init__(self, name, script, env):
+        self.name = name
+        self.script = script
+        self.env = env
+        self.process = None
+        self.started_at = 0
+        self.restart_at = 0
+        self.failures = 0
+
+    def start(self):
+        env = dict(os.environ, **self.env)
+        self.process = subprocess.Popen([sys.executable, self.script], cwd=APP_DIR, env=env)
+        self.started_at = time.monotonic()
+        print(f"✅ {self.name} запущен (pid {self.process.pid})")
+
+    def check(self, now):
+        """Перезапуск упавшего процесса с нарастающей задержкой"""
+        if self.process is None:
+            if now >= self.restart_at:
+                self.start()
+            return
+
+        code = self.process.poll()
+        if code is None:
+            return
+
+        if now - self.started_at >= RESTART_RESET_SECONDS:
+            self.failures = 0
+        delay = min(RESTART_BASE_SECONDS * 2 ** self.failures, RESTART_MAX_SECONDS)
+        self.failures += 1
+        self.process = None
+        self.restart_at = now + delay
+        print(f"❌ {self.name} завершился с кодом {code}, перезапуск через {delay}с")
+
+    def terminate(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+
+    def wait(self, deadline):
+        if self.process is None:
+            return
+        try:
+            self.process.wait(timeout=max(0, deadline - time.monotonic()))
+        except subprocess.TimeoutExpired:
+            print(f"⚠️ {self.name} не завершился за {SHUTDOWN_TIMEOUT_SECONDS}с, kill")
+            self.process.kill()
+            self.process.wait()
+
+
+# Бот, веб и воркеры очереди - отдельные процессы со своим GIL и временем жизни.
+# Веб - uvicorn с web_workers процессами (asgi_app.py), фоновая работа (размеры
+# фото, сообщения в Telegram, сборщик файлов) - в job_worker.py через таблицу jobs.
+# С BOT_MODE=webhook бот живет в веб-воркерах (telegram_webhook.py).
+class Supervisor:
+    def __init__(self, web_workers, job_workers, run_bot=True):
+        self.children = []
+        self.stopping = False
+
+        # В режиме webhook обновления принимают веб-воркеры, отдельный процесс не нужен
+        bot_mode = os.getenv('BOT_MODE', 'polling') if run_bot else 'polling'
+        if run_bot and bot_mode != 'webhook':
+            self.children.append(ChildProcess('Бот', 'bot.py', {'WEB_MODE': 'separate'}))
+        if web_workers > 0:
+            self.children.append(ChildProcess('Веб', 'asgi_app.py', {
+                'WEB_WORKERS': str(web_workers),
+                'DB_BOOTSTRAP': '0',
+                'BOT_MODE': bot_mode,
+                'IMAGE_PROCESSING': 'queue',
+                'PHOTO_GC_ENABLED': '0'
+            }))
+
+        gc_enabled = os.getenv('PHOTO_GC_ENABLED', '1') == '1'
+        for index in range(job_workers):
+            self.children.append(ChildProcess(f'Воркер #{index}', 'job_worker.py', {
+                'WORKER_INDEX': str(index),
+                'PHOTO_GC_ENABLED': '1' if gc_enabled and index == 0 else '0'
+            }))
+
+    @staticmethod
+    def prepare_database():
+        """Схема создается один раз до запуска процессов, а не каждым из них"""
+        db_manager = DatabaseManager()
+        if not db_manager.init_pool(min_conn=1, max_conn=1):
+            return False
+        try:
+            db_manager.bootstrap()
+        finally:
+            db_manager.connection_pool.closeall()
+        return True
+
+    def stop(self, signum=None, frame=None):
+        self.stopping = True
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        for child in self.children:
+            child.start()
+
+        while not self.stopping:
+            now = time.monotonic()
+            for child in self.children:
+                child.check(now)
+            time.sleep(0.5)
+
+        print("Остановка процессов...")
+        for child in self.children:
+            child.terminate()
+        deadline = time.monotonic() + SHUTDOWN_TIMEOUT_SECONDS
+        for child in self.children:
+            child.wait(deadline)
+        print("✅ Все процессы остановлены")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Запуск бота, веба и воркеров очереди отдельными процессами')
+    parser.add_argument('--web-workers', type=int, default=int(os.getenv('WEB_WORKERS', str(os.cpu_count() or 1))))
+    parser.add_argument('--job-workers', type=int, default=int(os.getenv('JOB_WORKERS', '1')))
+    parser.add_argument('--no-bot', action='store_true', help='без процесса бота')
+    args = parser.parse_args()
+
+    if not Supervisor.prepare_database():
+        print("❌ База данных недоступна, процессы не запущены")
+        raise SystemExit(1)
+
+    if not args.no_bot and os.getenv('BOT_MODE', 'polling') == 'webhook':
+        import bot
+
+        asyncio.run(bot.register_webhook())
+
+    Supervisor(args.web_workers, args.job_workers, run_bot=not args.no_bot).run()
+
+
+if __name__ == '__main__':
+    main()
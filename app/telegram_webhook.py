@@ -0,0 +1,57 @@
+import asyncio
+import hmac
+from starlette.responses import JSONResponse, Response # type: ignore
+from telegram import Update
+
+
+# Прием обновлений Telegram в веб-процессе (asgi_app.py, BOT_MODE=webhook).
+# Запрос только кладет обновление в ограниченную update_queue и сразу отвечает
+# 200; обработку ведет Application бота в том же event loop, параллельно, но не
+# больше BOT_CONCURRENT_UPDATES обновлений сразу. Если очередь полна, ответ 503 -
+# Telegram повторит доставку позже, а память процесса не растет.
+class TelegramWebhook:
+    def __init__(self, application, secret_token=None):
+        self.application = application
+        self.secret_token = secret_token
+        self.accepted = 0
+        self.rejected = 0
+
+    async def start(self):
+        await self.application.initialize()
+        await self.application.start()
+        print("✅ Бот принимает обновления через вебхук")
+
+    async def stop(self):
+        await self.application.stop()
+        await self.application.shutdown()
+
+    async def handle(self, request):
+        """POST - обновление от Telegram"""
+        if self.secret_token:
+            received = request.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+            if not hmac.compare_digest(received.encode(), self.secret_token.encode()):
+                return Response(status_code=403)
+
+        try:
+            update = Update.de_json(await request.json(), self.application.bot)
+        except (ValueError, TypeError, KeyError, AttributeError):
+            update = None
+        if update is None:
+            return Response(status_code=400)
+
+        try:
+            self.application.update_queue.put_nowait(update)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            return Response(status_code=503, headers={'Retry-After': '1'})
+        self.accepted += 1
+        return Response(status_code=200)
+
+    async def stats(self, request):
+        """GET - состояние очереди обновлений"""
+        return JSONResponse({
+            'queued': self.application.update_queue.qsize(),
+            'queue_size': self.application.update_queue.maxsize,
+            'accepted': self.accepted,
+            'rejected': self.rejected
+        })
@@ -0,0 +1,83 @@
+import hashlib
+import os
+import tempfile
+from flask import Request
+from werkzeug.exceptions import RequestEntityTooLarge
+
+
+# Загруженный файл пишется на диск во временную папку по мере разбора multipart
+# и одновременно хешируется, поэтому в памяти лежит только текущий кусок.
+# После проверки файл переносится в хранилище фото под ключом <sha256><ext>:
+# одинаковые фото хранятся одним файлом.
+class HashingUploadFile:
+    def __init__(self, folder, storage, max_size=None):
+        self.folder = folder
+        self.storage = storage
+        self.max_size = max_size
+        fd, self.path = tempfile.mkstemp(dir=folder, prefix='.upload-')
+        self.file = os.fdopen(fd, 'w+b')
+        self.hash = hashlib.sha256()
+        self.size = 0
+        self.stored = False
+        self.filename = None
+
+    def write(self, data):
+        self.size += len(data)
+        if self.max_size and self.size > self.max_size:
+            raise RequestEntityTooLarge(f"Файл больше {self.max_size // (1024 * 1024)} МБ")
+        self.hash.update(data)
+        return self.file.write(data)
+
+    def __getattr__(self, name):
+        # seek/read/tell/flush для werkzeug и FileStorage
+        return getattr(self.file, name)
+
+    def store(self, ext):
+        """Перенос файла в хранилище под имя по содержимому, возвращает это имя"""
+        self.file.close()
+        self.filename = f"{self.hash.hexdigest()}{ext}"
+        if self.storage.exists(self.filename):
+            # Такое фото уже загружали - второй копии в хранилище не будет.
+            # Временный файл живет до конца запроса: пока ссылка на фото не
+            # закоммичена, сборщик может удалить общий файл (см. restore)
+            return self.filename
+        self.storage.put_file(self.filename, self.path)
+        self.stored = True
+        return self.filename
+
+    def restore(self):
+        """Повторная запись файла, если сборщик удалил его копию из хранилища"""
+        if not self.stored:
+            self.storage.put_file(self.filename, self.path)
+            self.stored = True
+
+    def discard(self):
+        """Удаление временного файла, если он не был сохранен"""
+        if self.stored:
+            return
+        self.file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.stored = True
+
+
+def make_upload_request_class(folder, storage, max_file_size, endpoints):
+    """Класс запроса Flask, который пишет файлы указанных эндпоинтов сразу на диск"""
+
+    class UploadRequest(Request):
+        def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+            if self.endpoint not in endpoints:
+                return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+
+            stream = HashingUploadFile(folder, storage, max_file_size)
+            if not hasattr(self, 'upload_files'):
+                self.upload_files = []
+            self.upload_files.append(stream)
+            return stream
+
+        def discard_uploads(self):
+            """Удаление временных файлов, которые не были сохранены обработчиком"""
+            for stream in getattr(self, 'upload_files', []):
+                stream.discard()
+
+    return UploadRequest
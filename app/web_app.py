@@ -1,18 +1,51 @@
-from flask import Flask, send_from_directory
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, send_file
+from flask import Flask, render_template, request, jsonify, url_for, Response, stream_with_context, g
 import threading
-from database_manager import DatabaseManager
+from cached_database_manager import CachedDatabaseManager
+from image_variants import ImageVariantProcessor, VARIANT_SIZES
+import geo
+import pagination
+import mark_transfer
+import mark_batch
+import mark_search
+import mark_stats
+from admin_registry import AdminRegistry
+from uploads import make_upload_request_class, HashingUploadFile
+from photo_storage import create_photo_storage, parse_range, iter_chunks
+from photo_gc import PhotoGarbageCollector
+from geocoding import GeocodingService, GeocodingError, RateLimitExceeded, create_geocoding_provider
+from response_layer import FastJSONProvider, StaticAssets, compress_response, precompress, precompressed_response
+import instrumentation
+from cache import TTLCache, MISSING
 import os
 from dotenv import load_dotenv
 from werkzeug.utils import secure_filename
 import base64
 import json
+import mimetypes
+import hashlib
 
 
 load_dotenv()
 YANDEX_MAPS_API_KEY = os.getenv("YANDEX_MAPS_API_KEY")
+# Папка локального хранилища фото и временных файлов загрузки
 UPLOAD_FOLDER = "upload"
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'heif', 'bmp'}
+# Путь от файла модуля, а не от текущей директории
+ADMINS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'admins.json')
+# Фото не меняются после загрузки, поэтому браузер может долго держать их в кеше
+PHOTO_CACHE_MAX_AGE = 60 * 60 * 24 * 30
+# Ограничения загрузки: размер одного файла и всего запроса
+UPLOAD_MAX_FILE_SIZE = int(os.getenv('UPLOAD_MAX_FILE_MB', '20')) * 1024 * 1024
+UPLOAD_MAX_REQUEST_SIZE = int(os.getenv('UPLOAD_MAX_REQUEST_MB', '80')) * 1024 * 1024
+UPLOAD_CHUNK_SIZE = 64 * 1024
+# Эндпоинты, файлы которых пишутся сразу на диск с хешированием
+PHOTO_UPLOAD_ENDPOINTS = {'create_mark', 'update_mark', 'batch_marks'}
+# Сколько держать в памяти отрендеренную и сжатую главную страницу
+PAGE_CACHE_TTL = int(os.getenv('PAGE_CACHE_TTL_SECONDS', '300'))
+# Запас вокруг видимой области (в пикселях) и ограничение числа меток в ответе
+VIEWPORT_PADDING_PX = 64
+VIEWPORT_MAX_MARKS = 2000
 
 
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
@@ -24,24 +57,89 @@ class WebApplication:
             template_folder='templates',
             static_folder='static'
         )
+        # За nginx отдачу файлов можно переложить на X-Sendfile
+        self.app.config['USE_X_SENDFILE'] = os.getenv('USE_X_SENDFILE', '0') == '1'
+        self.app.config['MAX_CONTENT_LENGTH'] = UPLOAD_MAX_REQUEST_SIZE
+        self.photo_storage = create_photo_storage(UPLOAD_FOLDER)
+        self.app.request_class = make_upload_request_class(
+            UPLOAD_FOLDER, self.photo_storage, UPLOAD_MAX_FILE_SIZE, PHOTO_UPLOAD_ENDPOINTS
+        )
+        self.app.teardown_request(self.discard_uploads)
+        # Server-Timing и метрики - до сжатия, чтобы учесть и его время
+        instrumentation.install_flask(self.app)
+        # Быстрый JSON, сжатие ответов и статика с хешем содержимого в URL
+        self.app.json = FastJSONProvider(self.app)
+        self.app.after_request(compress_response)
+        self.static_assets = StaticAssets(self.app.static_folder)
+        self.app.jinja_env.globals['asset_url'] = self.static_assets.url
+        self.page_cache = TTLCache(maxsize=16, ttl=PAGE_CACHE_TTL)
+        self.app.add_url_rule('/assets/<digest>/<path:filename>', 'static_asset', self.static_assets.serve, methods=['GET'])
         self.app.add_url_rule('/', 'index', self.index)
         self.app.add_url_rule('/api/get_marks/<int:user_telegram_id>', 'get_marks', self.get_marks, methods=['GET'])
+        self.app.add_url_rule('/api/marks/changes/<int:user_telegram_id>', 'get_mark_changes', self.get_mark_changes, methods=['GET'])
+        self.app.add_url_rule('/api/get_marks_in_view/<int:user_telegram_id>', 'get_marks_in_view', self.get_marks_in_view, methods=['GET'])
+        self.app.add_url_rule('/api/get_mark_clusters/<int:user_telegram_id>', 'get_mark_clusters', self.get_mark_clusters, methods=['GET'])
+        self.app.add_url_rule('/api/search_marks/<int:user_telegram_id>', 'search_marks', self.search_marks, methods=['GET'])
+        self.app.add_url_rule('/api/mark_stats/<int:user_telegram_id>', 'get_mark_stats', self.get_mark_stats, methods=['GET'])
+        self.app.add_url_rule('/api/admin_stats/<int:user_telegram_id>', 'get_admin_stats', self.get_admin_stats, methods=['GET'])
         self.app.add_url_rule('/api/create_mark', 'create_mark', self.create_mark, methods=['POST'])
         self.app.add_url_rule('/api/get_mark/<int:mark_id>', 'get_mark_details', self.get_mark_details, methods=['GET'])
         self.app.add_url_rule('/api/delete_mark/<int:user_telegram_id>/<int:mark_id>', 'delete_mark', self.delete_mark, methods=['DELETE'])
         self.app.add_url_rule('/api/update_mark/<int:user_telegram_id>/<int:mark_id>', 'update_mark', self.update_mark, methods=['POST'])
+        self.app.add_url_rule('/api/batch_marks/<int:user_telegram_id>', 'batch_marks', self.batch_marks, methods=['POST'])
+        self.app.add_url_rule('/api/import_marks/<int:user_telegram_id>', 'import_marks', self.import_marks, methods=['POST'])
+        self.app.add_url_rule('/api/export_marks/<int:user_telegram_id>', 'export_marks', self.export_marks, methods=['GET'])
+        self.app.add_url_rule('/api/geocode/search/<int:user_telegram_id>', 'geocode_search', self.geocode_search, methods=['GET'])
+        self.app.add_url_rule('/api/geocode/reverse/<int:user_telegram_id>', 'geocode_reverse', self.geocode_reverse, methods=['GET'])
+        self.app.add_url_rule('/api/geocode/suggest/<int:user_telegram_id>', 'geocode_suggest', self.geocode_suggest, methods=['GET'])
+        self.app.add_url_rule('/api/geocode_stats', 'geocode_stats', self.geocode_stats, methods=['GET'])
+        self.app.add_url_rule('/api/cache_stats', 'cache_stats', self.cache_stats, methods=['GET'])
+        self.app.add_url_rule('/api/pool_stats', 'pool_stats', self.pool_stats, methods=['GET'])
+        self.app.add_url_rule('/metrics', 'metrics', self.metrics, methods=['GET'])
+        self.app.add_url_rule('/upload/<path:filename>', 'get_photo', self.get_photo, methods=['GET'])
 
-        self.db_manager = DatabaseManager()
+        self.db_manager = CachedDatabaseManager()
         self.init_database()
+        self.admin_registry = AdminRegistry(ADMINS_FILE, self.db_manager)
+        self.image_processor = ImageVariantProcessor(
+            self.photo_storage,
+            self.db_manager,
+            max_workers=int(os.getenv('IMAGE_WORKERS', '2')),
+            # queue - обработка в процессах job_worker.py (supervisor.py)
+            use_queue=os.getenv('IMAGE_PROCESSING', 'thread') == 'queue'
+        )
+        self.photo_gc = PhotoGarbageCollector(
+            self.photo_storage,
+            self.db_manager,
+            interval=int(os.getenv('PHOTO_GC_INTERVAL_SECONDS', '30')),
+            batch_size=int(os.getenv('PHOTO_GC_BATCH_SIZE', '200')),
+            delete_delay=int(os.getenv('PHOTO_GC_DELAY_SECONDS', '60')),
+            orphan_grace=int(os.getenv('PHOTO_GC_ORPHAN_GRACE_SECONDS', str(24 * 60 * 60))),
+            reconcile_interval=int(os.getenv('PHOTO_GC_RECONCILE_SECONDS', str(6 * 60 * 60)))
+        )
+        if os.getenv('PHOTO_GC_ENABLED', '1') == '1':
+            self.photo_gc.start()
+        self.geocoding = GeocodingService(
+            create_geocoding_provider(),
+            self.db_manager,
+            rate=float(os.getenv('GEOCODE_RATE_PER_MINUTE', '60')) / 60,
+            burst=int(os.getenv('GEOCODE_BURST', '20'))
+        )
 
 
     def init_database(self):
-        """Инициализация базы данных"""
-        if self.db_manager.init_pool():
-            self.db_manager.create_tables()
-            self.db_manager.create_indexes()
-            return True
-        return False
+        """Инициализация базы данных
+
+        С DB_BOOTSTRAP=0 схему уже подготовил родительский процесс
+        (supervisor.py или asgi_app.py с несколькими воркерами).
+        """
+        if not self.db_manager.init_pool():
+            return False
+        if os.getenv('DB_BOOTSTRAP', '1') == '1':
+            self.db_manager.bootstrap()
+        else:
+            self.db_manager.check_extensions()
+        return True
     
 
     def index(self):
@@ -52,20 +150,30 @@ class WebApplication:
         if user_id:
             # Пользователь пришел с ID
             is_admin = self.check_if_admin(user_id)
-            return render_template('index.html',
+            return self.render_page('index.html',
                                 yandex_maps_key=YANDEX_MAPS_API_KEY,
                                 is_admin=is_admin,
-                                user_id=user_id,
                                 today=self.get_current_date(),
                                 is_register=True)
         else:
             # Пользователь без ID - рендерим базовый шаблон
-            return render_template('index.html',
+            return self.render_page('index.html',
                                 yandex_maps_key=YANDEX_MAPS_API_KEY,
                                 is_admin=False,
-                                user_id=None,
                                 today=self.get_current_date(),
                                 is_register=False)
+
+
+    def render_page(self, template, **context):
+        """Страница из кеша: рендер и сжатие один раз на набор параметров"""
+        # user_id в шаблоне не нужен, поэтому вариантов страницы всего несколько
+        key = (template,) + tuple(sorted(context.items()))
+        page = self.page_cache.get(key)
+        if page is MISSING:
+            html = render_template(template, **context)
+            page = precompress(html.encode('utf-8'), 'text/html')
+            self.page_cache.set(key, page)
+        return precompressed_response(page)
     
 
     def create_user(self, user_telegram_id):
@@ -74,7 +182,14 @@ class WebApplication:
     
 
     def get_marks(self, user_telegram_id):
-        """GET - получение списка меток"""
+        """GET - получение списка меток: ?fields=id,lat,lon,title&limit=200&cursor=..."""
+        try:
+            fields = pagination.parse_fields(request.args.get('fields'))
+            after = pagination.decode_cursor(request.args.get('cursor'))
+            limit = pagination.parse_limit(request.args.get('limit'), after)
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+
         # Находим пользователя
         user = self.db_manager.get_user_by_telegram_id(user_telegram_id)
         if not user:
@@ -82,20 +197,189 @@ class WebApplication:
             if not user:
                 return jsonify({'error': 'Ошибка при создании пользователя'}), 404
         
-        # Получаем метки пользователя
-        marks = self.db_manager.get_user_marks(user['id'])
-        
-        # Добавляем фото к каждой метке
-        # for mark in marks:
-        #     mark['photos'] = self.db_manager.get_mark_photos_filename(mark['id'])
-        
+        # Версию читаем до списка: изменения после нее придут в ленте изменений
+        version = self.db_manager.get_marks_version(user['id'])
+
+        def load():
+            marks, last = self.db_manager.get_user_marks_page(user['id'], fields, limit, after)
+            return {
+                'success': True,
+                'marks': marks,
+                'user_id': user['id'],
+                'version': version,
+                'next_cursor': pagination.encode_cursor(*last) if last else None
+            }
+
+        return self.conditional_marks_response(pagination.marks_etag(user['id'], version, request.path, request.query_string.decode('utf-8')), load)
+
+
+    def get_mark_changes(self, user_telegram_id):
+        """GET - изменения списка меток после версии: ?since=<version>&fields=..."""
+        try:
+            since = pagination.parse_since(request.args.get('since'))
+            fields = pagination.parse_fields(request.args.get('fields'))
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+
+        user = self.db_manager.get_user_by_telegram_id(user_telegram_id)
+        if not user:
+            return jsonify({'success': False, 'message': 'Пользователь не найден'}), 404
+
+        version = self.db_manager.get_marks_version(user['id'])
+
+        def load():
+            if since > version:
+                # Версия от другой базы или из будущего - только полная загрузка
+                return {'success': True, 'reset': True, 'version': version}
+            changes = self.db_manager.get_mark_changes(user['id'], since, fields, pagination.MAX_CHANGES)
+            if changes is None:
+                return {'success': True, 'reset': True, 'version': version}
+            changed, deleted = changes
+            return {
+                'success': True,
+                'reset': False,
+                'changed': changed,
+                'deleted': deleted,
+                'version': version
+            }
+
+        return self.conditional_marks_response(pagination.marks_etag(user['id'], version, request.path, request.query_string.decode('utf-8')), load)
+
+
+    def conditional_marks_response(self, etag, load):
+        """304 без запроса к БД, если у клиента уже есть эта версия, иначе JSON из load()"""
+        # Сжатый ответ уходит со слабым ETag (compress_response), сравнение - слабое
+        if request.if_none_match.contains_weak(etag):
+            response = Response(status=304)
+        else:
+            response = jsonify(load())
+        response.set_etag(etag)
+        # Браузер каждый раз переспрашивает сервер, но при совпадении получает 304 без тела
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response
+
+
+    def get_marks_in_view(self, user_telegram_id):
+        """GET - метки в видимой области карты: ?bbox=south,west,north,east&zoom=12"""
+        try:
+            zoom = geo.parse_zoom(request.args.get('zoom'))
+            bbox = geo.parse_bbox(request.args.get('bbox'))
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+
+        user = self.db_manager.get_user_by_telegram_id(user_telegram_id)
+        if not user:
+            return jsonify({'success': True, 'marks': [], 'truncated': False})
+
+        bbox = geo.pad_bbox(bbox, zoom, VIEWPORT_PADDING_PX)
+        # Берем на одну метку больше лимита, чтобы понять, что ответ обрезан
+        marks = self.db_manager.get_user_marks_in_bbox(
+            user['id'], geo.split_bbox(bbox), limit=VIEWPORT_MAX_MARKS + 1
+        )
+        truncated = len(marks) > VIEWPORT_MAX_MARKS
+
         return jsonify({
             'success': True,
-            'marks': marks,
+            'marks': marks[:VIEWPORT_MAX_MARKS],
+            'truncated': truncated,
             'user_id': user['id']
         })
     
 
+    def get_mark_clusters(self, user_telegram_id):
+        """GET - кластеры меток на масштабе: ?zoom=12&bbox=south,west,north,east"""
+        try:
+            zoom = geo.parse_zoom(request.args.get('zoom'))
+            bbox = request.args.get('bbox')
+            bbox = geo.parse_bbox(bbox) if bbox else (-90.0, -180.0, 90.0, 180.0)
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+        if zoom is None:
+            return jsonify({'success': False, 'message': 'zoom не указан'}), 400
+
+        user = self.db_manager.get_user_by_telegram_id(user_telegram_id)
+        if not user:
+            return jsonify({'success': True, 'clusters': [], 'zoom': zoom})
+
+        # Глубже CLUSTER_MAX_ZOOM сетка не хранится, ячейки там уже меньше одной метки
+        cluster_zoom = min(zoom, geo.CLUSTER_MAX_ZOOM)
+        bbox = geo.pad_bbox(bbox, zoom, VIEWPORT_PADDING_PX)
+        clusters = self.db_manager.get_mark_clusters(
+            user['id'], cluster_zoom, geo.cluster_cell_ranges(bbox, cluster_zoom)
+        )
+
+        return jsonify({
+            'success': True,
+            'clusters': clusters,
+            'zoom': cluster_zoom,
+            'user_id': user['id']
+        })
+    
+
+    def search_marks(self, user_telegram_id):
+        """GET - поиск по своим меткам: ?q=...&limit=20&cursor=...&bbox=s,w,n,e&date_from=&date_to="""
+        try:
+            text, prefix_query = mark_search.parse_query(request.args.get('q'))
+            limit = mark_search.parse_limit(request.args.get('limit'))
+            after = pagination.decode_search_cursor(request.args.get('cursor'))
+            bbox = self.parse_optional_bbox()
+            date_from = mark_search.parse_date(request.args.get('date_from'), 'date_from')
+            date_to = mark_search.parse_date(request.args.get('date_to'), 'date_to')
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+
+        user = self.db_manager.get_user_by_telegram_id(user_telegram_id)
+        if not user:
+            return jsonify({'success': True, 'results': [], 'next_cursor': None})
+
+        # Берем на один результат больше, чтобы знать, есть ли следующая страница
+        results = self.db_manager.search_marks(
+            user['id'], text, prefix_query,
+            boxes=geo.split_bbox(bbox) if bbox else None,
+            date_from=date_from,
+            date_to=date_to,
+            limit=limit + 1,
+            after=after
+        )
+        next_cursor = None
+        if len(results) > limit:
+            results = results[:limit]
+            next_cursor = pagination.encode_search_cursor(results[-1].score, results[-1].id)
+
+        return jsonify({
+            'success': True,
+            'results': results,
+            'next_cursor': next_cursor
+        })
+
+
+    def get_mark_stats(self, user_telegram_id):
+        """GET - статистика своих меток по месяцам и регионам: ?top=50 самых заполненных ячеек"""
+        try:
+            top = mark_stats.parse_top(request.args.get('top'))
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+
+        user = self.db_manager.get_user_by_telegram_id(user_telegram_id)
+        rows = self.db_manager.get_mark_stats(user['id'], top) if user else []
+        return jsonify({'success': True, 'stats': mark_stats.build_report(rows)})
+
+
+    def get_admin_stats(self, user_telegram_id):
+        """GET - общая статистика для админов: метки по месяцам, регионы, активные пользователи"""
+        if not self.check_if_admin(user_telegram_id):
+            return jsonify({'success': False, 'message': 'Недостаточно прав'}), 403
+
+        try:
+            top = mark_stats.parse_top(request.args.get('top'))
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+
+        rows = self.db_manager.get_global_mark_stats(top)
+        return jsonify({'success': True, 'stats': mark_stats.build_report(rows)})
+
+
     def allowed_file(self, filename):
         return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
@@ -126,45 +410,37 @@ class WebApplication:
 
         user_id = user.get('id')
 
-        mark = self.db_manager.create_mark(user_id, title, coords, visit_date, description, address)
-        if not mark:
-            return jsonify({'success': False, 'message': 'Ты хуйню добавил'})
-        mark_id = mark.get('id')
-
-        if 'main_photo' in request.files:
-            file = request.files['main_photo']
-            # Проверяем тип файла
-            if file and self.allowed_file(file.filename):
-                # Безопасное имя файла
-                filename = secure_filename(file.filename)
-                # Добавляем timestamp к имени файла для уникальности
-                import time
-                timestamp = str(int(time.time()))
-                name, ext = os.path.splitext(filename)
-                filename = f"{name}_{timestamp}{ext}"
-
-                # Сохраняем файл
-                file_path = os.path.join(UPLOAD_FOLDER, filename)
-                file.save(file_path)
-                photo = self.db_manager.add_photo(mark_id=mark_id, filename=filename, is_main=True)
-
-        if 'secondary_photos' in request.files:
-            photos = request.files.getlist('secondary_photos')
-            for index, file in enumerate(photos):
-                # Проверяем тип файла
-                if file and self.allowed_file(file.filename):
-                    # Безопасное имя файла
-                    filename = secure_filename(file.filename)
-                    # Добавляем timestamp к имени файла для уникальности
-                    import time
-                    timestamp = str(int(time.time()))
-                    name, ext = os.path.splitext(filename)
-                    filename = f"{name}_{timestamp}_{index}{ext}"
-
-                    # Сохраняем файл
-                    file_path = os.path.join(UPLOAD_FOLDER, filename)
-                    file.save(file_path)
-                    photo = self.db_manager.add_photo(mark_id=mark_id, filename=filename, is_main=False)
+        # Файлы пишем до транзакции, чтобы не держать соединение на время записи
+        main_filename = self.save_photo(request.files.get('main_photo'))
+        secondary_filenames = self.save_secondary_photos(request.files.getlist('secondary_photos'))
+        saved_filenames = ([main_filename] if main_filename else []) + secondary_filenames
+
+        new_photos = []
+        try:
+            # Метка, кластеры и фото - одна транзакция на одном соединении
+            with self.db_manager.transaction() as cursor:
+                mark = self.db_manager.create_mark(user_id, title, coords, visit_date, description, address, cursor=cursor)
+                if not mark:
+                    self.queue_photo_deletes(saved_filenames, cursor=cursor)
+                    return jsonify({'success': False, 'message': 'Ты хуйню добавил'})
+                mark_id = mark.get('id')
+                self.db_manager.add_mark_to_clusters(user_id, mark_id, lat, lon, cursor=cursor)
+                self.db_manager.update_mark_stats(user_id, added=[(mark['visit_date'], lat, lon)], changes=1, cursor=cursor)
+
+                self.protect_photo_files(saved_filenames, cursor)
+                if main_filename:
+                    photo = self.db_manager.add_photo(mark_id=mark_id, filename=main_filename, is_main=True, cursor=cursor)
+                    new_photos.append(photo)
+                for filename in secondary_filenames:
+                    photo = self.db_manager.add_photo(mark_id=mark_id, filename=filename, is_main=False, cursor=cursor)
+                    new_photos.append(photo)
+        except Exception as e:
+            print(e)
+            self.queue_photo_deletes(saved_filenames)
+            return jsonify({'success': False, 'message': str(e)}), 500
+
+        for photo in new_photos:
+            self.image_processor.submit(photo['id'], photo['filename'])
                 
         return jsonify({
             'success': True, 
@@ -183,15 +459,13 @@ class WebApplication:
     def get_mark_details(self, mark_id):
         """Получение полной информации о метке"""
         try:
-            # Получаем метку из БД
-            mark = self.db_manager.get_mark_by_id(mark_id)
+            # Метка и все ее фото - один запрос к БД
+            mark = self.db_manager.get_mark_with_photos(mark_id)
             if not mark:
                 return jsonify({'success': False, 'message': 'Место не найдено'}), 404
-            
 
-            main_photo = self.db_manager.get_main_photo_filename(mark_id)
-            # Получаем фото метки
-            photos = self.db_manager.get_mark_photos_filename(mark_id)
+            main_photo = mark.get('main_photo')
+            photos = mark.get('photos')
             
             # Форматируем ответ
 
@@ -202,52 +476,210 @@ class WebApplication:
                 'address': mark.get('address')
             }
             
-            if main_photo:
-                file_path = os.path.join(UPLOAD_FOLDER, main_photo[0])
-                if os.path.isfile(file_path):
-                    with open(file_path, 'rb') as f:
-                        image_data = f.read()
+            # ?photos=url - отдаем ссылки на /upload/..., клиент грузит фото сам и кеширует
+            as_url = request.args.get('photos') == 'url'
+            # ?width=<px> или ?size=thumb|preview|full - размер фото под экран клиента
+            width = request.args.get('width', type=int)
+            size = request.args.get('size')
+            if size not in VARIANT_SIZES:
+                size = None
 
-                        base64_image = base64.b64encode(image_data).decode('utf-8')
-                        mark_data["main_photo"] = f"data:image/jpeg;base64,{base64_image}"
+            if main_photo:
+                filename = self.pick_photo_filename(main_photo.get('filename'), main_photo.get('variants'), width, size)
+                photo_data = self.get_photo_data(filename, as_url)
+                if photo_data:
+                    mark_data["main_photo"] = photo_data
 
             if photos:
                 mark_data["photos"] = []
                 for photo in photos:
-                    file_path = os.path.join(UPLOAD_FOLDER, photo.get('filename'))
-                    if os.path.isfile(file_path):
-                        with open(file_path, 'rb') as f:
-                            image_data = f.read()
-                            base64_image = base64.b64encode(image_data).decode('utf-8')
-                            mark_data["photos"].append(f"data:image/jpeg;base64,{base64_image}")
+                    filename = self.pick_photo_filename(photo.get('filename'), photo.get('variants'), width, size)
+                    photo_data = self.get_photo_data(filename, as_url)
+                    if photo_data:
+                        mark_data["photos"].append(photo_data)
             return jsonify({'success': True, 'mark': mark_data})
             
         except Exception as e:
             return jsonify({'success': False, 'message': str(e)}), 500
         
     
+    def pick_photo_filename(self, filename, variants, width=None, size=None):
+        """Имя файла подходящего размера, оригинал - если варианты еще не готовы"""
+        variant_filename = self.image_processor.choose_variant(variants, width, size)
+        if variant_filename and self.photo_storage.exists(variant_filename):
+            return variant_filename
+        return filename
+
+
+    def get_photo_data(self, filename, as_url=False):
+        """Ссылка на фото или data URI с base64, если файл существует"""
+        if not filename or not self.photo_storage.exists(filename):
+            return None
+
+        if as_url:
+            return url_for('get_photo', filename=filename)
+
+        with instrumentation.measure('io'):
+            image_data = b''.join(iter_chunks(self.photo_storage.open(filename)))
+        instrumentation.add_io_bytes(len(image_data))
+        with instrumentation.measure('serialize'):
+            base64_image = base64.b64encode(image_data).decode('utf-8')
+        mime_type = mimetypes.guess_type(filename)[0] or 'image/jpeg'
+        return f"data:{mime_type};base64,{base64_image}"
+
+
+    def get_photo(self, filename):
+        """GET - отдача фото из хранилища (ETag, Last-Modified, Range, Cache-Control)"""
+        try:
+            file_path = self.photo_storage.local_path(filename)
+            if file_path:
+                # Локальный диск - sendfile/X-Sendfile силами werkzeug
+                return send_file(
+                    file_path,
+                    conditional=True,
+                    etag=True,
+                    max_age=PHOTO_CACHE_MAX_AGE
+                )
+            stat = self.photo_storage.stat(filename)
+        except ValueError:
+            stat = None
+        if stat is None:
+            return Response(status=404)
+
+        response = Response(mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+        response.set_etag(stat.etag)
+        response.last_modified = stat.mtime
+        response.cache_control.public = True
+        response.cache_control.max_age = PHOTO_CACHE_MAX_AGE
+        response.accept_ranges = 'bytes'
+        if request.if_none_match.contains(stat.etag):
+            response.status_code = 304
+            return response
+
+        byte_range = parse_range(request.headers.get('Range'), stat.size)
+        if byte_range:
+            start, end = byte_range
+            response.status_code = 206
+            response.content_range = f"bytes {start}-{end}/{stat.size}"
+        else:
+            start, end = 0, stat.size - 1
+        response.content_length = end - start + 1
+        if request.method != 'HEAD':
+            # Из удаленного хранилища читаем кусками, файл целиком в память не попадает
+            response.response = iter_chunks(self.photo_storage.open(filename, start, end), end - start + 1)
+        return response
+
+
+    def save_photo(self, file):
+        """Сохранение загруженного фото под именем по содержимому, возвращает имя файла или None"""
+        # Проверяем тип файла
+        if not file or not self.allowed_file(file.filename):
+            return None
+
+        ext = os.path.splitext(secure_filename(file.filename))[1].lower()
+        if isinstance(file.stream, HashingUploadFile):
+            # Файл уже на диске и захеширован при разборе запроса
+            with instrumentation.measure('io'):
+                filename = file.stream.store(ext)
+            self.remember_photo_restore(filename, file.stream.restore)
+            return filename
+
+        hasher = hashlib.sha256()
+        for chunk in iter(lambda: file.stream.read(UPLOAD_CHUNK_SIZE), b''):
+            hasher.update(chunk)
+        file.stream.seek(0)
+        filename = f"{hasher.hexdigest()}{ext}"
+        if not self.photo_storage.exists(filename):
+            self.photo_storage.put(filename, file.stream)
+
+        def restore():
+            file.stream.seek(0)
+            self.photo_storage.put(filename, file.stream)
+
+        self.remember_photo_restore(filename, restore)
+        return filename
+
+    def remember_photo_restore(self, filename, restore):
+        """Запоминание, как заново записать файл фото до конца запроса"""
+        if 'photo_restores' not in g:
+            g.photo_restores = {}
+        g.photo_restores[filename] = restore
+
+    def protect_photo_files(self, filenames, cursor):
+        """Защита файлов новых фото от сборщика до commit транзакции
+
+        Блокировка имен не дает сборщику удалить файл, пока ссылка на него не
+        закоммичена. Файл, который уже лежал в хранилище, запрос не записывал;
+        если сборщик успел удалить его раньше блокировки, он пишется снова.
+        """
+        filenames = set(filenames)
+        if not filenames:
+            return
+        self.db_manager.lock_photo_files(filenames, cursor)
+        restores = g.get('photo_restores', {})
+        for filename in filenames:
+            if filename in restores and not self.photo_storage.exists(filename):
+                with instrumentation.measure('io'):
+                    restores[filename]()
+
+
+    def save_secondary_photos(self, files):
+        """Сохранение дополнительных фото, возвращает имена сохраненных файлов"""
+        filenames = []
+        for file in files:
+            filename = self.save_photo(file)
+            if filename:
+                filenames.append(filename)
+        return filenames
+
+
+    def discard_uploads(self, exc=None):
+        """Удаление временных файлов загрузки, не ставших фото"""
+        request.discard_uploads()
+
+
+    def queue_photo_deletes(self, filenames, cursor=None):
+        """Постановка сохраненных файлов в очередь удаления (метка не создана или не изменена)"""
+        if not filenames:
+            return
+        try:
+            self.db_manager.enqueue_photo_deletes(filenames, cursor=cursor)
+        except Exception as e:
+            # Файл останется сиротой и будет найден сверкой хранилища
+            print(f"❌ Не удалось поставить фото в очередь удаления: {e}")
+
+
+    def find_user_mark(self, user_telegram_id, mark_id, cursor=None):
+        """Метка и ее владелец; третьим значением - готовый ответ с ошибкой"""
+        mark = self.db_manager.get_mark_by_id(mark_id, cursor=cursor)
+        if not mark:
+            return None, None, (jsonify({'success': False, 'message': 'Место не найдено'}), 404)
+
+        user = self.db_manager.get_user_by_telegram_id(user_telegram_id, cursor=cursor)
+        if not user:
+            return None, None, (jsonify({'error': 'Пользователь не найден'}), 404)
+
+        if mark.get('user_id') != user.get('id'):
+            return None, None, (jsonify({'success': False, 'message': 'Место не найдено'}), 404)
+
+        return user, mark, None
+
+
     def delete_mark(self, user_telegram_id, mark_id):
         """Удаление метки"""
         try:
-            mark = self.db_manager.get_mark_by_id(mark_id)
-            if not mark:
-                return jsonify({'success': False, 'message': 'Место не найдено'}), 404
-        
-            user = self.db_manager.get_user_by_telegram_id(user_telegram_id)
-            if not user:
-                return jsonify({'error': 'Пользователь не найден'}), 404
-            
-            deleting_main_photo = self.db_manager.get_main_photo_filename(mark_id)
-            if deleting_main_photo:
-                os.remove(os.path.join(UPLOAD_FOLDER, deleting_main_photo[0]))
-                self.db_manager.delete_main_photo_by_mark_id(mark_id)
+            # Все изменения в БД - одна транзакция, файлы удалит сборщик после commit
+            with self.db_manager.transaction() as cursor:
+                user, mark, error = self.find_user_mark(user_telegram_id, mark_id, cursor)
+                if error:
+                    return error
 
-            deleting_secondary_photos = self.db_manager.get_mark_photos_filename(mark_id)
-            for photo in deleting_secondary_photos:
-                os.remove(os.path.join(UPLOAD_FOLDER, photo.get("filename")))
-            self.db_manager.delete_photos_by_mark_id(mark_id)
-
-            self.db_manager.delete_mark(mark_id, user['id'])
+                self.db_manager.delete_mark_photos(mark_id, cursor=cursor)
+                if self.db_manager.delete_mark(mark_id, user['id'], cursor=cursor):
+                    self.db_manager.remove_mark_from_clusters(user['id'], mark_id, mark['lat'], mark['lon'], cursor=cursor)
+                    self.db_manager.update_mark_stats(
+                        user['id'], removed=[(mark['visit_date'], mark['lat'], mark['lon'])], changes=1, cursor=cursor
+                    )
 
             return jsonify({'success': True})
         
@@ -258,85 +690,356 @@ class WebApplication:
     
     def update_mark(self, user_telegram_id, mark_id):
         """Редактирование метки"""
+        title = request.form.get('title', '')
+        
+        mark_kwargs = request.form.to_dict()
+
+        if not all([title]):
+            return jsonify({
+                'success': False, 
+                'message': 'Не заполнены обязательные поля'
+            }), 400
+
+        # Файлы пишем до транзакции, чтобы не держать соединение на время записи
+        main_filename = self.save_photo(request.files.get('main_photo'))
+        replace_secondary = 'secondary_photos' in request.files
+        secondary_filenames = self.save_secondary_photos(request.files.getlist('secondary_photos'))
+        saved_filenames = ([main_filename] if main_filename else []) + secondary_filenames
+
+        new_photos = []
         try:
-            mark = self.db_manager.get_mark_by_id(mark_id)
-            if not mark:
-                return jsonify({'success': False, 'message': 'Место не найдено'}), 404
-            
-            user = self.db_manager.get_user_by_telegram_id(user_telegram_id)
-            if not user:
-                return jsonify({'error': 'Пользователь не найден'}), 404
-            user_id = user.get('id')
-            
-            title = request.form.get('title', '')
-            
-            mark_kwargs = request.form.to_dict()
+            # Метка, кластеры и фото - одна транзакция на одном соединении
+            with self.db_manager.transaction() as cursor:
+                user, mark, error = self.find_user_mark(user_telegram_id, mark_id, cursor)
+                if error:
+                    self.queue_photo_deletes(saved_filenames, cursor=cursor)
+                    return error
+                user_id = user.get('id')
 
-            if not all([title]):
-                return jsonify({
-                    'success': False, 
-                    'message': 'Не заполнены обязательные поля'
-                }), 400
-            
-            self.db_manager.update_mark(mark_id, user_id, **mark_kwargs)
-
-            if 'main_photo' in request.files:
-                file = request.files['main_photo']
-                if file and self.allowed_file(file.filename):
-                    filename = secure_filename(file.filename)
-                    import time
-                    timestamp = str(int(time.time()))
-                    name, ext = os.path.splitext(filename)
-                    filename = f"{name}_{timestamp}{ext}"
-
-                    # Сохраняем файл
-                    file_path = os.path.join(UPLOAD_FOLDER, filename)
-                    file.save(file_path)
-
-                    deleting_filename = self.db_manager.get_main_photo_filename(mark_id)
-                    if deleting_filename:
-                        os.remove(os.path.join(UPLOAD_FOLDER, deleting_filename[0]))
-                    self.db_manager.delete_main_photo_by_mark_id(mark_id)
-                    photo = self.db_manager.add_photo(mark_id=mark_id, filename=filename, is_main=True)
-
-            if 'secondary_photos' in request.files:
-                photos = request.files.getlist('secondary_photos')
-                adding_filenames = []
-                for index, file in enumerate(photos):
-                    # Проверяем тип файла
-                    if file and self.allowed_file(file.filename):
-                        # Безопасное имя файла
-                        filename = secure_filename(file.filename)
-                        # Добавляем timestamp к имени файла для уникальности
-                        import time
-                        timestamp = str(int(time.time()))
-                        name, ext = os.path.splitext(filename)
-                        filename = f"{name}_{timestamp}_{index}{ext}"
-
-                        # Сохраняем файл
-                        file_path = os.path.join(UPLOAD_FOLDER, filename)
-                        file.save(file_path)
-                        adding_filenames.append(filename)
-
-
-                deleting_filenames = self.db_manager.get_mark_photos_filename(mark_id)
-                self.db_manager.delete_photos_by_mark_id(mark_id)
-                for deleting_filename in deleting_filenames:
-                    os.remove(os.path.join(UPLOAD_FOLDER, deleting_filename.get('filename')))
-                for filename in adding_filenames:
-                    photo = self.db_manager.add_photo(mark_id=mark_id, filename=filename, is_main=False)
-            return jsonify({'success': True, 'mark_id': mark_id})
+                updated = self.db_manager.update_mark(mark_id, user_id, cursor=cursor, **mark_kwargs)
+                # При переносе метки перекладываем ее в другие ячейки кластеров
+                if updated and ('lat' in mark_kwargs or 'lon' in mark_kwargs):
+                    self.db_manager.remove_mark_from_clusters(user_id, mark_id, mark['lat'], mark['lon'], cursor=cursor)
+                    self.db_manager.add_mark_to_clusters(
+                        user_id,
+                        mark_id,
+                        mark_kwargs.get('lat', mark['lat']),
+                        mark_kwargs.get('lon', mark['lon']),
+                        cursor=cursor
+                    )
+                if updated:
+                    # Месяц и ячейки статистики - по сохраненной метке: дату разбирает БД
+                    saved_mark = mark
+                    if {'visit_date', 'lat', 'lon'} & set(mark_kwargs):
+                        saved_mark = self.db_manager.get_mark_by_id(mark_id, cursor=cursor)
+                    self.db_manager.update_mark_stats(
+                        user_id,
+                        added=[(saved_mark['visit_date'], saved_mark['lat'], saved_mark['lon'])],
+                        removed=[(mark['visit_date'], mark['lat'], mark['lon'])],
+                        changes=1,
+                        cursor=cursor
+                    )
+
+                self.protect_photo_files(saved_filenames, cursor)
+                if main_filename:
+                    self.db_manager.delete_mark_photos(mark_id, is_main=True, cursor=cursor)
+                    photo = self.db_manager.add_photo(mark_id=mark_id, filename=main_filename, is_main=True, cursor=cursor)
+                    new_photos.append(photo)
+
+                if replace_secondary:
+                    self.db_manager.delete_mark_photos(mark_id, is_main=False, cursor=cursor)
+                    for filename in secondary_filenames:
+                        photo = self.db_manager.add_photo(mark_id=mark_id, filename=filename, is_main=False, cursor=cursor)
+                        new_photos.append(photo)
         except Exception as e:
             print(e)
+            self.queue_photo_deletes(saved_filenames)
             return jsonify({'success': False, 'message': str(e)}), 500
+
+        for photo in new_photos:
+            self.image_processor.submit(photo['id'], photo['filename'])
+        return jsonify({'success': True, 'mark_id': mark_id})
         
 
+    def batch_marks(self, user_telegram_id):
+        """POST - пакет создания, изменения и удаления меток одной транзакцией
+
+        JSON {"operations": [...]} или multipart с JSON в поле operations и
+        файлами фото в полях, имена которых указаны в операциях (см. mark_batch).
+        """
+        if request.is_json:
+            payload = request.get_json(silent=True)
+            operations = payload.get('operations') if isinstance(payload, dict) else None
+        else:
+            try:
+                operations = json.loads(request.form.get('operations') or 'null')
+            except ValueError:
+                return jsonify({'success': False, 'message': 'Некорректный JSON в поле operations'}), 400
+
+        try:
+            operations = mark_batch.parse_operations(operations, self.get_current_date())
+        except mark_batch.MarkBatchError as e:
+            return jsonify({'success': False, 'message': str(e), 'errors': e.errors}), 400
+
+        photo_fields = {
+            name
+            for operation in operations if operation['op'] != 'delete'
+            for name in [operation['main_photo']] + (operation['secondary_photos'] or []) if name
+        }
+        missing = sorted(photo_fields - set(request.files))
+        if missing:
+            return jsonify({'success': False, 'message': f"Нет файлов: {', '.join(missing)}"}), 400
+
+        user = self.db_manager.get_user_by_telegram_id(user_telegram_id)
+        if not user:
+            return jsonify({'success': False, 'message': 'Пользователь не найден'}), 404
+        user_id = user['id']
+
+        # Файлы пишем до транзакции, чтобы не держать соединение на время записи
+        saved = {name: self.save_photo(request.files.get(name)) for name in photo_fields}
+        saved_filenames = {filename for filename in saved.values() if filename}
+
+        creates = [operation for operation in operations if operation['op'] == 'create']
+        updates = [operation for operation in operations if operation['op'] == 'update']
+        deletes = [operation for operation in operations if operation['op'] == 'delete']
+        statuses = {}
+        new_photos = []
+        try:
+            # Все операции - одна транзакция: метки, кластеры, фото и лента изменений
+            with self.db_manager.transaction() as cursor:
+                existing = {
+                    mark.id: mark for mark in self.db_manager.lock_user_marks(
+                        user_id, [operation['id'] for operation in updates + deletes], cursor
+                    )
+                }
+
+                delete_ids = [operation['id'] for operation in deletes if operation['id'] in existing]
+                self.db_manager.delete_marks_photos(delete_ids, cursor=cursor)
+                deleted = self.db_manager.delete_marks(user_id, delete_ids, cursor)
+                self.db_manager.remove_marks_from_clusters(user_id, deleted, cursor)
+                statuses.update((row[0], 'deleted') for row in deleted)
+
+                updates = [operation for operation in updates if operation['id'] in existing]
+                updated = self.db_manager.update_marks(
+                    user_id, [(operation['id'], operation['fields']) for operation in updates if operation['fields']], cursor
+                )
+                # Перенесенные метки перекладываем в другие ячейки кластеров
+                moved = [row for row in updated if (row[1], row[2]) != (row[3], row[4])]
+                self.db_manager.remove_marks_from_clusters(user_id, [row[:3] for row in moved], cursor)
+                self.db_manager.add_marks_to_clusters(user_id, [(row[0], row[3], row[4]) for row in moved], cursor)
+                statuses.update((operation['id'], 'updated') for operation in updates)
+
+                created_ids = self.db_manager.create_marks(user_id, [operation['mark'] for operation in creates], cursor)
+                self.db_manager.add_marks_to_clusters(
+                    user_id,
+                    [(mark_id, operation['mark'][4], operation['mark'][5]) for mark_id, operation in zip(created_ids, creates)],
+                    cursor
+                )
+                for mark_id, operation in zip(created_ids, creates):
+                    operation['id'] = mark_id
+                    statuses[mark_id] = 'created'
+
+                # Статистика: удаленные, перенесенные или передатированные и новые метки
+                removed = [(existing[row[0]].visit_date, row[1], row[2]) for row in deleted]
+                added = [(operation['mark'][2], operation['mark'][4], operation['mark'][5]) for operation in creates]
+                fields = {operation['id']: operation['fields'] for operation in updates}
+                for row in updated:
+                    old_mark = existing[row[0]]
+                    removed.append((old_mark.visit_date, row[1], row[2]))
+                    added.append((fields[row[0]].get('visit_date', old_mark.visit_date), row[3], row[4]))
+                self.db_manager.update_mark_stats(
+                    user_id, added, removed, changes=len(deleted) + len(updates) + len(creates), cursor=cursor
+                )
+
+                # Фото всех меток: одно удаление заменяемых и одна вставка новых
+                self.db_manager.delete_marks_photos(
+                    [operation['id'] for operation in updates if saved.get(operation['main_photo'])],
+                    is_main=True, cursor=cursor
+                )
+                self.db_manager.delete_marks_photos(
+                    [operation['id'] for operation in updates if operation['secondary_photos'] is not None],
+                    is_main=False, cursor=cursor
+                )
+                photos = []
+                for operation in creates + updates:
+                    if saved.get(operation['main_photo']):
+                        photos.append((operation['id'], saved[operation['main_photo']], True))
+                    for name in operation['secondary_photos'] or []:
+                        if saved.get(name):
+                            photos.append((operation['id'], saved[name], False))
+                self.protect_photo_files({photo[1] for photo in photos}, cursor)
+                new_photos = self.db_manager.add_photos(photos, cursor)
+                # Файлы операций над чужими или удаленными метками не понадобились
+                self.queue_photo_deletes(saved_filenames - {photo[1] for photo in photos}, cursor=cursor)
+        except Exception as e:
+            print(e)
+            self.queue_photo_deletes(saved_filenames)
+            return jsonify({'success': False, 'message': str(e)}), 500
+
+        if new_photos:
+            self.image_processor.submit_many(new_photos)
+
+        results = []
+        for operation in operations:
+            result = {
+                'index': operation['index'],
+                'op': operation['op'],
+                'id': operation.get('id'),
+                'status': statuses.get(operation.get('id'), 'not_found')
+            }
+            if operation['ref'] is not None:
+                result['ref'] = operation['ref']
+            results.append(result)
+        return jsonify({'success': True, 'results': results})
+
+
+    def import_marks(self, user_telegram_id):
+        """POST - массовый импорт меток из CSV, GeoJSON или GPX (поле file, ?format=)"""
+        file = request.files.get('file')
+        if not file:
+            return jsonify({'success': False, 'message': 'Файл не передан'}), 400
+
+        try:
+            fmt = mark_transfer.detect_format(file.filename, request.form.get('format') or request.args.get('format'))
+        except mark_transfer.MarkImportError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+
+        user = self.db_manager.get_user_by_telegram_id(user_telegram_id)
+        if not user:
+            return jsonify({'success': False, 'message': 'Пользователь не найден'}), 404
+
+        report = {'skipped': 0, 'errors': []}
+        try:
+            marks = mark_transfer.iter_valid_marks(file.stream, fmt, report)
+            imported = self.db_manager.copy_marks(user['id'], marks)
+        except mark_transfer.MarkImportError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+        except Exception as e:
+            print(e)
+            return jsonify({'success': False, 'message': str(e)}), 500
+
+        return jsonify({
+            'success': True,
+            'imported': imported,
+            'skipped': report['skipped'],
+            'errors': report['errors']
+        })
+
+
+    def export_marks(self, user_telegram_id):
+        """GET - потоковая выгрузка меток: ?format=csv|geojson|gpx"""
+        fmt = request.args.get('format', 'csv').lower()
+        if fmt not in mark_transfer.EXPORT_FORMATS:
+            return jsonify({'success': False, 'message': f'Неподдерживаемый формат: {fmt}'}), 400
+
+        user = self.db_manager.get_user_by_telegram_id(user_telegram_id)
+        if not user:
+            return jsonify({'success': False, 'message': 'Пользователь не найден'}), 404
+
+        chunks = self.db_manager.copy_out(
+            mark_transfer.EXPORT_QUERIES[fmt],
+            (user['id'],),
+            options=mark_transfer.EXPORT_COPY_OPTIONS[fmt]
+        )
+        return Response(
+            stream_with_context(mark_transfer.wrap_export(fmt, chunks)),
+            mimetype=mark_transfer.EXPORT_MIMETYPES[fmt],
+            headers={'Content-Disposition': f'attachment; filename=marks.{fmt}'}
+        )
+
+
+    def geocode_search(self, user_telegram_id):
+        """GET - поиск места: ?q=<адрес или название>&bbox=south,west,north,east"""
+        return self.geocode_response(lambda: {
+            'result': self.first_or_none(self.geocoding.geocode(
+                user_telegram_id, request.args.get('q'), self.parse_optional_bbox()
+            ))
+        })
+
+
+    def geocode_reverse(self, user_telegram_id):
+        """GET - адрес по координатам: ?lat=55.75&lon=37.62"""
+        return self.geocode_response(lambda: {
+            'result': self.first_or_none(self.geocoding.reverse(
+                user_telegram_id, request.args.get('lat', ''), request.args.get('lon', '')
+            ))
+        })
+
+
+    def geocode_suggest(self, user_telegram_id):
+        """GET - подсказки адреса: ?q=<начало запроса>&bbox=south,west,north,east"""
+        return self.geocode_response(lambda: {
+            'suggestions': self.geocoding.suggest(
+                user_telegram_id, request.args.get('q'), self.parse_optional_bbox()
+            )
+        })
+
+
+    def parse_optional_bbox(self):
+        value = request.args.get('bbox')
+        return geo.parse_bbox(value) if value else None
+
+
+    @staticmethod
+    def first_or_none(items):
+        return items[0] if items else None
+
+
+    def geocode_response(self, lookup):
+        """Ответ прокси геокодера: 400 на плохой запрос, 429 по лимиту, 502 при сбое геокодера"""
+        try:
+            return jsonify({'success': True, **lookup()})
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+        except RateLimitExceeded as e:
+            response = jsonify({'success': False, 'message': str(e)})
+            response.status_code = 429
+            response.headers['Retry-After'] = str(max(1, round(e.retry_after)))
+            return response
+        except GeocodingError as e:
+            print(f"❌ {e}")
+            return jsonify({'success': False, 'message': 'Геокодер недоступен'}), 502
+
+
+    def geocode_stats(self):
+        """GET - попадания в кеш геокодера, запросы к геокодеру и отказы по лимиту"""
+        return jsonify({'success': True, 'geocoding': self.geocoding.stats()})
+
+
+    def cache_stats(self):
+        """GET - счетчики попаданий и промахов кеша чтений"""
+        return jsonify({'success': True, 'cache': self.db_manager.cache_stats()})
+
+
+    def pool_stats(self):
+        """GET - метрики connection pool: занятость, ожидание, время выдачи"""
+        return jsonify({'success': True, 'pool': self.db_manager.pool_stats()})
+
+
+    def metrics(self):
+        """GET - метрики в текстовом формате Prometheus"""
+        gauges = []
+        pool = self.db_manager.pool_stats()
+        if pool:
+            for key in ('size', 'in_use', 'idle', 'waiting'):
+                gauges.append((f"db_pool_{key}", {}, pool[key]))
+            for key in ('checkouts', 'timeouts', 'connects', 'discarded'):
+                gauges.append((f"db_pool_{key}_total", {}, pool[key]))
+            gauges.append(('db_pool_wait_seconds_total', {}, pool['wait_time_total_s']))
+        for cache, stats in self.db_manager.cache_stats().items():
+            gauges.append(('cache_size', {'cache': cache}, stats['size']))
+            gauges.append(('cache_hits_total', {'cache': cache}, stats['hits']))
+            gauges.append(('cache_misses_total', {'cache': cache}, stats['misses']))
+        geocoding = self.geocoding.stats()
+        gauges.append(('geocode_upstream_calls_total', {}, geocoding['upstream_calls']))
+        gauges.append(('geocode_db_hits_total', {}, geocoding['db_hits']))
+        gauges.append(('geocode_coalesced_total', {}, geocoding['coalesced']))
+        gauges.append(('geocode_rate_limited_total', {}, geocoding['rate_limited']))
+        return Response(instrumentation.METRICS.render(gauges), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
     def check_if_admin(self, user_id):
-        with open("static/admins.json", "r") as file:
-            data = json.load(file)
-            if str(user_id) in data.get('admin_ids', []):
-                return True
-        return False
+        return self.admin_registry.is_admin(user_id)
     
 
     def get_current_date(self):
@@ -0,0 +1,26 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app'))
+
+import geo
+
+
+# Разбор bbox из запроса: python -m unittest test_geo
+class ParseBboxTest(unittest.TestCase):
+    def test_bbox(self):
+        self.assertEqual(geo.parse_bbox('55.5,37.3,56,38'), (55.5, 37.3, 56.0, 38.0))
+        # Долгота после прокрутки мира приводится к [-180, 180]
+        self.assertEqual(geo.parse_bbox('10,190,20,200'), (10.0, -170.0, 20.0, -160.0))
+
+    def test_invalid_bbox(self):
+        for value in ('', '1,2,3', '1,2,3,x', '91,0,92,1', '20,0,10,1',
+                      'nan,0,1,1', '0,-inf,1,1', '0,0,1,inf', '0,nan,1,1'):
+            with self.subTest(value=value):
+                with self.assertRaises(ValueError):
+                    geo.parse_bbox(value)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import os
+import sys
+import unittest
+from datetime import date
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app'))
+
+from mark_batch import MarkBatchError, parse_operations
+
+
+# Проверка пакета операций до БД: python -m unittest test_mark_batch
+class ParseOperationsTest(unittest.TestCase):
+    default_date = date(2024, 1, 1)
+
+    def test_valid_batch(self):
+        operations = parse_operations([
+            {'op': 'create', 'ref': 'tmp-1', 'title': ' Дом ', 'lat': '55.75', 'lon': 37.6, 'main_photo': 'p1'},
+            {'op': 'update', 'id': '12', 'title': 'Новое', 'secondary_photos': ['p2', 'p3']},
+            {'op': 'delete', 'id': 13}
+        ], self.default_date)
+
+        create, update, delete = operations
+        self.assertEqual(create['mark'], ('Дом', None, self.default_date, None, 55.75, 37.6))
+        self.assertEqual((create['main_photo'], create['secondary_photos']), ('p1', None))
+        self.assertEqual(update['id'], 12)
+        self.assertEqual(update['fields'], {'title': 'Новое'})
+        self.assertEqual(update['secondary_photos'], ['p2', 'p3'])
+        self.assertEqual((delete['op'], delete['id']), ('delete', 13))
+
+    def test_errors_are_collected_by_index(self):
+        with self.assertRaises(MarkBatchError) as context:
+            parse_operations([
+                {'op': 'create', 'title': 'Ок', 'lat': 1, 'lon': 2},
+                {'op': 'move', 'id': 1},
+                {'op': 'update', 'id': 5, 'lat': 91},
+                {'op': 'update', 'id': 6, 'user_id': 2},
+                {'op': 'delete', 'id': True},
+                {'op': 'delete', 'id': 5},
+                {'op': 'create', 'title': 'Фото', 'lat': 1, 'lon': 2, 'main_photo': 3}
+            ], self.default_date)
+        self.assertEqual([error['index'] for error in context.exception.errors], [1, 2, 3, 4, 6])
+
+    def test_duplicate_mark(self):
+        with self.assertRaises(MarkBatchError) as context:
+            parse_operations([{'op': 'update', 'id': 5, 'title': 'a'}, {'op': 'delete', 'id': '5'}], self.default_date)
+        self.assertEqual([error['index'] for error in context.exception.errors], [1])
+
+    def test_batch_size(self):
+        for raw in (None, [], {'op': 'delete', 'id': 1}):
+            with self.subTest(raw=raw):
+                with self.assertRaises(MarkBatchError):
+                    parse_operations(raw, self.default_date)
+        with self.assertRaises(MarkBatchError):
+            parse_operations([{'op': 'delete', 'id': i} for i in range(3)], self.default_date, max_operations=2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import io
+import os
+import sys
+import tracemalloc
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app'))
+
+import mark_transfer
+
+
+def gpx(body):
+    return io.BytesIO(
+        f'<?xml version="1.0"?><gpx version="1.1" xmlns="http://www.topografix.com/GPX/1/1">{body}</gpx>'.encode('utf-8')
+    )
+
+
+def track(points):
+    return '<trk><name>Трек</name><trkseg>' + ''.join(
+        f'<trkpt lat="55.{i:05d}" lon="37.{i:05d}"><ele>150</ele><time>2024-01-01T00:00:00Z</time></trkpt>'
+        for i in range(points)
+    ) + '</trkseg></trk>'
+
+
+# Потоковый разбор файлов импорта: python -m unittest test_mark_transfer
+class IterGpxTest(unittest.TestCase):
+    def test_waypoints_between_tracks(self):
+        marks = list(mark_transfer.iter_gpx(gpx(
+            '<wpt lat="55.7" lon="37.6"><name>Дом</name><time>2024-05-01T10:00:00Z</time>'
+            '<link href="https://example.com"><text>сайт</text></link></wpt>'
+            + track(3) +
+            '<wpt lat="-1.5" lon="2"><name>Пляж</name><cmt>коммент</cmt></wpt>'
+        )))
+        self.assertEqual(marks, [
+            (1, {'title': 'Дом', 'description': None, 'visit_date': '2024-05-01T10:00:00Z',
+                 'address': None, 'lat': '55.7', 'lon': '37.6'}),
+            (2, {'title': 'Пляж', 'description': 'коммент', 'visit_date': None,
+                 'address': None, 'lat': '-1.5', 'lon': '2'})
+        ])
+
+    def test_track_points_are_not_kept(self):
+        stream = gpx(track(20000) + '<wpt lat="1" lon="2"><name>A</name></wpt>')
+        tracemalloc.start()
+        try:
+            marks = list(mark_transfer.iter_gpx(stream))
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        self.assertEqual(len(marks), 1)
+        # Все дерево трека - десятки мегабайт, потоковый разбор - единицы
+        self.assertLess(peak, 5 * 1024 * 1024)
+
+    def test_broken_file(self):
+        report = {'skipped': 0, 'errors': []}
+        with self.assertRaises(mark_transfer.MarkImportError):
+            list(mark_transfer.iter_valid_marks(gpx('<wpt lat="1" lon="2">'), 'gpx', report))
+
+
+if __name__ == '__main__':
+    unittest.main()
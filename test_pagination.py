@@ -0,0 +1,52 @@
+import os
+import sys
+import unittest
+from datetime import date, datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app'))
+
+import pagination
+
+
+# Параметры списка меток: python -m unittest test_pagination
+class PaginationTest(unittest.TestCase):
+    def test_cursor_roundtrip(self):
+        cursor = pagination.encode_cursor(date(2024, 5, 1), datetime(2024, 5, 2, 10, 30, 15, 123456), 42)
+        self.assertNotIn('=', cursor)
+        self.assertEqual(
+            pagination.decode_cursor(cursor),
+            (date(2024, 5, 1), datetime(2024, 5, 2, 10, 30, 15, 123456), 42)
+        )
+        self.assertIsNone(pagination.decode_cursor(''))
+
+    def test_broken_cursor(self):
+        for value in ('!!!', 'e30', pagination.encode_search_cursor(1.5, 3)):
+            with self.subTest(value=value):
+                with self.assertRaises(ValueError):
+                    pagination.decode_cursor(value)
+
+    def test_search_cursor_roundtrip(self):
+        cursor = pagination.encode_search_cursor(0.25, 7)
+        self.assertEqual(pagination.decode_search_cursor(cursor), (0.25, 7))
+
+    def test_fields_are_canonical(self):
+        self.assertEqual(pagination.parse_fields('lon, lat,id'), ('id', 'lat', 'lon'))
+        self.assertEqual(pagination.parse_fields('id,lat,lon'), pagination.parse_fields('lat,lon,id,lat'))
+        self.assertIsNone(pagination.parse_fields(''))
+        self.assertIsNone(pagination.parse_fields(' , '))
+        with self.assertRaisesRegex(ValueError, 'a, b'):
+            pagination.parse_fields('id,b,a')
+
+    def test_limit(self):
+        self.assertIsNone(pagination.parse_limit(None))
+        self.assertEqual(pagination.parse_limit('', cursor='x'), pagination.DEFAULT_PAGE_SIZE)
+        self.assertEqual(pagination.parse_limit('10'), 10)
+        self.assertEqual(pagination.parse_limit('100000'), pagination.MAX_PAGE_SIZE)
+        for value in ('0', '-1', 'abc'):
+            with self.subTest(value=value):
+                with self.assertRaises(ValueError):
+                    pagination.parse_limit(value)
+
+
+if __name__ == '__main__':
+    unittest.main()
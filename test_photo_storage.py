@@ -0,0 +1,197 @@
+import hashlib
+import io
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import types
+import unittest
+import uuid
+from datetime import datetime, timezone
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app'))
+
+from photo_storage import LocalPhotoStorage, S3PhotoStorage, parse_range
+from uploads import HashingUploadFile
+
+
+# Хранилище фото без сервера: python -m unittest test_photo_storage
+class ParseRangeTest(unittest.TestCase):
+    def test_full_and_open_ranges(self):
+        self.assertEqual(parse_range('bytes=0-99', 1000), (0, 99))
+        self.assertEqual(parse_range('bytes=500-', 1000), (500, 999))
+        self.assertEqual(parse_range('bytes=-100', 1000), (900, 999))
+
+    def test_end_is_clamped_to_size(self):
+        self.assertEqual(parse_range('bytes=900-5000', 1000), (900, 999))
+        self.assertEqual(parse_range('bytes=-5000', 1000), (0, 999))
+
+    def test_unsupported_ranges_return_whole_file(self):
+        for header in (None, '', 'items=0-1', 'bytes=0-1,5-6', 'bytes=a-b', 'bytes=5-1', 'bytes=1000-'):
+            with self.subTest(header=header):
+                self.assertIsNone(parse_range(header, 1000))
+
+
+
+class LocalPhotoStorageTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.addCleanup(self.folder.cleanup)
+        self.storage = LocalPhotoStorage(self.folder.name)
+
+    def assertReadableByOthers(self, key):
+        # Фото отдает и nginx (X-Sendfile) от другого пользователя
+        mode = stat.S_IMODE(os.stat(self.storage.local_path(key)).st_mode)
+        self.assertEqual(mode, 0o644)
+
+    def test_put(self):
+        self.storage.put('a.jpg', io.BytesIO(b'photo'))
+        self.assertReadableByOthers('a.jpg')
+        with self.storage.open('a.jpg', 2) as file:
+            self.assertEqual(file.read(), b'oto')
+
+    def test_stored_upload(self):
+        upload = HashingUploadFile(self.folder.name, self.storage)
+        upload.write(b'photo')
+        filename = upload.store('.jpg')
+        self.assertTrue(upload.stored)
+        self.assertReadableByOthers(filename)
+        self.assertEqual(self.storage.stat(filename).size, 5)
+        self.assertEqual(list(self.storage.iter_keys()), [filename])
+
+
+
+class FakeClientError(Exception):
+    def __init__(self, code):
+        super().__init__(code)
+        self.response = {'Error': {'Code': code}}
+
+
+# Клиент S3 в памяти с теми же вызовами boto3, что использует S3PhotoStorage:
+# драйвер проверяется без сети, MinIO и пакета boto3
+class FakeS3Client:
+    def __init__(self):
+        self.objects = {}
+
+    def _object(self, bucket, key, missing_code):
+        if (bucket, key) not in self.objects:
+            raise FakeClientError(missing_code)
+        return self.objects[(bucket, key)]
+
+    def upload_fileobj(self, fileobj, bucket, key):
+        self.objects[(bucket, key)] = (fileobj.read(), datetime.now(timezone.utc))
+
+    def upload_file(self, path, bucket, key):
+        with open(path, 'rb') as file:
+            self.upload_fileobj(file, bucket, key)
+
+    def get_object(self, Bucket, Key, Range=None):
+        data, _ = self._object(Bucket, Key, 'NoSuchKey')
+        if Range:
+            start, _, end = Range[len('bytes='):].partition('-')
+            data = data[int(start):int(end) + 1 if end else None]
+        return {'Body': io.BytesIO(data)}
+
+    def head_object(self, Bucket, Key):
+        # HEAD без тела: вместо NoSuchKey просто 404
+        data, modified = self._object(Bucket, Key, '404')
+        return {'ContentLength': len(data), 'LastModified': modified, 'ETag': f'"{hashlib.md5(data).hexdigest()}"'}
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop((Bucket, Key), None)
+
+    def get_paginator(self, operation):
+        objects = self.objects
+
+        class Paginator:
+            def paginate(self, Bucket, Prefix):
+                yield {'Contents': [
+                    {'Key': key} for bucket, key in sorted(objects) if bucket == Bucket and key.startswith(Prefix)
+                ]}
+
+        return Paginator()
+
+
+def create_fake_s3_storage(prefix='photos'):
+    """S3PhotoStorage поверх FakeS3Client вместо boto3"""
+    client = FakeS3Client()
+    modules = {
+        'boto3': types.SimpleNamespace(client=lambda *args, **kwargs: client),
+        'botocore': types.ModuleType('botocore'),
+        'botocore.exceptions': types.SimpleNamespace(ClientError=FakeClientError)
+    }
+    with mock.patch.dict(sys.modules, modules):
+        return S3PhotoStorage('test-bucket', prefix=prefix)
+
+
+class S3PhotoStorageChecks:
+    def create_storage(self):
+        raise NotImplementedError
+
+    def setUp(self):
+        self.storage = self.create_storage()
+        self.addCleanup(self.cleanup)
+
+    def cleanup(self):
+        for key in list(self.storage.iter_keys()):
+            self.storage.delete(key)
+
+    def test_put_stat_open_delete(self):
+        self.storage.put('a.jpg', io.BytesIO(b'0123456789'))
+        photo_stat = self.storage.stat('a.jpg')
+        self.assertEqual(photo_stat.size, 10)
+        self.assertEqual(photo_stat.etag, hashlib.md5(b'0123456789').hexdigest())
+        self.assertTrue(self.storage.exists('a.jpg'))
+        self.assertEqual(self.storage.open('a.jpg').read(), b'0123456789')
+        self.assertEqual(self.storage.open('a.jpg', 2, 5).read(), b'2345')
+        self.assertEqual(self.storage.open('a.jpg', 7).read(), b'789')
+
+        self.storage.delete('a.jpg')
+        self.assertIsNone(self.storage.stat('a.jpg'))
+        self.assertFalse(self.storage.exists('a.jpg'))
+        with self.assertRaises(FileNotFoundError):
+            self.storage.open('a.jpg')
+        # Повторное удаление не падает
+        self.storage.delete('a.jpg')
+
+    def test_put_file_removes_local_file(self):
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        path = os.path.join(folder, '.upload-1')
+        with open(path, 'wb') as file:
+            file.write(b'photo')
+        self.storage.put_file('b.jpg', path)
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(self.storage.open('b.jpg').read(), b'photo')
+        self.assertEqual(list(self.storage.iter_keys()), ['b.jpg'])
+
+    def test_invalid_key(self):
+        with self.assertRaises(ValueError):
+            self.storage.stat('../a.jpg')
+
+
+class FakeS3PhotoStorageTest(S3PhotoStorageChecks, unittest.TestCase):
+    def create_storage(self):
+        return create_fake_s3_storage()
+
+
+# Те же проверки на настоящем S3-совместимом сервере, например локальном MinIO:
+# S3_TEST_ENDPOINT_URL=http://localhost:9000 S3_TEST_BUCKET=... python -m unittest test_photo_storage
+@unittest.skipUnless(os.getenv('S3_TEST_ENDPOINT_URL'), "S3_TEST_ENDPOINT_URL не задан")
+class MinioPhotoStorageTest(S3PhotoStorageChecks, unittest.TestCase):
+    def create_storage(self):
+        return S3PhotoStorage(
+            bucket=os.getenv('S3_TEST_BUCKET', 'bilodelo-test'),
+            # Свой префикс на запуск: чужие объекты бакета не трогаем
+            prefix=f"test-{uuid.uuid4().hex}",
+            endpoint_url=os.getenv('S3_TEST_ENDPOINT_URL'),
+            region=os.getenv('S3_REGION') or None,
+            access_key=os.getenv('S3_ACCESS_KEY') or None,
+            secret_key=os.getenv('S3_SECRET_KEY') or None
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
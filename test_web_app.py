@@ -0,0 +1,264 @@
+import io
+import os
+import sys
+import tempfile
+import unittest
+from contextlib import contextmanager
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app'))
+
+web_app = None
+asgi_app = None
+WORK_DIR = tempfile.TemporaryDirectory()
+START_DIR = os.getcwd()
+
+
+def setUpModule():
+    global web_app, asgi_app
+    # web_app при импорте создает папку upload в текущей директории
+    os.chdir(WORK_DIR.name)
+    import web_app
+    import asgi_app
+
+
+def tearDownModule():
+    os.chdir(START_DIR)
+    WORK_DIR.cleanup()
+
+
+# Вместо Postgres - данные одного пользователя в памяти: проверяются
+# маршруты Flask, ETag, сжатие и форма ответов, а не SQL
+class FakeDatabaseManager:
+    def __init__(self):
+        self.version = 7
+        # change_seq - версия, в которой метка менялась последний раз
+        self.marks = [
+            {'id': mark_id, 'title': f'Метка {mark_id} ' + 'x' * 40, 'lat': 55.75, 'lon': 37.62,
+             'change_seq': min(mark_id, self.version)}
+            for mark_id in range(1, 61)
+        ]
+        self.tombstones = {}
+        self.loads = 0
+
+    def change_mark(self, mark_id, **fields):
+        self.version += 1
+        for mark in self.marks:
+            if mark['id'] == mark_id:
+                mark.update(fields, change_seq=self.version)
+
+    def remove_mark(self, mark_id):
+        self.version += 1
+        self.marks = [mark for mark in self.marks if mark['id'] != mark_id]
+        self.tombstones[mark_id] = self.version
+
+    def init_pool(self):
+        return True
+
+    def check_extensions(self):
+        pass
+
+    def get_role_telegram_ids(self, role):
+        return []
+
+    def get_user_by_telegram_id(self, telegram_id, cursor=None):
+        return {'id': 1, 'telegram_id': telegram_id}
+
+    def get_marks_version(self, user_id):
+        return self.version
+
+    def get_user_marks_page(self, user_id, fields=None, limit=None, after=None):
+        self.loads += 1
+        return self.marks, None
+
+    def get_mark_changes(self, user_id, since, fields=None, limit=None):
+        self.loads += 1
+        fields = ('id',) + tuple(field for field in fields or ('title', 'lat', 'lon') if field != 'id')
+        changed = sorted((mark for mark in self.marks if mark['change_seq'] > since), key=lambda mark: mark['change_seq'])
+        if limit and len(changed) > limit:
+            return None
+        deleted = sorted(mark_id for mark_id, seq in self.tombstones.items() if seq > since)
+        return [{field: mark[field] for field in fields} for mark in changed], deleted
+
+
+@contextmanager
+def app_environment(db_manager):
+    env = {'DB_BOOTSTRAP': '0', 'PHOTO_GC_ENABLED': '0', 'PHOTO_STORAGE': 'local', 'GEOCODER': 'stub', 'BOT_MODE': 'polling'}
+    with mock.patch.dict(os.environ, env), \
+            mock.patch.object(web_app, 'CachedDatabaseManager', lambda: db_manager):
+        yield
+
+
+def create_web_app(db_manager):
+    with app_environment(db_manager):
+        return web_app.WebApplication()
+
+
+def create_async_app(db_manager):
+    # Пул asyncpg создается в lifespan, TestClient без with его не запускает
+    with app_environment(db_manager):
+        return asgi_app.AsyncWebApplication()
+
+
+class WebAppTestCase(unittest.TestCase):
+    def setUp(self):
+        self.db_manager = FakeDatabaseManager()
+        self.client = create_web_app(self.db_manager).app.test_client()
+
+    def revalidate(self, url, **headers):
+        first = self.client.get(url, headers=headers)
+        self.assertEqual(first.status_code, 200)
+        second = self.client.get(url, headers={**headers, 'If-None-Match': first.headers['ETag']})
+        return first, second
+
+
+class MarksRevalidationTest(WebAppTestCase):
+    def test_not_modified_without_compression(self):
+        first, second = self.revalidate('/api/get_marks/100')
+        self.assertNotIn('Content-Encoding', first.headers)
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(self.db_manager.loads, 1)
+
+    def test_not_modified_with_gzip(self):
+        first, second = self.revalidate('/api/get_marks/100', **{'Accept-Encoding': 'gzip'})
+        self.assertEqual(first.headers['Content-Encoding'], 'gzip')
+        self.assertTrue(first.headers['ETag'].startswith('W/'))
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(self.db_manager.loads, 1)
+
+    def test_new_version_is_sent_again(self):
+        first = self.client.get('/api/get_marks/100', headers={'Accept-Encoding': 'gzip'})
+        self.db_manager.version += 1
+        second = self.client.get('/api/get_marks/100', headers={
+            'Accept-Encoding': 'gzip',
+            'If-None-Match': first.headers['ETag']
+        })
+        self.assertEqual(second.status_code, 200)
+        self.assertNotEqual(second.headers['ETag'], first.headers['ETag'])
+        self.assertEqual(self.db_manager.loads, 2)
+
+
+class MarkChangesTest(WebAppTestCase):
+    def test_changes_since_version(self):
+        self.db_manager.change_mark(3, title='Новое название')
+        self.db_manager.remove_mark(5)
+        body = self.client.get('/api/marks/changes/100?since=7').get_json()
+        self.assertEqual(body, {
+            'success': True,
+            'reset': False,
+            'changed': [{'id': 3, 'title': 'Новое название', 'lat': 55.75, 'lon': 37.62}],
+            'deleted': [5],
+            'version': 9
+        })
+
+    def test_deleted_only(self):
+        self.db_manager.remove_mark(1)
+        self.db_manager.remove_mark(2)
+        body = self.client.get('/api/marks/changes/100?since=7&fields=title').get_json()
+        self.assertEqual((body['changed'], body['deleted'], body['version']), ([], [1, 2], 9))
+
+        # Удаление после since, но не после версии клиента - уже учтено
+        body = self.client.get('/api/marks/changes/100?since=8').get_json()
+        self.assertEqual(body['deleted'], [2])
+
+    def test_fields(self):
+        self.db_manager.change_mark(4)
+        body = self.client.get('/api/marks/changes/100?since=7&fields=lat,title').get_json()
+        self.assertEqual(body['changed'], [{'id': 4, 'title': self.db_manager.marks[3]['title'], 'lat': 55.75}])
+
+    def test_reset(self):
+        # Версия клиента новее серверной - только полная загрузка
+        body = self.client.get('/api/marks/changes/100?since=50').get_json()
+        self.assertEqual(body, {'success': True, 'reset': True, 'version': 7})
+
+        with mock.patch.object(web_app.pagination, 'MAX_CHANGES', 10):
+            body = self.client.get('/api/marks/changes/100?since=0').get_json()
+        self.assertEqual(body, {'success': True, 'reset': True, 'version': 7})
+
+    def test_invalid_params(self):
+        for query in ('since=-1', 'since=abc', 'since=1&fields=password'):
+            with self.subTest(query=query):
+                response = self.client.get(f'/api/marks/changes/100?{query}')
+                self.assertEqual(response.status_code, 400)
+                self.assertFalse(response.get_json()['success'])
+
+    def test_not_modified_without_compression(self):
+        first, second = self.revalidate('/api/marks/changes/100?since=0')
+        self.assertNotIn('Content-Encoding', first.headers)
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(self.db_manager.loads, 1)
+
+    def test_not_modified_with_gzip(self):
+        first, second = self.revalidate('/api/marks/changes/100?since=0', **{'Accept-Encoding': 'gzip'})
+        self.assertEqual(first.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(self.db_manager.loads, 1)
+
+    def test_change_invalidates_etag(self):
+        first = self.client.get('/api/marks/changes/100?since=7')
+        self.db_manager.remove_mark(6)
+        second = self.client.get('/api/marks/changes/100?since=7', headers={'If-None-Match': first.headers['ETag']})
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.get_json()['deleted'], [6])
+
+
+# Фото из удаленного хранилища (S3) отдаются потоком с поддержкой Range
+class RemotePhotoTest(unittest.TestCase):
+    data = b'0123456789'
+
+    def setUp(self):
+        from test_photo_storage import create_fake_s3_storage
+        self.storage = create_fake_s3_storage()
+        self.storage.put('a.jpg', io.BytesIO(self.data))
+
+    def flask_client(self):
+        application = create_web_app(FakeDatabaseManager())
+        application.photo_storage = self.storage
+        return application.app.test_client()
+
+    def asgi_client(self):
+        from starlette.testclient import TestClient
+        application = create_async_app(FakeDatabaseManager())
+        application.photo_storage = self.storage
+        return TestClient(application.app)
+
+    def check_photo(self, client):
+        response = client.get('/upload/a.jpg', headers={'Range': 'bytes=2-5'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.headers['Content-Range'], 'bytes 2-5/10')
+        self.assertEqual(response.headers['Content-Length'], '4')
+        self.assertEqual(response.headers['Content-Type'], 'image/jpeg')
+        self.assertEqual(response.headers['Accept-Ranges'], 'bytes')
+
+        full = client.get('/upload/a.jpg')
+        self.assertEqual(full.status_code, 200)
+        self.assertIn('Last-Modified', full.headers)
+
+        cached = client.get('/upload/a.jpg', headers={'If-None-Match': full.headers['ETag']})
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(client.get('/upload/b.jpg').status_code, 404)
+        return response, full
+
+    def test_flask(self):
+        response, full = self.check_photo(self.flask_client())
+        self.assertEqual(response.get_data(), b'2345')
+        self.assertEqual(full.get_data(), self.data)
+
+    def test_asgi(self):
+        response, full = self.check_photo(self.asgi_client())
+        self.assertEqual(response.content, b'2345')
+        self.assertEqual(full.content, self.data)
+
+
+class EtagMatchesTest(unittest.TestCase):
+    def test_weak_comparison(self):
+        from response_layer import etag_matches
+        self.assertTrue(etag_matches('W/"abc"', '"abc"'))
+        self.assertTrue(etag_matches('"x", "abc"', 'W/"abc"'))
+        self.assertTrue(etag_matches('*', '"abc"'))
+        self.assertFalse(etag_matches('"abd"', '"abc"'))
+        self.assertFalse(etag_matches(None, '"abc"'))
+
+
+if __name__ == '__main__':
+    unittest.main()